@@ -0,0 +1,49 @@
+"""gunicorn settings for running the backend.
+
+Sets up a directory for prometheus_client's multiprocess mode so the
+metrics end-point can aggregate metrics across all the workers.
+
+Requests are handled by gevent workers, as answer event streams stay
+open for as long as mentors' dashboards do and would each pin a sync
+worker.  WORKER_CLASS=sync switches back to sync workers.
+"""
+#pylint: disable=C0103
+
+
+import os
+import shutil
+import tempfile
+
+
+MULTIPROC_DIR_VAR = 'prometheus_multiproc_dir'
+
+# This must be set before the workers import prometheus_client.
+if not os.environ.get(MULTIPROC_DIR_VAR):
+    os.environ[MULTIPROC_DIR_VAR] = tempfile.mkdtemp(prefix='parklab-metrics')
+
+worker_class = os.environ.get('WORKER_CLASS', 'gevent')
+# The most requests, open event streams included, a gevent worker
+# handles at once.
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+
+
+def on_starting(_):
+    """Clear out metrics left over from a previous run."""
+    multiproc_dir = os.environ[MULTIPROC_DIR_VAR]
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir)
+
+
+def worker_exit(_, worker):
+    """Let prometheus_client clean up after a dead worker."""
+    import prometheus_client.multiprocess
+    prometheus_client.multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(_, __):
+    """Make psycopg2 wait on the database cooperatively in gevent
+    workers, rather than blocking every request in the worker.
+    """
+    if worker_class == 'gevent':
+        import psycogreen.gevent
+        psycogreen.gevent.patch_psycopg()
@@ -1,35 +1,54 @@
 """REST backend for the google analytics UI."""
 
 
+import atexit
 import flask
 import flask_babel
 import flask_login
 import flask_restful
-import flask_sqlalchemy
+import flask_restful.representations.json
 import flask_user
 import logging
 
+import backend.common.database as database
+import backend.common.logs as logs
+
 
 app = flask.Flask(__name__)
 app.config.from_object('backend.config')
 api = flask_restful.Api(app)
 babel = flask_babel.Babel(app)
-db = flask_sqlalchemy.SQLAlchemy(app)
+db = database.SQLAlchemy(app)
+app.after_request(database.record_write)
 
 if not app.debug:
     # debug mode defaults to sending errors to stdout/stderr
     # outside debug mode, we still want to print to stdout/stderr
-    # because heroku will capture and log that output
-    app.logger.addHandler(logging.StreamHandler())
+    # because heroku will capture and log that output.
+    # Records go through a queue to a background thread so requests
+    # never wait on stdout, and are written as JSON.
+    log_handler, log_listener = logs.queue_logging(
+            logging.StreamHandler(), app.config['LOG_QUEUE_SIZE'])
+    app.logger.addHandler(log_handler)
     app.logger.setLevel(logging.INFO)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    app.after_request(logs.log_access)
 
 
 # We have to import these after defining app, api and db as these
 # imports will be looking for those variables.
+import backend.changes.views as change_views
 import backend.common.auth as auth
+import backend.common.instrumentation as instrumentation
+import backend.common.metrics as metrics
+import backend.common.profiling as profiling
 import backend.common.response as response
+import backend.common.slow_queries as slow_queries
 import backend.missions.views as mission_views
 import backend.organizations.views as organization_views
+import backend.progress.views as progress_views
+import backend.quest_answers.views as quest_answer_views
 import backend.quests.views as quest_views
 import backend.questions.views as question_views
 import backend.users.models as user_models
@@ -39,6 +58,21 @@ import backend.users.views as user_views
 db_adapter = flask_user.SQLAlchemyAdapter(db, user_models.User)
 flask_user.UserManager(db_adapter, app)
 
+app.before_request(metrics.start_request)
+app.after_request(metrics.record_request)
+app.before_request(profiling.start_profile)
+app.after_request(profiling.tag_response)
+app.teardown_request(profiling.finish_profile)
+instrumentation.add_query_listener(slow_queries.log_slow_query)
+
+
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+    """Encode resource responses as JSON, timing the encoding."""
+    with instrumentation.timed('serialization'):
+        return flask_restful.representations.json.output_json(
+                data, code, headers)
+
 
 @app.route('/')
 def index():
@@ -64,6 +98,18 @@ def logout():
     flask.session.clear()
     return flask.make_response()
 
+@app.route('/internal/metrics')
+@auth.internal_only
+def metrics_exposition():
+    """Report request metrics in Prometheus' text exposition format."""
+    return metrics.exposition()
+
+@app.route('/internal/metrics/db-pool')
+@auth.internal_only
+def db_pool_metrics():
+    """Report on the state of the database connection pools."""
+    return flask.jsonify(db.pool_status())
+
 @app.errorhandler(Exception)
 def other_error(error):
     """Catch any other exception.
@@ -77,14 +123,21 @@ def other_error(error):
 api.add_resource(user_views.User, '/v1/users/<int:user_id>')
 api.add_resource(
         user_views.UserAvatar, '/v1/users/<int:user_id>/avatar/<file_name>')
+api.add_resource(
+        progress_views.UserProgress, '/v1/users/<int:user_id>/progress')
 
 api.add_resource(mission_views.Mission, '/v1/missions/<int:mission_id>')
 api.add_resource(mission_views.MissionList, '/v1/missions')
 api.add_resource(
         mission_views.MissionUserList, '/v1/users/<int:user_id>/missions')
+api.add_resource(
+        mission_views.MissionExport, '/v1/missions/<int:mission_id>/export')
 
 api.add_resource(quest_views.Quest, '/v1/quests/<int:quest_id>')
 api.add_resource(quest_views.QuestList, '/v1/quests')
+api.add_resource(quest_views.QuestImport, '/v1/quest-imports')
+api.add_resource(
+        quest_views.QuestClone, '/v1/quests/<int:quest_id>/clone')
 
 api.add_resource(
         quest_views.QuestStaticAsset,
@@ -112,9 +165,25 @@ api.add_resource(
 api.add_resource(
         question_views.QuestionList,
         '/v1/quests/<int:parent_id>/questions')
+api.add_resource(
+        question_views.QuestionOrder,
+        '/v1/quests/<int:quest_id>/questions/order')
 api.add_resource(
         question_views.QuestionView,
         '/v1/questions/<int:question_id>')
+api.add_resource(
+        quest_answer_views.QuestScore, '/v1/quests/<int:quest_id>/score')
+api.add_resource(
+        quest_answer_views.QuestScores, '/v1/quests/<int:quest_id>/scores')
+api.add_resource(
+        quest_answer_views.QuestAnswerList,
+        '/v1/quests/<int:quest_id>/answers')
+api.add_resource(
+        quest_answer_views.QuestAnswerStats,
+        '/v1/quests/<int:quest_id>/answer-stats')
+api.add_resource(
+        quest_answer_views.QuestAnswerEvents,
+        '/v1/quests/<int:quest_id>/answer-events')
 
 api.add_resource(
         question_views.Answer,
@@ -122,6 +191,9 @@ api.add_resource(
 api.add_resource(
         question_views.AnswerList,
         '/v1/questions/<int:parent_id>/answers')
+api.add_resource(
+        question_views.AnswerStats,
+        '/v1/questions/<int:question_id>/answer-stats')
 
 api.add_resource(
         question_views.MultipleChoice,
@@ -130,11 +202,19 @@ api.add_resource(
 api.add_resource(
         question_views.MultipleChoiceList,
         '/v1/questions/<int:parent_id>/multiple_choices')
+api.add_resource(
+        question_views.MultipleChoiceOrder,
+        '/v1/questions/<int:question_id>/multiple_choices/order')
 
 api.add_resource(
         organization_views.Organization,
         '/v1/organizations/<int:organization_id>')
 api.add_resource(organization_views.OrganizationList, '/v1/organizations')
+api.add_resource(
+        progress_views.Leaderboard, '/v1/leaderboard',
+        '/v1/organizations/<int:organization_id>/leaderboard')
 api.add_resource(
         organization_views.OrganizationUserLink,
         '/v1/organizations/<int:left_id>/users/<int:right_id>')
+
+api.add_resource(change_views.ChangeList, '/v1/changes')
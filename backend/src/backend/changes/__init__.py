@@ -0,0 +1 @@
+"""change feed resources"""
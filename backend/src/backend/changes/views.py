@@ -0,0 +1,79 @@
+"""Views for the feed of changes made to resources."""
+
+
+import flask_restful
+import sqlalchemy
+
+import backend
+import backend.common.database as database
+import backend.common.models as models
+import backend.common.resource as resource
+
+
+def parse_page_size(arg):
+    """Parse the number of changes to return on a page, 1-1000."""
+    limit = int(arg)
+    assert 0 < limit <= ChangeList.max_limit, 'invalid limit'
+    return limit
+
+
+class ChangeList(flask_restful.Resource):
+    """The feed of every create, update, delete, link and unlink made to
+    resources, in order, for caches, search indexers and sync clients to
+    consume incrementally.
+
+    The feed is ordered by the id of the writing transaction and then by
+    seq, and only includes the changes of finished transactions.  A
+    transaction still running when a page is read can only add changes
+    after that page, so consumers never miss changes by paging past
+    them.
+    """
+    default_limit = 100
+    max_limit = 1000
+
+    query_parser = resource.RequestParser()
+    query_parser.add_argument('after', type=int, location='args')
+    query_parser.add_argument(
+            'limit', type=parse_page_size, default=default_limit,
+            location='args')
+
+    view_fields = (
+            'seq', 'action', 'resource_type', 'resource_id', 'related_id')
+
+    def as_dict(self, change):
+        """Return a serializable dictionary representing the change."""
+        resp = {field: getattr(change, field) for field in self.view_fields}
+        resp['changed_at'] = change.changed_at.isoformat()
+        return resp
+
+    @database.read_replica
+    def get(self):
+        """Return the page of changes after the one with the given seq,
+        or from the start of the feed, and the seq to read on from.
+        """
+        args = self.query_parser.parse_args()
+        change = models.Change
+        query = change.query.filter(
+                change.txid < sqlalchemy.func.txid_snapshot_xmin(
+                    sqlalchemy.func.txid_current_snapshot()))
+
+        if args['after'] is not None:
+            last = backend.db.session.query(change.txid).filter(
+                    change.seq == args['after']).scalar()
+            if last is None:
+                # Not a change a consumer could have been sent.
+                flask_restful.abort(
+                        400, message='after must be the seq of a change.')
+            query = query.filter(
+                    sqlalchemy.tuple_(change.txid, change.seq) >
+                    sqlalchemy.tuple_(last, args['after']))
+
+        changes = query.order_by(change.txid, change.seq).limit(
+                args['limit']).all()
+        if changes:
+            after = changes[-1].seq
+        else:
+            after = args['after']
+        return {
+            'changes': [self.as_dict(row) for row in changes],
+            'after': after}
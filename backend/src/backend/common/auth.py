@@ -2,8 +2,32 @@
 
 
 import flask
+import functools
+import hmac
 
 
 def current_user_id():
     """Return the id of the user for whom we are handling a request."""
     return flask.session['user_id']
+
+
+def internal_only(func):
+    """Decorator for internal end-points.  Requests must send the
+    configured INTERNAL_TOKEN in the X-Internal-Token header.  If no
+    token is configured the end-points are only available in debug mode.
+    Other requests get a 404 so as not to advertise the end-point.
+    """
+    @functools.wraps(func)
+    def new_func(*args, **kwargs):
+        """Check the token before calling the end-point."""
+        token = flask.current_app.config.get('INTERNAL_TOKEN')
+        if token is None:
+            allowed = flask.current_app.debug
+        else:
+            allowed = hmac.compare_digest(
+                    str(flask.request.headers.get('X-Internal-Token', '')),
+                    str(token))
+        if not allowed:
+            flask.abort(404)
+        return func(*args, **kwargs)
+    return new_func
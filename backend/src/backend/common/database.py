@@ -0,0 +1,121 @@
+"""Database sessions which route reads to a replica, and engines
+which pool their connections with common.pool.
+
+GET handlers mark the request as read-only with the read_replica
+decorator and the session sends their queries to the 'replica' bind
+from SQLALCHEMY_BINDS.  Flushes and requests which were not marked
+read-only always go to the primary.  After a user writes something,
+their reads stick to the primary for REPLICA_STICKY_SECONDS so they
+don't see stale data while the replica catches up.
+"""
+
+
+import flask
+import flask_sqlalchemy
+import functools
+import sqlalchemy.orm as orm
+import time
+
+import backend.common.pool as pool
+
+
+REPLICA_BIND = 'replica'
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+def replica_configured(app):
+    """Return True if the given app has a read replica configured."""
+    binds = app.config.get('SQLALCHEMY_BINDS') or {}
+    return REPLICA_BIND in binds
+
+
+def should_use_replica():
+    """Return True if reads for the current request should be sent
+    to the replica rather than the primary.
+    """
+    if not flask.has_request_context():
+        return False
+    if not flask.g.get('read_replica', False):
+        return False
+    if not replica_configured(flask.current_app):
+        return False
+
+    last_write = flask.session.get('last_write_at')
+    if last_write is None:
+        return True
+    else:
+        sticky_seconds = flask.current_app.config['REPLICA_STICKY_SECONDS']
+        return time.time() - last_write >= sticky_seconds
+
+
+def read_replica(func):
+    """Decorator for resource methods which only read from the database.
+    Queries made while handling the method may be sent to the replica.
+    """
+    @functools.wraps(func)
+    def new_func(*args, **kwargs):
+        """Flag the request as read-only before calling the method."""
+        flask.g.read_replica = True
+        return func(*args, **kwargs)
+    return new_func
+
+
+def record_write(response):
+    """after_request hook which remembers when the current user last
+    wrote to the database so their following reads go to the primary.
+    """
+    if (flask.request.method in WRITE_METHODS and
+            response.status_code < 400):
+        flask.session['last_write_at'] = time.time()
+    return response
+
+
+class RoutingSession(flask_sqlalchemy._SignallingSession):
+    """Session which picks the replica engine for reads from requests
+    flagged with read_replica and the primary for everything else.
+    """
+    #pylint: disable=W0212,R0904
+
+    def __init__(self, db, *args, **kwargs):
+        self.db = db
+        super(RoutingSession, self).__init__(db, *args, **kwargs)
+
+    def get_bind(self, mapper=None, clause=None):
+        """Return the replica engine if this is a read which may go to
+        the replica, otherwise defer to the usual bind lookup.
+        """
+        if not self._flushing and should_use_replica():
+            return self.db.get_engine(self.app, bind=REPLICA_BIND)
+        else:
+            return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class SQLAlchemy(flask_sqlalchemy.SQLAlchemy):
+    """flask_sqlalchemy extension using RoutingSession for its sessions."""
+
+    def create_scoped_session(self, options=None):
+        """Create a scoped session of RoutingSessions."""
+        if options is None:
+            options = {}
+        scopefunc = options.pop('scopefunc', None)
+        return orm.scoped_session(
+                functools.partial(RoutingSession, self, **options),
+                scopefunc=scopefunc)
+
+    def apply_pool_defaults(self, app, options):
+        """Use our instrumented pool, pinging connections on checkout
+        if SQLALCHEMY_POOL_PRE_PING is set.
+        """
+        super(SQLAlchemy, self).apply_pool_defaults(app, options)
+        options['poolclass'] = pool.InstrumentedQueuePool
+        if app.config.get('SQLALCHEMY_POOL_PRE_PING'):
+            options['pool_events'] = [(pool.ping_connection, 'checkout')]
+
+    def pool_status(self, app=None):
+        """Return a serializable dictionary describing the connection
+        pool of each bind, keyed by bind name.
+        """
+        app = self.get_app(app)
+        binds = [None] + list(app.config.get('SQLALCHEMY_BINDS') or ())
+        return {bind or 'primary': self.get_engine(app, bind).pool.as_dict()
+                for bind in binds}
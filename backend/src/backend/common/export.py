@@ -0,0 +1,76 @@
+"""Streaming exports of query results which may be too big to build up
+in memory.
+
+Rows are read through a server-side cursor a batch at a time and
+written to the client as they are read, so the memory used stays the
+same however many rows are exported.
+"""
+
+
+import csv
+import flask
+import io
+import json
+
+
+YIELD_PER = 1000
+
+
+def stream(query):
+    """Return the results of the ORM query, fetched YIELD_PER rows at a
+    time through a server-side cursor.
+    """
+    return query.execution_options(stream_results=True).yield_per(YIELD_PER)
+
+
+def csv_value(value):
+    """Return the value as a byte string for the csv module."""
+    if value is None:
+        return ''
+    elif isinstance(value, unicode):
+        return value.encode('utf-8')
+    else:
+        return value
+
+
+def csv_line(values):
+    """Return the values as a line of CSV."""
+    line = io.BytesIO()
+    csv.writer(line).writerow([csv_value(value) for value in values])
+    return line.getvalue()
+
+
+def download(file_name, lines, mimetype):
+    """Return a response streaming the lines, an iterable which may be
+    lazy, as a file download.  The request context is kept around until
+    the last line is sent.
+    """
+    return flask.Response(
+            flask.stream_with_context(lines), mimetype=mimetype,
+            headers={'Content-Disposition': (
+                'attachment; filename=%s' % file_name)})
+
+
+def csv_response(file_name, header, rows):
+    """Return a response streaming the header and then the rows as a
+    CSV file download.
+    """
+    def generate():
+        """Yield the file line by line."""
+        yield csv_line(header)
+        for row in rows:
+            yield csv_line(row)
+
+    return download(file_name, generate(), 'text/csv')
+
+
+def ndjson_response(file_name, fields, rows):
+    """Return a response streaming the rows as newline delimited JSON,
+    each row becoming an object keyed by the given field names.
+    """
+    def generate():
+        """Yield the file line by line."""
+        for row in rows:
+            yield json.dumps(dict(zip(fields, row))) + '\n'
+
+    return download(file_name, generate(), 'application/x-ndjson')
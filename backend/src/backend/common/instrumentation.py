@@ -0,0 +1,112 @@
+"""Hooks for measuring where the time goes while handling a request.
+
+Every statement run through a SQLAlchemy engine is timed and counted
+against the current request.  Other code may register query listeners
+to be told about each statement as it finishes, and may time any other
+kind of work with the timed context manager.
+"""
+
+
+import contextlib
+import flask
+import sqlalchemy
+import sqlalchemy.engine
+import time
+import uuid
+
+
+# Functions called as listener(conn, statement, parameters, context,
+# seconds) after every statement executed by any engine.
+QUERY_LISTENERS = []
+
+
+def add_query_listener(listener):
+    """Register a function to be called after each statement executes."""
+    QUERY_LISTENERS.append(listener)
+
+
+def remove_query_listener(listener):
+    """Unregister a function added with add_query_listener."""
+    QUERY_LISTENERS.remove(listener)
+
+
+def request_id():
+    """Return the id of the current request, taken from the X-Request-Id
+    header set by Heroku's router if available.
+    """
+    if 'request_id' not in flask.g:
+        flask.g.request_id = flask.request.headers.get(
+                'X-Request-Id') or uuid.uuid4().hex
+    return flask.g.request_id
+
+
+def resource_name():
+    """Return the name of the flask_restful resource class (or plain view
+    function) handling the current request.
+    """
+    view_func = flask.current_app.view_functions.get(flask.request.endpoint)
+    if view_func is None:
+        return 'unknown'
+    else:
+        view_class = getattr(view_func, 'view_class', view_func)
+        return view_class.__name__
+
+
+def timings():
+    """Return the dictionary of seconds spent on each kind of work in
+    the current request.
+    """
+    if 'timings' not in flask.g:
+        flask.g.timings = {}
+    return flask.g.timings
+
+
+def add_timing(kind, seconds):
+    """Add the given number of seconds to the request's total for kind."""
+    if flask.has_request_context():
+        request_timings = timings()
+        request_timings[kind] = request_timings.get(kind, 0) + seconds
+
+
+@contextlib.contextmanager
+def timed(kind):
+    """Context manager adding the time spent in its block to the
+    request's total for the given kind of work.
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        add_timing(kind, time.time() - start)
+
+
+def query_count():
+    """Return the number of statements executed for the current request."""
+    return flask.g.get('query_count', 0)
+
+
+def before_cursor_execute(_, __, ___, ____, context, _____):
+    """Engine listener noting when a statement started."""
+    #pylint: disable=W0613
+    context.query_start_time = time.time()
+
+
+def after_cursor_execute(conn, _, statement, parameters, context, __):
+    """Engine listener timing the statement and passing it on to the
+    registered query listeners.
+    """
+    #pylint: disable=W0613
+    seconds = time.time() - context.query_start_time
+    if flask.has_request_context():
+        add_timing('db', seconds)
+        flask.g.query_count = query_count() + 1
+    for listener in QUERY_LISTENERS:
+        listener(conn, statement, parameters, context, seconds)
+
+
+sqlalchemy.event.listen(
+        sqlalchemy.engine.Engine, 'before_cursor_execute',
+        before_cursor_execute)
+sqlalchemy.event.listen(
+        sqlalchemy.engine.Engine, 'after_cursor_execute',
+        after_cursor_execute)
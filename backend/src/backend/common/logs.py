@@ -0,0 +1,222 @@
+"""Structured logging which never blocks the request thread.
+
+Log records are formatted as one JSON object per line, carrying the
+request id, route, user id and so on of the request which logged them.
+Records are handed to a QueueListener thread through a bounded queue
+so a slow stdout can't hold up requests; if the queue fills up records
+are dropped and counted rather than waited on.
+
+Under gunicorn's gevent workers the threading module is monkey-patched,
+and a patched thread would be a greenlet writing to stdout on the
+worker's one OS thread, in the way of every request.  The listener and
+its queue use the unpatched thread module instead, so the writes happen
+on a real thread of their own.
+"""
+
+
+import collections
+import datetime
+import flask
+import json
+import logging
+import Queue
+import time
+import traceback
+
+import backend.common.instrumentation as instrumentation
+import backend.common.metrics as metrics
+import backend.common.profiling as profiling
+
+
+# Attributes which may be set on records, through the 'extra' argument
+# to the logging functions or by the RequestContextFilter, and which
+# are included in the JSON output.
+RECORD_FIELDS = (
+        'request_id', 'route', 'method', 'path', 'user_id', 'status',
+        'duration', 'query_count')
+
+access_logger = logging.getLogger('backend.access')
+
+
+class RequestContextFilter(logging.Filter):
+    """Add details of the current request to log records."""
+
+    def filter(self, record):
+        """Annotate the record, never filtering it out."""
+        if flask.has_request_context():
+            record.request_id = instrumentation.request_id()
+            record.route = instrumentation.resource_name()
+            record.method = flask.request.method
+            record.path = flask.request.path
+            record.user_id = flask.session.get('user_id')
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as a single line of JSON."""
+
+    def format(self, record):
+        """Return the record as a JSON string."""
+        log = {
+                'time': datetime.datetime.utcfromtimestamp(
+                    record.created).isoformat() + 'Z',
+                'level': record.levelname,
+                'logger': record.name,
+                'message': record.getMessage()}
+        for field in RECORD_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                log[field] = value
+        if record.exc_info:
+            log['exception'] = self.formatException(record.exc_info)
+        elif getattr(record, 'exc_text', None):
+            log['exception'] = record.exc_text
+        return json.dumps(log, default=str)
+
+
+class QueueHandler(logging.Handler):
+    """Handler which puts records on a bounded queue for a QueueListener
+    to handle, dropping them if the queue is full.
+    """
+
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        self.dropped = 0
+
+    def prepare(self, record):
+        """Render the parts of the record which can't safely be handled
+        later on another thread: the message arguments and traceback.
+        """
+        #pylint: disable=R0201
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = ''.join(
+                    traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        """Queue the record without waiting."""
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1
+            metrics.LOG_RECORDS_DROPPED.inc()
+        except Exception: #pylint: disable=W0703
+            self.handleError(record)
+
+
+class NativeQueue(object):
+    """A bounded queue passing records from requests to a QueueListener,
+    locked with real locks even under gevent.  Only the listener gets
+    from it; requests only put to it without waiting.
+    """
+
+    def __init__(self, max_size):
+        allocate_lock = profiling.original('thread', 'allocate_lock')
+        self.max_size = max_size
+        self.items = collections.deque()
+        self.mutex = allocate_lock()
+        # Released exactly while there are items to get.
+        self.ready = allocate_lock()
+        self.ready.acquire()
+
+    def qsize(self):
+        """Return the number of items waiting."""
+        with self.mutex:
+            return len(self.items)
+
+    def put(self, item):
+        """Add the item to the queue, even if it's full."""
+        with self.mutex:
+            self.items.append(item)
+            if len(self.items) == 1:
+                self.ready.release()
+
+    def put_nowait(self, item):
+        """Add the item to the queue, raising Queue.Full if it's full."""
+        with self.mutex:
+            if len(self.items) >= self.max_size:
+                raise Queue.Full
+            self.items.append(item)
+            if len(self.items) == 1:
+                self.ready.release()
+
+    def get(self):
+        """Remove and return the oldest item, waiting for one if need be."""
+        self.ready.acquire()
+        with self.mutex:
+            item = self.items.popleft()
+            if self.items:
+                self.ready.release()
+        return item
+
+
+class QueueListener(object):
+    """Pass records from a queue to the given handlers on a
+    background thread.
+    """
+    sentinel = None
+
+    def __init__(self, queue, *handlers):
+        self.queue = queue
+        self.handlers = handlers
+        self.finished = None
+
+    def handle(self, record):
+        """Pass a record to each of our handlers."""
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def run(self):
+        """Handle records until the sentinel is seen."""
+        try:
+            while True:
+                record = self.queue.get()
+                if record is self.sentinel:
+                    break
+                self.handle(record)
+        finally:
+            self.finished.release()
+
+    def start(self):
+        """Start handling records on a real thread, which doesn't keep
+        the process alive.
+        """
+        self.finished = profiling.original('thread', 'allocate_lock')()
+        self.finished.acquire()
+        profiling.original('thread', 'start_new_thread')(self.run, ())
+
+    def stop(self):
+        """Handle the records already queued, then stop the thread."""
+        self.queue.put(self.sentinel)
+        self.finished.acquire()
+        self.finished = None
+
+
+def queue_logging(handler, max_size):
+    """Return a (QueueHandler, QueueListener) pair which sends records
+    through a queue of at most max_size records to the given handler,
+    which is set up to write JSON.
+    """
+    queue = NativeQueue(max_size)
+    handler.setFormatter(JSONFormatter())
+    queue_handler = QueueHandler(queue)
+    queue_handler.addFilter(RequestContextFilter())
+    return queue_handler, QueueListener(queue, handler)
+
+
+def log_access(response):
+    """after_request hook writing an access log entry for the request."""
+    start = flask.g.get('request_start_time')
+    duration = None if start is None else round(time.time() - start, 6)
+    access_logger.info(
+            '%s %s %s', flask.request.method, flask.request.path,
+            response.status_code, extra={
+                'status': response.status_code,
+                'duration': duration,
+                'query_count': instrumentation.query_count()})
+    return response
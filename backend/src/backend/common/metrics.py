@@ -0,0 +1,101 @@
+"""Prometheus metrics for requests handled by the app.
+
+Metrics are labeled by the flask_restful resource class handling the
+request.  Under gunicorn each worker is a separate process, so when the
+prometheus_multiproc_dir environment variable names a directory the
+workers write their metrics to memory-mapped files there and the
+metrics end-point aggregates the files of every worker.
+"""
+
+
+import flask
+import os
+import prometheus_client
+import prometheus_client.multiprocess
+import time
+
+import backend.common.instrumentation as instrumentation
+
+
+MULTIPROC_DIR_VAR = 'prometheus_multiproc_dir'
+
+LATENCY_BUCKETS = (
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+LABELS = ('resource', 'method')
+
+REQUESTS = prometheus_client.Counter(
+        'parklab_http_requests_total', 'Requests handled.',
+        LABELS + ('status',))
+LATENCY = prometheus_client.Histogram(
+        'parklab_http_request_seconds', 'Time spent handling requests.',
+        LABELS, buckets=LATENCY_BUCKETS)
+DB_TIME = prometheus_client.Histogram(
+        'parklab_db_seconds', 'Time per request spent running SQL.',
+        LABELS, buckets=LATENCY_BUCKETS)
+S3_TIME = prometheus_client.Histogram(
+        'parklab_s3_seconds', 'Time per request spent calling S3.',
+        LABELS, buckets=LATENCY_BUCKETS)
+SERIALIZATION_TIME = prometheus_client.Histogram(
+        'parklab_serialization_seconds',
+        'Time per request spent encoding the response.',
+        LABELS, buckets=LATENCY_BUCKETS)
+RESPONSE_SIZE = prometheus_client.Histogram(
+        'parklab_response_bytes', 'Size of response bodies.',
+        LABELS, buckets=SIZE_BUCKETS)
+LOG_RECORDS_DROPPED = prometheus_client.Counter(
+        'parklab_log_records_dropped_total',
+        'Log records dropped because the logging queue was full.')
+
+# Metrics observed from the request's instrumentation timings.
+TIMED_METRICS = (
+        ('db', DB_TIME), ('s3', S3_TIME),
+        ('serialization', SERIALIZATION_TIME))
+
+
+def start_request():
+    """before_request hook noting when the request started."""
+    flask.g.request_start_time = time.time()
+
+
+def record_request(response):
+    """after_request hook recording metrics for the finished request."""
+    start = flask.g.get('request_start_time')
+    if start is None:
+        return response
+
+    labels = {
+            'resource': instrumentation.resource_name(),
+            'method': flask.request.method}
+    REQUESTS.labels(status=str(response.status_code), **labels).inc()
+    LATENCY.labels(**labels).observe(time.time() - start)
+
+    request_timings = instrumentation.timings()
+    for kind, metric in TIMED_METRICS:
+        if kind in request_timings:
+            metric.labels(**labels).observe(request_timings[kind])
+
+    if response.content_length is not None:
+        RESPONSE_SIZE.labels(**labels).observe(response.content_length)
+    return response
+
+
+def registry():
+    """Return the registry to collect metrics from, gathering the metrics
+    of every worker process when running in multiprocess mode.
+    """
+    if os.environ.get(MULTIPROC_DIR_VAR):
+        multiproc_registry = prometheus_client.CollectorRegistry()
+        prometheus_client.multiprocess.MultiProcessCollector(
+                multiproc_registry)
+        return multiproc_registry
+    else:
+        return prometheus_client.REGISTRY
+
+
+def exposition():
+    """Return a response with the metrics in Prometheus' text format."""
+    return flask.Response(
+            prometheus_client.generate_latest(registry()),
+            content_type=prometheus_client.CONTENT_TYPE_LATEST)
@@ -1,9 +1,11 @@
 """Common functionality for DB models."""
 
 
+import sqlalchemy
 import sqlalchemy.ext.declarative as declarative
 
 import backend
+import backend.common.custom_types as custom_types
 
 db = backend.db
 
@@ -28,3 +30,162 @@ class CreatedBy(object):
         if self.creator_id is not None:
             return backend.api.url_for(
                     backend.user_views.User, user_id=self.creator_id)
+
+
+def utc_now():
+    """Return the SQL for the start of the current transaction in UTC."""
+    return sqlalchemy.func.timezone('utc', sqlalchemy.func.now())
+
+
+class Timestamps(object):
+    """Mixin to provide created_at and updated_at fields, in UTC, which
+    the database fills in on insert.  updated_at is moved on by every
+    UPDATE issued through SQLAlchemy.
+    """
+
+    @declarative.declared_attr
+    def created_at(_):
+        """The created_at column."""
+        #pylint: disable=E0213,R0201
+        return db.Column(
+                custom_types.UTCDateTime, nullable=False,
+                server_default=sqlalchemy.text("timezone('utc', now())"))
+
+    @declarative.declared_attr
+    def updated_at(_):
+        """The updated_at column."""
+        #pylint: disable=E0213,R0201
+        return db.Column(
+                custom_types.UTCDateTime, nullable=False,
+                server_default=sqlalchemy.text("timezone('utc', now())"),
+                onupdate=utc_now())
+
+
+class Tombstone(db.Model):
+    """A record of a deleted resource, so that clients syncing changes
+    since a given time learn about deletions as well.
+    """
+
+    __tablename__ = 'tombstones'
+
+    id = db.Column(db.Integer, primary_key=True, nullable=False)
+    # The deleted row's table, id, and if it has them the id of its
+    # parent and its creator, which lists of its siblings are scoped by.
+    resource_type = db.Column(db.String, nullable=False)
+    resource_id = db.Column(db.Integer, nullable=False)
+    parent_id = db.Column(db.Integer)
+    creator_id = db.Column(db.Integer)
+    deleted_at = db.Column(
+            custom_types.UTCDateTime, nullable=False,
+            server_default=sqlalchemy.text("timezone('utc', now())"))
+
+db.Index(
+        'ix_tombstones_type_deleted_at',
+        Tombstone.resource_type, Tombstone.deleted_at)
+
+RECORD_DELETIONS = """
+CREATE OR REPLACE FUNCTION record_tombstone()
+  RETURNS trigger
+  LANGUAGE plpgsql
+AS $$
+DECLARE
+  deleted json := to_json(OLD);
+BEGIN
+  INSERT INTO tombstones (resource_type, resource_id, parent_id, creator_id)
+  VALUES (
+    TG_TABLE_NAME, OLD.id,
+    CAST(deleted ->> NULLIF(TG_ARGV[0], '') AS integer),
+    CAST(deleted ->> 'creator_id' AS integer));
+  RETURN NULL;
+END $$;
+
+CREATE TRIGGER {table}_tombstone AFTER DELETE ON {table}
+FOR EACH ROW EXECUTE PROCEDURE record_tombstone('{parent_column}');"""
+
+
+def record_deletions(table, parent_column=''):
+    """Record a tombstone for every row deleted from the table, however
+    it is deleted, including by cascades.  parent_column names the
+    column holding the id of the row's parent, if it has one.
+    """
+    sqlalchemy.event.listen(table, 'after_create', sqlalchemy.DDL(
+        RECORD_DELETIONS.format(
+            table=table.name, parent_column=parent_column)))
+
+
+CHANGE_ACTIONS = ('create', 'update', 'delete', 'link', 'unlink')
+
+
+class Change(db.Model):
+    """An entry in the feed of changes made to resources and the links
+    between them, written in the same transaction as the change.
+    """
+
+    __tablename__ = 'changes'
+
+    seq = db.Column(db.BigInteger, primary_key=True, nullable=False)
+    # The writing transaction's id.  The feed is read in (txid, seq)
+    # order, one transaction's changes after another's.
+    txid = db.Column(
+            db.BigInteger, nullable=False,
+            server_default=sqlalchemy.text('txid_current()'))
+    action = db.Column(
+            db.Enum(*CHANGE_ACTIONS, name='change_actions'), nullable=False)
+    # The changed row's table and id or, for links, the join table and
+    # the ids of the two linked rows.
+    resource_type = db.Column(db.String, nullable=False)
+    resource_id = db.Column(db.Integer, nullable=False)
+    related_id = db.Column(db.Integer)
+    changed_at = db.Column(
+            custom_types.UTCDateTime, nullable=False,
+            server_default=sqlalchemy.text("timezone('utc', now())"))
+
+db.Index('ix_changes_txid_seq', Change.txid, Change.seq)
+
+RECORD_CHANGES = """
+CREATE OR REPLACE FUNCTION record_change()
+  RETURNS trigger
+  LANGUAGE plpgsql
+AS $$
+DECLARE
+  related text := NULLIF(TG_ARGV[1], '');
+  changed json;
+  change_action text;
+BEGIN
+  IF TG_OP = 'DELETE' THEN
+    changed := to_json(OLD);
+  ELSE
+    changed := to_json(NEW);
+  END IF;
+
+  IF TG_OP = 'UPDATE' THEN
+    change_action := 'update';
+  ELSIF related IS NULL THEN
+    change_action := CASE TG_OP WHEN 'INSERT' THEN 'create' ELSE 'delete' END;
+  ELSE
+    change_action := CASE TG_OP WHEN 'INSERT' THEN 'link' ELSE 'unlink' END;
+  END IF;
+
+  INSERT INTO changes (action, resource_type, resource_id, related_id)
+  VALUES (
+    CAST(change_action AS change_actions), TG_TABLE_NAME,
+    CAST(changed ->> TG_ARGV[0] AS integer),
+    CAST(changed ->> related AS integer));
+  RETURN NULL;
+END $$;
+
+CREATE TRIGGER {table}_change AFTER INSERT OR UPDATE OR DELETE ON {table}
+FOR EACH ROW
+EXECUTE PROCEDURE record_change('{id_column}', '{related_column}');"""
+
+
+def record_changes(table, id_column='id', related_column=''):
+    """Record every insert, update and delete of the table's rows in the
+    change feed, however they're made.  For join tables, id_column and
+    related_column name the columns holding the ids of the two linked
+    rows, and inserts and deletes are recorded as links and unlinks.
+    """
+    sqlalchemy.event.listen(table, 'after_create', sqlalchemy.DDL(
+        RECORD_CHANGES.format(
+            table=table.name, id_column=id_column,
+            related_column=related_column)))
@@ -0,0 +1,154 @@
+"""Hand Postgres notifications to the requests waiting on them.
+
+Each worker process keeps one connection LISTENing on a channel, read
+by a background thread, which passes the JSON payload of each
+notification to the queues of the requests subscribed to its key, e.g.
+the event streams of the mentors watching a quest.  Under gunicorn's
+gevent workers the thread and queues are greenlets, so idle subscribers
+cost neither an OS thread nor a database connection each.
+
+Notifications are only delivered while the connection is listening.
+Subscribers are sent RESYNC whenever some may have been missed: after
+the connection is lost, or when they fall too far behind.
+"""
+
+
+import collections
+import json
+import logging
+import psycopg2.extensions
+import Queue
+import select
+import threading
+import time
+
+import backend
+
+
+# Sent to subscribers in place of the events they may have missed.
+RESYNC = {'event': 'resync'}
+
+# The most events queued for a subscriber before it's sent RESYNC.
+MAX_QUEUED = 100
+# Seconds to wait for a notification before checking the connection.
+POLL_SECONDS = 30
+# Seconds to wait before reconnecting after the connection is lost.
+RECONNECT_SECONDS = 5
+# Seconds a new subscriber waits for the connection to be listening.
+LISTEN_TIMEOUT = 5
+
+logger = logging.getLogger(__name__)
+
+
+def put(queue, event):
+    """Queue the event for a subscriber, replacing everything queued
+    with RESYNC if the subscriber has fallen behind.
+    """
+    try:
+        queue.put_nowait(event)
+    except Queue.Full:
+        try:
+            while True:
+                queue.get_nowait()
+        except Queue.Empty:
+            queue.put_nowait(RESYNC)
+
+
+class Listener(object):
+    """Listen on a channel whose payloads are JSON objects, passing each
+    to the subscribers to the value of its key field.
+    """
+
+    def __init__(self, channel, key):
+        self.channel = channel
+        self.key = key
+        self.subscribers = collections.defaultdict(set)
+        self.lock = threading.Lock()
+        self.listening = threading.Event()
+        self.thread = None
+
+    def subscribe(self, key):
+        """Return a queue which will be given the payloads of the
+        notifications for the given key, starting to listen first if
+        this is the process's first subscriber.
+        """
+        queue = Queue.Queue(MAX_QUEUED)
+        with self.lock:
+            self.subscribers[key].add(queue)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+        self.listening.wait(LISTEN_TIMEOUT)
+        return queue
+
+    def unsubscribe(self, key, queue):
+        """Stop passing notifications for the key to the queue."""
+        with self.lock:
+            queues = self.subscribers[key]
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[key]
+
+    def publish(self, key, event):
+        """Pass the event to the subscribers to the given key."""
+        with self.lock:
+            queues = list(self.subscribers.get(key, ()))
+        for queue in queues:
+            put(queue, event)
+
+    def resync(self):
+        """Send every subscriber RESYNC."""
+        with self.lock:
+            queues = [
+                    queue for key_queues in self.subscribers.itervalues() for
+                    queue in key_queues]
+        for queue in queues:
+            put(queue, RESYNC)
+
+    def connect(self):
+        """Return a new connection to the primary database listening on
+        the channel.  It's taken out of the pool for good.
+        """
+        pooled = backend.db.engine.raw_connection()
+        pooled.detach()
+        connection = pooled.connection
+        connection.set_isolation_level(
+                psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        connection.cursor().execute('LISTEN "%s"' % self.channel)
+        return connection
+
+    def receive(self, connection):
+        """Wait for notifications on the connection and publish them.
+        If none come for a while, check the connection still works.
+        """
+        if select.select([connection], [], [], POLL_SECONDS)[0]:
+            connection.poll()
+            while connection.notifies:
+                event = json.loads(connection.notifies.pop(0).payload)
+                self.publish(event[self.key], event)
+        else:
+            connection.cursor().execute('SELECT 1')
+
+    def run(self):
+        """Publish notifications for as long as the process runs,
+        reconnecting whenever the connection is lost.
+        """
+        connection = None
+        while True:
+            try:
+                if connection is None:
+                    connection = self.connect()
+                    self.listening.set()
+                self.receive(connection)
+            except Exception: #pylint: disable=W0703
+                logger.exception('Lost the %s listener', self.channel)
+                self.listening.clear()
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except psycopg2.Error:
+                        pass
+                    connection = None
+                self.resync()
+                time.sleep(RECONNECT_SECONDS)
@@ -0,0 +1,55 @@
+"""Helpers for rows kept in an order chosen by users, e.g. the quests of
+a mission.
+"""
+
+
+import sqlalchemy
+
+import backend
+
+
+def parse_ids(arg):
+    """Parse an ordered list of distinct ids."""
+    assert isinstance(arg, list), 'expected a list of ids'
+    ids = [int(row_id) for row_id in arg]
+    assert len(set(ids)) == len(ids), 'duplicate ids'
+    return ids
+
+
+def set_positions(position_column, key_column, scope_column, scope_id,
+                  positions):
+    """Move rows within the scope, those whose scope_column equals
+    scope_id, to new positions with a single UPDATE ... FROM (VALUES
+    ...) statement.  positions is a list of (key, position) pairs, key
+    being the value of key_column of the row to move.  Rows already in
+    place aren't written to.  Returns the number of rows moved.
+    """
+    if not positions:
+        return 0
+
+    table = position_column.table
+    params = {'scope_id': scope_id}
+    rows = []
+    for index, (key, position) in enumerate(positions):
+        params['key_%d' % index] = key
+        params['position_%d' % index] = position
+        rows.append('(:key_%d, :position_%d)' % (index, index))
+
+    if 'updated_at' in table.c:
+        # Moved rows count as updated for clients syncing changes.
+        touch = ", updated_at = timezone('utc', now())"
+    else:
+        touch = ''
+
+    statement = """
+        UPDATE {table} SET "{position}" = new_positions.position{touch}
+        FROM (VALUES {rows}) AS new_positions (key, position)
+        WHERE {table}."{key}" = new_positions.key
+          AND {table}."{scope}" = :scope_id
+          AND {table}."{position}" IS DISTINCT FROM new_positions.position
+    """.format(
+            table=table.name, position=position_column.name, touch=touch,
+            key=key_column.name, scope=scope_column.name,
+            rows=', '.join(rows))
+    return backend.db.session.execute(
+            sqlalchemy.text(statement), params).rowcount
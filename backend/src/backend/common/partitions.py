@@ -0,0 +1,167 @@
+"""Tables partitioned by month.
+
+Postgres 9.3 has no declarative partitioning, so a partitioned table is
+an empty parent whose rows live in child tables inheriting from it, one
+per month, each with a CHECK constraint on its month's range.  An
+insert trigger routes each row to its month's partition, creating the
+partition the first time the month is seen.  Queries which filter the
+partition column by constants only scan the partitions whose range
+matches, constraint_exclusion being 'partition' by default.
+
+Cold partitions are archived to gzipped CSV files and dropped, leaving
+the recent ones small.  Cold rows of unpartitioned tables can be
+archived the same way, deleting them instead.
+"""
+
+
+import datetime
+import gzip
+import os
+import sqlalchemy
+
+import backend
+
+
+INSERT_TRIGGER = """
+CREATE OR REPLACE FUNCTION {table}_partition_insert()
+  RETURNS trigger
+  LANGUAGE plpgsql
+AS $$
+DECLARE
+  month timestamp := date_trunc('month', NEW.{column});
+  partition text := '{table}_' || to_char(month, 'YYYY_MM');
+BEGIN
+  PERFORM NULL FROM pg_tables
+  WHERE schemaname = current_schema() AND tablename = partition;
+
+  IF NOT FOUND THEN
+    -- Make concurrent first inserts of the month wait for the partition
+    -- to be created by one of them.
+    PERFORM pg_advisory_xact_lock(hashtext(partition));
+    PERFORM NULL FROM pg_tables
+    WHERE schemaname = current_schema() AND tablename = partition;
+
+    IF NOT FOUND THEN
+      EXECUTE format(
+        'CREATE TABLE %%I (LIKE {table} INCLUDING INDEXES, '
+        'CHECK ({column} >= %%L AND {column} < %%L)) INHERITS ({table})',
+        partition, month, month + interval '1 month');
+    END IF;
+  END IF;
+
+  EXECUTE format('INSERT INTO %%I SELECT ($1).*', partition) USING NEW;
+  RETURN NULL;
+END $$;
+
+CREATE TRIGGER {table}_partition BEFORE INSERT ON {table}
+FOR EACH ROW EXECUTE PROCEDURE {table}_partition_insert();"""
+
+DROP_PARTITIONS = """
+DO $$
+DECLARE
+  partition regclass;
+BEGIN
+  FOR partition IN
+    SELECT inhrelid::regclass FROM pg_inherits
+    WHERE inhparent = '{table}'::regclass
+  LOOP
+    EXECUTE format('DROP TABLE %%s', partition);
+  END LOOP;
+END $$;"""
+
+
+def partition_by_month(table, column_name):
+    """Partition the table by the month of the given timestamp column,
+    which must always be filled in, e.g. by a server default.  Indexes
+    defined on the table are copied to each partition.  The trigger
+    leaves nothing in the table for RETURNING to return, so the table
+    needs implicit_returning=False.
+    """
+    sqlalchemy.event.listen(table, 'after_create', sqlalchemy.DDL(
+        INSERT_TRIGGER.format(table=table.name, column=column_name)))
+    # The partitions have to go before the table they inherit from.
+    sqlalchemy.event.listen(table, 'before_drop', sqlalchemy.DDL(
+        DROP_PARTITIONS.format(table=table.name)))
+
+
+def partition_months(table_name):
+    """Return (month, partition name) pairs for the table's partitions,
+    oldest first, month being the date of the month's first day.
+    """
+    names = backend.db.session.execute(sqlalchemy.text("""
+        SELECT child.relname
+        FROM pg_inherits JOIN pg_class AS child ON child.oid = inhrelid
+        WHERE inhparent = CAST(:table AS regclass)"""), {'table': table_name})
+    prefix = table_name + '_'
+    return sorted(
+            (datetime.datetime.strptime(
+                name[len(prefix):], '%Y_%m').date(), name) for
+            (name,) in names.fetchall())
+
+
+def months_before(day, months):
+    """Return the first day of the month the given number of months
+    before the given day's.
+    """
+    month_index = day.year * 12 + day.month - 1 - months
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def write_archive(copy, file_name):
+    """Write the output of the COPY ... TO STDOUT statement to a gzipped
+    file, synced to disk.
+    """
+    cursor = backend.db.session.connection().connection.cursor()
+    with open(file_name, 'wb') as raw_file:
+        with gzip.GzipFile(fileobj=raw_file, mode='wb') as archive:
+            cursor.copy_expert(copy, archive)
+        raw_file.flush()
+        os.fsync(raw_file.fileno())
+
+
+def archive_partition(partition, file_name):
+    """Write the partition's rows to a gzipped CSV file, with a header
+    line, and then drop the partition in the current transaction.  The
+    file is synced to disk before the partition is dropped.
+    """
+    write_archive(
+            'COPY "%s" TO STDOUT WITH CSV HEADER' % partition, file_name)
+    backend.db.session.execute('DROP TABLE "%s"' % partition)
+
+
+def archive_rows(table_name, condition, params, file_name):
+    """Delete the table's rows matching the SQL condition, which may
+    refer to the table by name and take bind parameters, in the current
+    transaction, writing them to a gzipped CSV file with a header line.
+    The rows are deleted before the file is written, so rows coming to
+    match the condition meanwhile can't be deleted unarchived, and if
+    writing fails rolling back restores them.  Return the number of rows
+    archived.
+    """
+    session = backend.db.session
+    session.execute(
+            'CREATE TEMPORARY TABLE archived_rows (LIKE "%s") '
+            'ON COMMIT DROP' % table_name)
+    archived = session.execute(sqlalchemy.text(
+        'WITH deleted AS (DELETE FROM "%s" WHERE %s RETURNING *) '
+        'INSERT INTO archived_rows SELECT * FROM deleted' % (
+            table_name, condition)), params)
+    write_archive('COPY archived_rows TO STDOUT WITH CSV HEADER', file_name)
+    session.execute('DROP TABLE archived_rows')
+    return archived.rowcount
+
+
+def archive_before(table_name, month, directory):
+    """Archive the table's partitions for months before the given one,
+    each to <partition name>.csv.gz in the directory, committing after
+    each.  Return the names of the files written.
+    """
+    file_names = []
+    for partition_month, partition in partition_months(table_name):
+        if partition_month >= month:
+            break
+        file_name = os.path.join(directory, partition + '.csv.gz')
+        archive_partition(partition, file_name)
+        backend.db.session.commit()
+        file_names.append(file_name)
+    return file_names
@@ -0,0 +1,152 @@
+"""Connection pooling with statistics we can report on.
+
+The pool keeps histograms of how long requests wait to get a connection
+and how old connections are when they are checked out, so that the
+number of workers can be sized against Postgres' max_connections.
+"""
+
+
+import bisect
+import logging
+import sqlalchemy.exc as exc
+import sqlalchemy.pool
+import threading
+import time
+
+
+# Upper bounds of the histogram buckets, in seconds.
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+AGE_BUCKETS = (1, 10, 60, 300, 900, 1800, 3600, 7200, 14400, 86400)
+
+
+class Histogram(object):
+    """Count observations in buckets with the given upper bounds.
+    Anything larger than the last bound goes into a final '+Inf' bucket.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Record a single observation."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def as_dict(self):
+        """Return a serializable dictionary of the histogram."""
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+        return {
+                'buckets': dict(zip(bounds, self.counts)),
+                'count': self.count,
+                'sum': self.total}
+
+
+class PoolStats(object):
+    """Statistics gathered by an InstrumentedQueuePool."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wait_seconds = Histogram(WAIT_BUCKETS)
+        self.age_seconds = Histogram(AGE_BUCKETS)
+        self.timeouts = 0
+
+    def observe_wait(self, seconds):
+        """Record the time taken to check out a connection."""
+        with self.lock:
+            self.wait_seconds.observe(seconds)
+
+    def observe_age(self, seconds):
+        """Record the age of a connection being checked out."""
+        with self.lock:
+            self.age_seconds.observe(seconds)
+
+    def observe_timeout(self):
+        """Record a failure to check out a connection in time."""
+        with self.lock:
+            self.timeouts += 1
+
+
+def record_connect(_, connection_record):
+    """Pool 'connect' listener noting when the connection was opened."""
+    connection_record.info['connected_at'] = time.time()
+
+
+def ping_connection(dbapi_connection, _, __):
+    """Pool 'checkout' listener making sure the connection still works
+    before handing it out.  Raising DisconnectionError makes the pool
+    throw the connection away and try again with a fresh one.
+    """
+    #pylint: disable=W0613
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    except Exception:
+        raise exc.DisconnectionError()
+    finally:
+        cursor.close()
+
+
+class InstrumentedQueuePool(sqlalchemy.pool.QueuePool):
+    """QueuePool which records PoolStats about its connections."""
+
+    def __init__(self, *args, **kwargs):
+        super(InstrumentedQueuePool, self).__init__(*args, **kwargs)
+        self.stats = PoolStats()
+        if not self.echo:
+            # SQLAlchemy names pool loggers after the pool's module, which
+            # would put its debug output under the app's own logger.
+            self.logger = logging.getLogger('sqlalchemy.pool.QueuePool')
+
+    def timed_checkout(self, checkout):
+        """Call the given checkout function, recording how long it took
+        and how old the connection it returned is.
+        """
+        start = time.time()
+        try:
+            connection = checkout()
+        except exc.TimeoutError:
+            self.stats.observe_timeout()
+            raise
+        finally:
+            self.stats.observe_wait(time.time() - start)
+
+        connected_at = connection.info.get('connected_at')
+        if connected_at is not None:
+            self.stats.observe_age(time.time() - connected_at)
+        return connection
+
+    def connect(self):
+        """Check out a connection, recording the wait."""
+        return self.timed_checkout(super(InstrumentedQueuePool, self).connect)
+
+    def unique_connection(self):
+        """Check out a connection, recording the wait."""
+        return self.timed_checkout(
+                super(InstrumentedQueuePool, self).unique_connection)
+
+    def recreate(self):
+        """Carry our stats over to the recreated pool."""
+        new_pool = super(InstrumentedQueuePool, self).recreate()
+        new_pool.stats = self.stats
+        return new_pool
+
+    def as_dict(self):
+        """Return a serializable dictionary of the pool's state."""
+        with self.stats.lock:
+            return {
+                    'size': self.size(),
+                    'checked_in': self.checkedin(),
+                    'checked_out': self.checkedout(),
+                    'overflow': self.overflow(),
+                    'max_overflow': self._max_overflow,
+                    'timeouts': self.stats.timeouts,
+                    'wait_seconds': self.stats.wait_seconds.as_dict(),
+                    'connection_age_seconds':
+                        self.stats.age_seconds.as_dict()}
+
+
+sqlalchemy.event.listen(InstrumentedQueuePool, 'connect', record_connect)
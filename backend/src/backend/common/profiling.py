@@ -0,0 +1,217 @@
+"""On-demand profiling of single requests.
+
+A request is profiled if it carries an X-Profile header holding a token
+from make_token, or if its resource is listed in PROFILE_RESOURCES.
+While the request is handled a background thread samples the handling
+thread's stack, so time spent waiting on Postgres or S3 shows up as
+well as time spent in Python.  The samples are written in collapsed
+stack format, ready for flamegraph.pl, to PROFILE_DIR/<profile id>.folded,
+the profile id being the request id if it's safe to use in a file name.
+
+Under gunicorn's gevent workers the thread and time modules are
+monkey-patched, and each request runs in a greenlet sharing its OS
+thread with the worker's other requests.  The sampler then uses the
+unpatched modules to find the OS thread and to sample from a real
+thread of its own, and while the request's greenlet is switched out,
+e.g. waiting on Postgres, samples the frame it's suspended in.
+"""
+
+
+import collections
+import flask
+import importlib
+import itsdangerous
+import os
+import re
+import sys
+import time
+import uuid
+
+import backend.common.instrumentation as instrumentation
+
+
+TOKEN_SALT = 'profile'
+# Request ids which may be used as profile file names.  Request ids can
+# come from the client, so anything else, e.g. '../x', is replaced.
+PROFILE_ID_PATTERN = re.compile(r'^[A-Za-z0-9-]{1,200}$')
+
+
+def signer():
+    """Return the signer used to create and check profiling tokens."""
+    return itsdangerous.TimestampSigner(
+            flask.current_app.config['SECRET_KEY'], salt=TOKEN_SALT)
+
+
+def make_token():
+    """Return a token which enables profiling when sent in the
+    X-Profile header.  Must be called within an app context.
+    """
+    return signer().sign(str(int(time.time())))
+
+
+def valid_token(token):
+    """Return True if the token was made by make_token and has not
+    yet expired.
+    """
+    try:
+        signer().unsign(
+                token, max_age=flask.current_app.config['PROFILE_TOKEN_AGE'])
+    except itsdangerous.BadData:
+        return False
+    else:
+        return True
+
+
+def should_profile():
+    """Return True if the current request should be profiled."""
+    token = flask.request.headers.get('X-Profile')
+    if token is not None and valid_token(str(token)):
+        return True
+    else:
+        return instrumentation.resource_name() in (
+                flask.current_app.config['PROFILE_RESOURCES'])
+
+
+def frame_name(frame):
+    """Return the name of the frame's function used in collapsed stacks."""
+    code = frame.f_code
+    return '%s (%s:%d)' % (
+            code.co_name, os.path.basename(code.co_filename),
+            code.co_firstlineno)
+
+
+def collapse(frame):
+    """Return the stack ending in the given frame in collapsed stack
+    format: function names from the outermost call inwards, joined by
+    semi-colons.
+    """
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame).replace(';', ':'))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def original(module_name, name):
+    """Return the named attribute of a standard library module as it
+    was before gevent's workers monkey-patched it, if they have.
+    """
+    monkey = sys.modules.get('gevent.monkey')
+    if monkey is not None:
+        return monkey.get_original(module_name, name)
+    else:
+        return getattr(importlib.import_module(module_name), name)
+
+
+def current_greenlet():
+    """Return the running greenlet, or None if greenlets aren't in use."""
+    greenlet = sys.modules.get('greenlet')
+    if greenlet is not None:
+        return greenlet.getcurrent()
+    else:
+        return None
+
+
+class Sampler(object):
+    """Sample the stack of a thread, or of a greenlet running in it, at
+    regular intervals from another thread, counting how often each stack
+    is seen.
+    """
+
+    def __init__(self, thread_id, interval, greenlet=None):
+        self.thread_id = thread_id
+        self.greenlet = greenlet
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.running = False
+        self.finished = original('thread', 'allocate_lock')()
+
+    def frame(self):
+        """Return the frame the thread or greenlet is in, or None."""
+        #pylint: disable=W0212
+        if self.greenlet is not None and self.greenlet.gr_frame is not None:
+            # The greenlet is switched out, waiting to run again.
+            return self.greenlet.gr_frame
+        else:
+            return sys._current_frames().get(self.thread_id)
+
+    def run(self):
+        """Take samples until stopped."""
+        sleep = original('time', 'sleep')
+        try:
+            while self.running:
+                sleep(self.interval)
+                frame = self.frame()
+                if frame is not None:
+                    self.stacks[collapse(frame)] += 1
+        finally:
+            self.finished.release()
+
+    def start(self):
+        """Start sampling."""
+        self.running = True
+        self.finished.acquire()
+        original('thread', 'start_new_thread')(self.run, ())
+
+    def stop(self):
+        """Stop sampling and wait for the sampling thread to finish."""
+        self.running = False
+        self.finished.acquire()
+        self.finished.release()
+
+    def collapsed(self):
+        """Return the samples in collapsed stack format."""
+        return ''.join('%s %d\n' % (stack, count) for
+                stack, count in sorted(self.stacks.iteritems()))
+
+
+def profile_id():
+    """Return the id to name the current request's profile by: its
+    request id if that's safe to use in a file name, or else a new one.
+    """
+    request_id = instrumentation.request_id()
+    if PROFILE_ID_PATTERN.match(request_id):
+        return request_id
+    else:
+        return str(uuid.uuid4())
+
+
+def profile_path(file_id):
+    """Return the path of the profile with the given id."""
+    return os.path.join(
+            flask.current_app.config['PROFILE_DIR'],
+            '%s.folded' % file_id)
+
+
+def start_profile():
+    """before_request hook starting the profiler if it was asked for."""
+    if should_profile():
+        flask.g.profile_id = profile_id()
+        flask.g.profiler = Sampler(
+                original('thread', 'get_ident')(),
+                flask.current_app.config['PROFILE_INTERVAL'],
+                current_greenlet())
+        flask.g.profiler.start()
+
+
+def tag_response(response):
+    """after_request hook telling the client which profile to look for."""
+    if flask.g.get('profiler') is not None:
+        response.headers['X-Profile-Id'] = flask.g.profile_id
+    return response
+
+
+def finish_profile(_):
+    """teardown_request hook stopping the profiler and writing out its
+    samples, which runs even if the request failed.
+    """
+    profiler = flask.g.get('profiler')
+    if profiler is not None:
+        flask.g.profiler = None
+        profiler.stop()
+
+        profile_dir = flask.current_app.config['PROFILE_DIR']
+        if not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir)
+        with open(profile_path(flask.g.profile_id), 'w') as out:
+            out.write(profiler.collapsed())
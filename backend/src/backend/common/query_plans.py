@@ -0,0 +1,77 @@
+"""Tools for checking the query plans of the statements we run.
+
+A PlanRecorder hooks into the engine listeners from common.instrumentation
+to remember every statement run while it is active.  Afterwards their
+plans can be searched for sequential scans over large tables, which
+usually mean a missing or unusable index.
+"""
+
+
+import json
+
+import backend.common.instrumentation as instrumentation
+import backend.common.slow_queries as slow_queries
+
+
+class PlanRecorder(object):
+    """Context manager recording the statements executed within it."""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, statement, parameters, context, _):
+        """Query listener remembering the statement."""
+        if not context.executemany:
+            self.statements.append((conn.engine, statement, parameters))
+
+    def __enter__(self):
+        instrumentation.add_query_listener(self)
+        return self
+
+    def __exit__(self, *_):
+        instrumentation.remove_query_listener(self)
+
+    def plans(self):
+        """Return a list of (statement, plan) pairs for the recorded
+        statements, with plans as the parsed output of EXPLAIN's JSON format.
+        """
+        plans = []
+        for engine, statement, parameters in self.statements:
+            rows = slow_queries.explain_rows(
+                    engine, statement, parameters,
+                    options='ANALYZE off, FORMAT JSON')
+            if rows is not None:
+                # psycopg2 decodes json columns itself on newer servers
+                plan = rows[0]
+                if isinstance(plan, basestring):
+                    plan = json.loads(plan)
+                plans.append((statement, plan[0]['Plan']))
+        return plans
+
+
+def plan_nodes(plan):
+    """Yield every node of the given plan tree."""
+    yield plan
+    for child in plan.get('Plans', ()):
+        for node in plan_nodes(child):
+            yield node
+
+
+def table_sizes(engine, tables):
+    """Return a dictionary of the planner's estimated row counts for the
+    given tables.
+    """
+    rows = engine.execute(
+            'SELECT relname, reltuples FROM pg_class '
+            'WHERE relkind = %(kind)s AND relname = ANY(%(tables)s)',
+            {'kind': 'r', 'tables': list(tables)})
+    return {name: int(size) for name, size in rows}
+
+
+def seq_scans(plan, sizes, min_rows):
+    """Return the names of tables in sizes with more than min_rows rows
+    which the given plan reads with a sequential scan.
+    """
+    return [node['Relation Name'] for node in plan_nodes(plan) if
+            node['Node Type'] == 'Seq Scan' and
+            sizes.get(node['Relation Name'], 0) > min_rows]
@@ -10,6 +10,8 @@ import sqlalchemy.orm as orm
 
 import backend
 import backend.common.auth as auth
+import backend.common.database as database
+import backend.common.sync as sync
 
 
 class RequestParser(flask_restful.reqparse.RequestParser):
@@ -50,6 +52,32 @@ class RequestParser(flask_restful.reqparse.RequestParser):
         return super(RequestParser, self).add_argument(*args, **kwargs)
 
 
+class ValuesRequest(object):
+    """Stands in for the request when parsing values which didn't come
+    in a request of their own, e.g. the rows of an import.
+    """
+
+    def __init__(self, values):
+        self.json = values
+        self.values = {}
+
+
+def parse_values(parsers, values):
+    """Parse the dictionary of values with each of the parsers,
+    returning the combined arguments.  Raises an HTTPException, as
+    parse_args does, if the values are invalid.
+    """
+    args = {}
+    for parser in parsers:
+        args.update(parser.parse_args(ValuesRequest(values)))
+    return args
+
+
+def error_message(error):
+    """Return the message an HTTPException would have sent the client."""
+    return getattr(error, 'data', {}).get('message', error.description)
+
+
 class SimpleResource(flask_restful.Resource):
     """Base class defining the simplest common set of CRUD endpoints
     for working with single resources.
@@ -73,6 +101,7 @@ class SimpleResource(flask_restful.Resource):
         """
         raise NotImplementedError
 
+    @database.read_replica
     def get(self, *args, **kwargs):
         """Return a serialization of the resource or a 404."""
         resource = self.query(*args, **kwargs).first()
@@ -88,11 +117,22 @@ class SimpleResource(flask_restful.Resource):
             return flask.Response('', 404)
         else:
             update = self.parser.parse_args()
+            previous = {key: getattr(resource, key) for key in update}
             for key, value in update.iteritems():
                 setattr(resource, key, value)
+            backend.db.session.flush()
+            self.after_update(resource, previous)
             backend.db.session.commit()
             return self.as_dict(resource)
 
+    def after_update(self, resource, previous):
+        """Called once an updated resource has been flushed to the
+        database, in the same transaction, with a dictionary of the
+        updated fields' previous values.  Child classes may override
+        this to keep other tables in step.
+        """
+        pass
+
     def delete(self, *args, **kwargs):
         """Delete a resource."""
         rows_deleted = self.query(*args, **kwargs).delete(
@@ -137,7 +177,8 @@ class ManyToOneLink(flask_restful.Resource):
     resource_type = None
     parent_resource_type = None
     parser = None
-
+    # Loader options for the children when they are synced.
+    child_options = ()
 
     def as_dict(self, resource):
         """Needs to be implemented by child classes.  Given an object,
@@ -168,15 +209,32 @@ class ManyToOneLink(flask_restful.Resource):
         new_resource = self.resource_type(**args) #pylint: disable=E1102
         try:
             backend.db.session.add(new_resource)
-            backend.db.session.commit()
+            backend.db.session.flush()
         except sqlalchemy.exc.IntegrityError:
             # tried to link to a non-existent parent
+            backend.db.session.rollback()
             return flask.Response('', 404)
         else:
+            self.after_create(new_resource)
+            backend.db.session.commit()
             return self.as_dict(new_resource)
 
+    def after_create(self, new_resource):
+        """Called once a new resource has been flushed to the database,
+        in the same transaction.  Child classes may override this to
+        make further changes which depend on the new resource.
+        """
+        pass
+
+    @database.read_replica
     def get(self, parent_id):
-        """Return children linked to a given parent."""
+        """Return children linked to a given parent, or with
+        ?updated_since= those changed since the given time.
+        """
+        since = sync.updated_since()
+        if since is not None:
+            return self.sync(parent_id, since)
+
         parent = self.parent_resource_type.query.filter_by(
                 id=parent_id).options(
                         orm.joinedload(self.child_link_name)).first()
@@ -187,6 +245,25 @@ class ManyToOneLink(flask_restful.Resource):
                 self.as_dict(child) for child in
                 getattr(parent, self.child_link_name)]}
 
+    def sync(self, parent_id, since, *criteria):
+        """Return the children of the given parent, matching any further
+        criteria, changed since the given time and the ids of those
+        deleted since then.
+        """
+        if not self.parent_resource_type.query.filter_by(
+                id=parent_id).count():
+            return flask.Response('', 404)
+        child_type = self.resource_type
+        children = child_type.query.filter(
+                getattr(child_type, self.parent_id_name) == parent_id,
+                child_type.updated_at >= since, *criteria).options(
+                        *self.child_options).order_by(
+                                child_type.updated_at, child_type.id)
+        return sync.changes(
+                self.child_link_name,
+                [self.as_dict(child) for child in children],
+                child_type.__tablename__, since, parent_id=parent_id)
+
 
 class ManyToManyLink(flask_restful.Resource):
     """Resource dealing with many-to-many links between collections."""
@@ -198,16 +275,18 @@ class ManyToManyLink(flask_restful.Resource):
     def put(self, left_id, right_id):
         """Create a link between the two given ids in the join table."""
 
-        insert = self.join_table.insert().values({
-            self.left_id_name: left_id,
-            self.right_id_name: right_id})
+        values = {self.left_id_name: left_id, self.right_id_name: right_id}
+        values.update(self.link_values(left_id, right_id))
+        insert = self.join_table.insert().values(values)
         try:
             backend.db.session.execute(insert)
-            backend.db.session.commit()
         except sqlalchemy.exc.IntegrityError:
             # We hit a unique constraint for this combination
             # of ids, so we happily let the insert fail.
-            pass
+            backend.db.session.rollback()
+        else:
+            self.after_link(left_id, right_id)
+            backend.db.session.commit()
 
     def delete(self, left_id, right_id):
         """Delete a link between the two given ids in the join table."""
@@ -215,7 +294,28 @@ class ManyToManyLink(flask_restful.Resource):
             self.left_id_name == left_id, self.right_id_name == right_id))
 
         res = backend.db.session.execute(delete)
+        if res.rowcount:
+            self.after_unlink(left_id, right_id)
         backend.db.session.commit()
 
         if not res.rowcount:
             return flask.Response('', 404)
+
+    def link_values(self, left_id, right_id):
+        """Return a dictionary of values for any other columns of a new
+        link.  Child classes may override this.
+        """
+        #pylint: disable=R0201,W0613
+        return {}
+
+    def after_link(self, left_id, right_id):
+        """Called in the same transaction after a new link is inserted.
+        Child classes may override this to keep other tables in step.
+        """
+        pass
+
+    def after_unlink(self, left_id, right_id):
+        """Called in the same transaction after a link is deleted.
+        Child classes may override this to keep other tables in step.
+        """
+        pass
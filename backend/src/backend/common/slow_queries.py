@@ -0,0 +1,85 @@
+"""Log statements which take longer than SLOW_QUERY_SECONDS to run.
+
+Each slow statement is logged with its parameters, the resource and
+method whose request ran it, and its query plan.  The plan is fetched
+with EXPLAIN on a separate connection so the slow statement's own
+transaction is left alone.
+"""
+
+
+import flask
+import logging
+
+import backend.common.instrumentation as instrumentation
+
+
+logger = logging.getLogger('backend.slow_queries')
+
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def explain_rows(engine, statement, parameters, options='ANALYZE off'):
+    """Return the rows output by EXPLAIN for the given statement, or
+    None if it can't be explained.  Uses a raw DBAPI connection so that
+    the EXPLAIN doesn't trip our own engine listeners.
+    """
+    if not statement.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    if ';' in statement.strip().rstrip(';'):
+        # Only the first of several statements would be explained; the
+        # rest would actually run.
+        return None
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+                'EXPLAIN (%s) %s' % (options, statement), parameters)
+        rows = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        return rows
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def explain(engine, statement, parameters):
+    """Return the query plan for the given statement as a string, or
+    None if it can't be explained.
+    """
+    rows = explain_rows(engine, statement, parameters)
+    if rows is None:
+        return None
+    else:
+        return '\n'.join(rows)
+
+
+def log_slow_query(conn, statement, parameters, context, seconds):
+    """Query listener logging statements which took too long."""
+    if not flask.has_app_context():
+        return
+    threshold = flask.current_app.config['SLOW_QUERY_SECONDS']
+    if threshold is None or seconds < threshold:
+        return
+
+    if flask.has_request_context():
+        origin = '%s %s' % (
+                flask.request.method, instrumentation.resource_name())
+    else:
+        origin = 'outside of a request'
+
+    if context.executemany:
+        plan = None
+    else:
+        try:
+            plan = explain(conn.engine, statement, parameters)
+        except Exception: #pylint: disable=W0703
+            # Not being able to explain the statement is no reason to
+            # fail the request; e.g. it may use tables which only
+            # exist in its own transaction.
+            logger.info('Could not explain slow query', exc_info=True)
+            plan = None
+
+    logger.warning(
+            'Slow query took %.3fs in %s:\n%s\nparameters: %r\nplan:\n%s',
+            seconds, origin, statement, parameters, plan or 'unavailable')
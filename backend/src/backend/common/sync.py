@@ -0,0 +1,90 @@
+"""Support for clients syncing the changes to lists of resources rather
+than reloading every resource each time.
+
+List end-points given ?updated_since=<ISO 8601 time> only return the
+resources created or updated since then, along with the ids of those
+deleted since then, and the synced_at time to pass as updated_since
+next time.  The first sync may pass any time in the past.
+
+Rows are stamped with the time their writing transaction began, which
+may be before a sync reads them even though they commit after it.
+synced_at is set back by SYNC_OVERLAP to pick those writes up next
+time; clients may be sent the same resources twice as a result.
+"""
+
+
+import aniso8601
+import datetime
+import flask
+import flask_restful
+import pytz
+import sqlalchemy
+
+import backend
+import backend.common.models as models
+
+
+SYNC_OVERLAP = datetime.timedelta(minutes=1)
+
+
+def parse_time(arg):
+    """Parse an ISO 8601 time, taken to be in UTC if it has no offset.
+    A date alone is taken to be midnight at its start.
+    """
+    if 'T' in arg:
+        time = aniso8601.parse_datetime(arg)
+    else:
+        time = datetime.datetime.combine(
+                aniso8601.parse_date(arg), datetime.time())
+    if time.tzinfo is None:
+        return time.replace(tzinfo=pytz.utc)
+    else:
+        return time
+
+
+def updated_since():
+    """Return the time given by the request's updated_since argument, or
+    None if there isn't one.
+    """
+    arg = flask.request.args.get('updated_since')
+    if arg is None:
+        return None
+    try:
+        return parse_time(arg)
+    except ValueError:
+        flask_restful.abort(
+                400, message='updated_since must be an ISO 8601 time.')
+
+
+def deleted_ids(resource_type, since, parent_id=None, creator_id=None):
+    """Return the ids of the rows deleted from the given table since the
+    given time, only those with the given parent or creator if given.
+    """
+    tombstone = models.Tombstone
+    query = backend.db.session.query(tombstone.resource_id).filter(
+            tombstone.resource_type == resource_type,
+            tombstone.deleted_at >= since)
+    if parent_id is not None:
+        query = query.filter(tombstone.parent_id == parent_id)
+    if creator_id is not None:
+        query = query.filter(tombstone.creator_id == creator_id)
+    return [resource_id for (resource_id,) in query.order_by(tombstone.id)]
+
+
+def synced_at():
+    """Return the time the client should sync from next, as a string."""
+    now = backend.db.session.execute(
+            sqlalchemy.select([models.utc_now()])).scalar()
+    return (now.replace(tzinfo=pytz.utc) - SYNC_OVERLAP).isoformat()
+
+
+def changes(link_name, resources, resource_type, since, **scope):
+    """Return the response to a sync: the serialized resources changed
+    since the given time under link_name, the ids of the rows deleted
+    from the resource_type table since then, limited by the parent_id
+    or creator_id given in scope, and the time to sync from next.
+    """
+    return {
+        link_name: resources,
+        'deleted': deleted_ids(resource_type, since, **scope),
+        'synced_at': synced_at()}
@@ -2,13 +2,43 @@
 
 
 import os
+import tempfile
+
+
+def env_int(variable):
+    """Return the named environment variable as an int or None if unset."""
+    value = os.environ.get(variable)
+    return int(value) if value else None
 
 
 AWS_ACCESS_KEY_ID = os.environ['AWS_ACCESS_KEY_ID']
 AWS_SECRET_ACCESS_KEY = os.environ['AWS_SECRET_ACCESS_KEY']
 CLOUDFRONT_URL = os.environ['CLOUDFRONT_URL']
 DEBUG = bool(os.environ.get('DEBUG', False))
+# Shared secret for the /internal end-points, sent as X-Internal-Token.
+INTERNAL_TOKEN = os.environ.get('INTERNAL_TOKEN')
+# Maximum number of log records waiting to be written before we drop them.
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# Requests to these resource classes are always profiled, e.g. "Quest,User"
+PROFILE_RESOURCES = [name for name in
+        os.environ.get('PROFILE_RESOURCES', '').split(',') if name]
+PROFILE_DIR = os.environ.get(
+        'PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'parklab-profiles'))
+# Seconds between stack samples and how long X-Profile tokens last.
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+PROFILE_TOKEN_AGE = int(os.environ.get('PROFILE_TOKEN_AGE', 3600))
 S3_BUCKET = os.environ['S3_BUCKET']
 SECRET_KEY = os.environ['SECRET_KEY']
+# Statements taking longer than this many seconds are logged with their plan.
+SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_SECONDS', 0.25))
 SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URL']
+SQLALCHEMY_BINDS = ({'replica': os.environ['DATABASE_REPLICA_URL']} if
+        os.environ.get('DATABASE_REPLICA_URL') else None)
+SQLALCHEMY_POOL_SIZE = env_int('DATABASE_POOL_SIZE')
+SQLALCHEMY_MAX_OVERFLOW = env_int('DATABASE_MAX_OVERFLOW')
+SQLALCHEMY_POOL_TIMEOUT = env_int('DATABASE_POOL_TIMEOUT')
+SQLALCHEMY_POOL_RECYCLE = env_int('DATABASE_POOL_RECYCLE')
+SQLALCHEMY_POOL_PRE_PING = bool(os.environ.get('DATABASE_POOL_PRE_PING', ''))
+# Seconds after a write during which a user's reads skip the replica.
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
 USER_ENABLE_EMAIL = bool(os.environ.get('USER_ENABLE_EMAIL', True))
@@ -6,7 +6,7 @@ import backend.common.models as models
 db = backend.db
 
 
-class Mission(db.Model, models.CreatedBy):
+class Mission(db.Model, models.CreatedBy, models.Timestamps):
     """Missions are groups of quests.  Mentors chose how to group
     quests into missions and learners complete missions quest by quest.
     """
@@ -23,3 +23,10 @@ class Mission(db.Model, models.CreatedBy):
         """Return the url for the resource."""
         return backend.api.url_for(
                 backend.mission_views.Mission, mission_id=self.id)
+
+# Serves syncing a user's missions with ?updated_since=.
+db.Index(
+        'ix_missions_creator_updated_at',
+        Mission.creator_id, Mission.updated_at)
+models.record_deletions(Mission.__table__)
+models.record_changes(Mission.__table__)
@@ -1,11 +1,19 @@
 """Views for supporting mission resources."""
 
 
+import flask
 import flask_restful
 import sqlalchemy.orm as orm
 
+import backend
+import backend.common.database as database
+import backend.common.export as export
 import backend.common.resource as resource
+import backend.common.sync as sync
 import backend.missions.models as mission_models
+import backend.quests.models as quest_models
+import backend.questions.models as question_models
+import backend.users.models as user_models
 
 
 class MissionBase(object):
@@ -50,9 +58,79 @@ class MissionList(MissionBase, resource.SimpleCreate):
 
 class MissionUserList(MissionBase, flask_restful.Resource):
     """List missions linked to a user."""
+    @database.read_replica
     def get(self, user_id):
-        """Return a list of missions linked to the given user_id."""
-        missions = mission_models.Mission.query.filter_by(
-                creator_id=user_id).all()
-        return {'missions': [self.as_dict(mission) for
-            mission in missions]}
+        """Return a list of missions linked to the given user_id, or with
+        ?updated_since= those changed since the given time.
+        """
+        mission_model = mission_models.Mission
+        query = mission_model.query.filter_by(creator_id=user_id)
+        since = sync.updated_since()
+        if since is None:
+            return {'missions': [self.as_dict(mission) for
+                mission in query.all()]}
+        else:
+            missions = query.filter(
+                    mission_model.updated_at >= since).order_by(
+                            mission_model.updated_at, mission_model.id)
+            return sync.changes(
+                    'missions', [self.as_dict(mission) for
+                        mission in missions],
+                    mission_model.__tablename__, since, creator_id=user_id)
+
+
+class MissionExport(flask_restful.Resource):
+    """Stream a mission's quests, questions and answers for reporting,
+    one row per answer, or per question for unanswered questions.
+    """
+    fields = (
+            'quest_id', 'quest_name', 'question_id', 'question_group',
+            'question_type', 'question_description', 'answer_id',
+            'creator_id', 'creator_name', 'answer_text', 'answer_upload_url',
+            'answer_multiple_choice')
+
+    parser = resource.RequestParser()
+    parser.add_argument(
+            'format', type=str, default='ndjson', choices=('ndjson', 'csv'),
+            location='args')
+
+    @staticmethod
+    def export_query(mission_id):
+        """Return the query for the rows of the export."""
+        mission_quests = quest_models.join_table
+        quest = quest_models.Quest
+        question = question_models.Question
+        answer = question_models.Answer
+        user = user_models.User
+        return backend.db.session.query(
+                quest.id, quest.name, question.id, question.question_group,
+                question.question_type, question.description, answer.id,
+                answer.creator_id, user.name, answer.answer_text,
+                answer.answer_upload_url, answer.answer_multiple_choice
+                ).select_from(mission_quests).join(
+                        quest, quest.id == mission_quests.c.quest_id
+                ).outerjoin(
+                        question, question.quest_id == quest.id
+                ).outerjoin(
+                        answer, answer.question_id == question.id
+                ).outerjoin(
+                        user, user.id == answer.creator_id
+                ).filter(
+                        mission_quests.c.mission_id == mission_id
+                ).order_by(
+                        mission_quests.c.position, quest.id, question.id,
+                        answer.id)
+
+    @database.read_replica
+    def get(self, mission_id):
+        """Stream the export as NDJSON or CSV."""
+        export_format = self.parser.parse_args()['format']
+        if not mission_models.Mission.query.filter_by(id=mission_id).count():
+            return flask.Response('', 404)
+
+        rows = export.stream(self.export_query(mission_id))
+        file_name = 'mission-%d.%s' % (mission_id, export_format)
+        if export_format == 'csv':
+            return export.csv_response(file_name, self.fields, rows)
+        else:
+            return export.ndjson_response(file_name, self.fields, rows)
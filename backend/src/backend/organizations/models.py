@@ -17,9 +17,10 @@ db.Index(
         'ix_user_org_id_combo',
         join_table.c.organization_id,
         join_table.c.user_id)
+models.record_changes(join_table, 'organization_id', 'user_id')
 
 
-class Organization(db.Model, models.CreatedBy):
+class Organization(db.Model, models.CreatedBy, models.Timestamps):
     """Organizations are groups of people.  Missions may also be linked
     to organizations.
     """
@@ -39,3 +40,6 @@ class Organization(db.Model, models.CreatedBy):
         return backend.api.url_for(
                 backend.organization_views.Organization,
                 organization_id=self.id)
+
+models.record_deletions(Organization.__table__)
+models.record_changes(Organization.__table__)
@@ -0,0 +1 @@
+"""learner progress resources"""
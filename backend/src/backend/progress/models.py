@@ -0,0 +1,375 @@
+"""SQLAlchemy models summarizing how far learners have got through
+quests and missions, and the points they have earned.
+
+The summaries are kept up to date incrementally, in the same
+transaction as the writes which change them, by the functions below.
+A question counts as answered by a user once they have submitted at
+least one answer to it, and a mission is completed once every question
+in its quests has been answered.  Completing a mission earns its points
+for good: they are not taken away if answers are later deleted.
+"""
+
+import collections
+import psycopg2.errorcodes
+import sqlalchemy
+import sqlalchemy.exc
+
+import backend
+import backend.missions.models as mission_models
+import backend.quests.models as quest_models
+import backend.questions.models as question_models
+
+
+# How many times insert_missing tries before giving up on a row which
+# concurrent transactions keep inserting first.
+INSERT_ATTEMPTS = 3
+
+
+db = backend.db
+
+
+class QuestProgress(db.Model):
+    """The number of a quest's questions a user has answered."""
+
+    __tablename__ = 'quest_progress'
+
+    user_id = db.Column(
+            db.Integer, db.ForeignKey(
+                'users.id', onupdate='CASCADE', ondelete='CASCADE'),
+            nullable=False, primary_key=True)
+    quest_id = db.Column(
+            db.Integer, db.ForeignKey(
+                'quests.id', onupdate='CASCADE', ondelete='CASCADE'),
+            nullable=False, primary_key=True, index=True)
+    questions_answered = db.Column(db.Integer, nullable=False, default=0)
+
+
+class MissionProgress(db.Model):
+    """The number of questions, across all of a mission's quests, a user
+    has answered.
+    """
+
+    __tablename__ = 'mission_progress'
+
+    user_id = db.Column(
+            db.Integer, db.ForeignKey(
+                'users.id', onupdate='CASCADE', ondelete='CASCADE'),
+            nullable=False, primary_key=True)
+    mission_id = db.Column(
+            db.Integer, db.ForeignKey(
+                'missions.id', onupdate='CASCADE', ondelete='CASCADE'),
+            nullable=False, primary_key=True, index=True)
+    questions_answered = db.Column(db.Integer, nullable=False, default=0)
+
+
+class MissionCompletion(db.Model):
+    """A mission completed by a user and the points it earned them."""
+
+    __tablename__ = 'mission_completions'
+
+    user_id = db.Column(
+            db.Integer, db.ForeignKey(
+                'users.id', onupdate='CASCADE', ondelete='CASCADE'),
+            nullable=False, primary_key=True)
+    mission_id = db.Column(
+            db.Integer, db.ForeignKey(
+                'missions.id', onupdate='CASCADE', ondelete='CASCADE'),
+            nullable=False, primary_key=True, index=True)
+    points = db.Column(db.Integer, nullable=False)
+
+
+class LearnerPoints(db.Model):
+    """The total points a user has earned by completing missions, from
+    which the leaderboards are read.
+    """
+
+    __tablename__ = 'learner_points'
+
+    user_id = db.Column(
+            db.Integer, db.ForeignKey(
+                'users.id', onupdate='CASCADE', ondelete='CASCADE'),
+            nullable=False, primary_key=True)
+    points = db.Column(db.Integer, nullable=False, default=0)
+
+# Serves both the top of the leaderboard and counting the users ahead
+# of a given user, without sorting.
+db.Index(
+        'ix_learner_points_ranking',
+        LearnerPoints.points.desc(), LearnerPoints.user_id)
+
+
+def missions_of(quest_id):
+    """Return a select of the ids of the missions the quest is linked to."""
+    mission_quests = quest_models.join_table
+    return sqlalchemy.select([mission_quests.c.mission_id]).where(
+            mission_quests.c.quest_id == quest_id)
+
+
+def insert_missing(table, columns, missing):
+    """Insert the rows selected by missing, which must leave out rows
+    already in the table.  Postgres 9.3 has no upsert, so a concurrent
+    transaction may insert some of them first, failing the insert with
+    a unique violation once it commits.  The insert is made in a
+    savepoint so that it can then be retried, leaving those rows out.
+    Any other error, e.g. a foreign key violation because the quest was
+    just deleted, is raised straight away.
+    """
+    for attempt in range(1, INSERT_ATTEMPTS + 1):
+        backend.db.session.begin_nested()
+        try:
+            backend.db.session.execute(table.insert(inline=True).from_select(
+                columns, missing))
+        except sqlalchemy.exc.IntegrityError as error:
+            backend.db.session.rollback()
+            if (error.orig.pgcode != psycopg2.errorcodes.UNIQUE_VIOLATION or
+                    attempt == INSERT_ATTEMPTS):
+                raise
+        else:
+            backend.db.session.commit()
+            return
+
+
+def award_points(user_id, points):
+    """Add to the user's total points."""
+    learner_points = LearnerPoints.__table__
+    update = learner_points.update().where(
+        learner_points.c.user_id == user_id).values(
+            points=learner_points.c.points + points)
+    if not backend.db.session.execute(update).rowcount:
+        insert_missing(
+                learner_points, ['user_id', 'points'], sqlalchemy.select([
+                    sqlalchemy.literal(user_id), sqlalchemy.literal(0)]).where(
+                        ~sqlalchemy.exists().where(
+                            learner_points.c.user_id == user_id)))
+        backend.db.session.execute(update)
+
+
+def record_completions(mission_ids, user_id=None):
+    """Record the completion of any of the given missions which users
+    (or just the given user) have now answered every question of, and
+    award them the missions' points.  mission_ids may be a list or a
+    select of ids.
+    """
+    mission_progress = MissionProgress.__table__
+    completions = MissionCompletion.__table__
+    missions = mission_models.Mission.__table__
+    mission_quests = quest_models.join_table
+    questions = question_models.Question.__table__
+
+    question_count = sqlalchemy.select([
+        sqlalchemy.func.count(questions.c.id)]).select_from(
+                mission_quests.join(
+                    questions,
+                    questions.c.quest_id == mission_quests.c.quest_id)
+                ).where(
+                        mission_quests.c.mission_id == (
+                            mission_progress.c.mission_id)).as_scalar()
+    # Progress never exceeds the question count, so having answered
+    # some questions means the mission has some to answer.
+    completed = sqlalchemy.select([
+        mission_progress.c.user_id, mission_progress.c.mission_id,
+        missions.c.points]).where(sqlalchemy.and_(
+            missions.c.id == mission_progress.c.mission_id,
+            mission_progress.c.mission_id.in_(mission_ids),
+            mission_progress.c.questions_answered > 0,
+            mission_progress.c.questions_answered >= question_count,
+            ~sqlalchemy.exists().where(sqlalchemy.and_(
+                completions.c.user_id == mission_progress.c.user_id,
+                completions.c.mission_id == mission_progress.c.mission_id))))
+    if user_id is not None:
+        completed = completed.where(mission_progress.c.user_id == user_id)
+
+    new_completions = backend.db.session.execute(
+            completions.insert(inline=True).from_select(
+                ['user_id', 'mission_id', 'points'], completed).returning(
+                    completions.c.user_id, completions.c.points)).fetchall()
+
+    earned = collections.Counter()
+    for completion_user_id, points in new_completions:
+        earned[completion_user_id] += points
+    for earner_id, points in earned.iteritems():
+        award_points(earner_id, points)
+
+
+def count_answers(user_id, question_id):
+    """Return the number of answers the user has given to the question."""
+    return question_models.Answer.query.filter_by(
+            creator_id=user_id, question_id=question_id).count()
+
+
+def add_answered(user_id, question_id, delta):
+    """Add delta to the number of questions the user has answered in the
+    question's quest and in each mission that quest belongs to.
+    """
+    quest_id = backend.db.session.query(
+            question_models.Question.quest_id).filter_by(
+                    id=question_id).scalar()
+    if quest_id is not None:
+        add_quest_answered(user_id, quest_id, delta)
+
+
+def add_quest_answered(user_id, quest_id, delta):
+    """Add delta to the number of questions the user has answered in the
+    quest and in each mission it belongs to.
+    """
+    quest_progress = QuestProgress.__table__
+    mission_progress = MissionProgress.__table__
+    mission_quests = quest_models.join_table
+
+    # Update any existing rows, inserting the missing ones first if
+    # there are any.  Decrements always find their rows.
+    quest_update = quest_progress.update().where(sqlalchemy.and_(
+        quest_progress.c.user_id == user_id,
+        quest_progress.c.quest_id == quest_id)).values(
+            questions_answered=quest_progress.c.questions_answered + delta)
+    if not backend.db.session.execute(quest_update).rowcount and delta > 0:
+        insert_missing(
+                quest_progress,
+                ['user_id', 'quest_id', 'questions_answered'],
+                sqlalchemy.select([
+                    sqlalchemy.literal(user_id), sqlalchemy.literal(quest_id),
+                    sqlalchemy.literal(0)]).where(~sqlalchemy.exists().where(
+                        sqlalchemy.and_(
+                            quest_progress.c.user_id == user_id,
+                            quest_progress.c.quest_id == quest_id))))
+        backend.db.session.execute(quest_update)
+
+    if delta > 0:
+        insert_missing(
+                mission_progress,
+                ['user_id', 'mission_id', 'questions_answered'],
+                sqlalchemy.select([
+                    sqlalchemy.literal(user_id), mission_quests.c.mission_id,
+                    sqlalchemy.literal(0)]).where(sqlalchemy.and_(
+                        mission_quests.c.quest_id == quest_id,
+                        ~sqlalchemy.exists().where(sqlalchemy.and_(
+                            mission_progress.c.user_id == user_id,
+                            mission_progress.c.mission_id == (
+                                mission_quests.c.mission_id))))))
+    backend.db.session.execute(mission_progress.update().where(
+        sqlalchemy.and_(
+            mission_progress.c.user_id == user_id,
+            mission_progress.c.mission_id.in_(
+                missions_of(quest_id)))).values(
+                        questions_answered=(
+                            mission_progress.c.questions_answered + delta)))
+    if delta > 0:
+        record_completions(missions_of(quest_id), user_id)
+
+
+def lock_answers(user_id, question_ids):
+    """Wait for any other transactions changing the user's answers to
+    the questions to finish, so that one transaction at a time counts
+    them and a first or last answer is never counted twice or missed.
+    The locks are taken in order, and held until the transaction ends.
+    """
+    for question_id in sorted(question_ids):
+        backend.db.session.execute(sqlalchemy.text(
+            'SELECT pg_advisory_xact_lock('
+            'CAST(:user_id AS integer), CAST(:question_id AS integer))'), {
+                'user_id': user_id, 'question_id': question_id})
+
+
+def answer_added(user_id, question_id):
+    """Count the question as answered if the newly flushed answer is the
+    user's first to it.
+    """
+    if user_id is None:
+        return
+    lock_answers(user_id, [question_id])
+    if count_answers(user_id, question_id) == 1:
+        add_answered(user_id, question_id, 1)
+
+
+def answers_added(user_id, quest_id, new_answers):
+    """Count the quest's questions as answered where the newly flushed
+    answers are the user's first to them.  new_answers is a Counter of
+    the number of new answers to each of the quest's questions.
+    """
+    if user_id is None or not new_answers:
+        return
+    lock_answers(user_id, new_answers)
+    answers = question_models.Answer.__table__
+    totals = backend.db.session.execute(sqlalchemy.select([
+        answers.c.question_id, sqlalchemy.func.count(answers.c.id)]).where(
+            sqlalchemy.and_(
+                answers.c.creator_id == user_id,
+                answers.c.question_id.in_(list(new_answers)))).group_by(
+                    answers.c.question_id)).fetchall()
+    first_answered = len([question_id for question_id, total in totals if
+        total == new_answers[question_id]])
+    if first_answered:
+        add_quest_answered(user_id, quest_id, first_answered)
+
+
+def answer_removed(user_id, question_id):
+    """Stop counting the question as answered if the user's last answer
+    to it has just been deleted.
+    """
+    if user_id is None:
+        return
+    lock_answers(user_id, [question_id])
+    if count_answers(user_id, question_id) == 0:
+        add_answered(user_id, question_id, -1)
+
+
+def question_removed(question_id, quest_id):
+    """Stop counting the question, from the given quest, as answered for
+    everyone who answered it.  Call before deleting the question, and
+    call quest_changed after.
+    """
+    quest_progress = QuestProgress.__table__
+    mission_progress = MissionProgress.__table__
+    answers = question_models.Answer.__table__
+
+    answered_by = sqlalchemy.select([answers.c.creator_id]).where(
+            answers.c.question_id == question_id)
+
+    backend.db.session.execute(quest_progress.update().where(
+        sqlalchemy.and_(
+            quest_progress.c.quest_id == quest_id,
+            quest_progress.c.user_id.in_(answered_by))).values(
+                questions_answered=quest_progress.c.questions_answered - 1))
+    backend.db.session.execute(mission_progress.update().where(
+        sqlalchemy.and_(
+            mission_progress.c.mission_id.in_(missions_of(quest_id)),
+            mission_progress.c.user_id.in_(answered_by))).values(
+                questions_answered=(
+                    mission_progress.c.questions_answered - 1)))
+
+
+def quest_changed(quest_id):
+    """Record any mission completions due to questions being removed
+    from the quest.
+    """
+    record_completions(missions_of(quest_id))
+
+
+def quest_linked(mission_id, quest_id, sign):
+    """Add (sign=1) or remove (sign=-1) everyone's progress through the
+    quest to or from their progress through the mission.
+    """
+    quest_progress = QuestProgress.__table__
+    mission_progress = MissionProgress.__table__
+
+    backend.db.session.execute(mission_progress.update().where(
+        sqlalchemy.and_(
+            mission_progress.c.mission_id == mission_id,
+            quest_progress.c.quest_id == quest_id,
+            quest_progress.c.user_id == mission_progress.c.user_id)).values(
+                questions_answered=(
+                    mission_progress.c.questions_answered +
+                    sign * quest_progress.c.questions_answered)))
+    if sign > 0:
+        missing = sqlalchemy.select([
+            quest_progress.c.user_id, sqlalchemy.literal(mission_id),
+            quest_progress.c.questions_answered]).where(sqlalchemy.and_(
+                quest_progress.c.quest_id == quest_id,
+                ~sqlalchemy.exists().where(sqlalchemy.and_(
+                    mission_progress.c.mission_id == mission_id,
+                    mission_progress.c.user_id == (
+                        quest_progress.c.user_id)))))
+        backend.db.session.execute(
+                mission_progress.insert(inline=True).from_select(
+                    ['user_id', 'mission_id', 'questions_answered'], missing))
+    record_completions([mission_id])
@@ -0,0 +1,184 @@
+"""Views for learner progress through quests and missions, and the
+points leaderboards.
+"""
+
+
+import flask
+import flask_restful
+import sqlalchemy
+
+import backend
+import backend.common.database as database
+import backend.common.resource as resource
+import backend.organizations.models as organization_models
+import backend.progress.models as progress_models
+import backend.quests.models as quest_models
+import backend.questions.models as question_models
+import backend.users.models as user_models
+
+
+class UserProgress(flask_restful.Resource):
+    """How far a user has got through each quest and mission they have
+    started.
+    """
+
+    @staticmethod
+    def quest_progress(user_id):
+        """Return (quest_id, questions_answered, question_count) rows for
+        each quest the user has started.
+        """
+        progress = progress_models.QuestProgress
+        question = question_models.Question
+        return backend.db.session.query(
+                progress.quest_id, progress.questions_answered,
+                sqlalchemy.func.count(question.id)).join(
+                        question, question.quest_id == progress.quest_id
+                ).filter(
+                        progress.user_id == user_id,
+                        progress.questions_answered > 0).group_by(
+                                progress.quest_id,
+                                progress.questions_answered).order_by(
+                                        progress.quest_id).all()
+
+    @staticmethod
+    def mission_progress(user_id):
+        """Return (mission_id, questions_answered, question_count) rows
+        for each mission the user has started.
+        """
+        progress = progress_models.MissionProgress
+        mission_quests = quest_models.join_table
+        question = question_models.Question
+        return backend.db.session.query(
+                progress.mission_id, progress.questions_answered,
+                sqlalchemy.func.count(question.id)).join(
+                        mission_quests,
+                        mission_quests.c.mission_id == progress.mission_id
+                ).join(
+                        question,
+                        question.quest_id == mission_quests.c.quest_id
+                ).filter(
+                        progress.user_id == user_id,
+                        progress.questions_answered > 0).group_by(
+                                progress.mission_id,
+                                progress.questions_answered).order_by(
+                                        progress.mission_id).all()
+
+    @database.read_replica
+    def get(self, user_id):
+        """Return the user's progress through their quests and missions."""
+        quests = [{
+            'quest_id': quest_id,
+            'quest_url': backend.api.url_for(
+                backend.quest_views.Quest, quest_id=quest_id),
+            'questions_answered': questions_answered,
+            'question_count': question_count} for
+            quest_id, questions_answered, question_count in
+            self.quest_progress(user_id)]
+        missions = [{
+            'mission_id': mission_id,
+            'mission_url': backend.api.url_for(
+                backend.mission_views.Mission, mission_id=mission_id),
+            'questions_answered': questions_answered,
+            'question_count': question_count} for
+            mission_id, questions_answered, question_count in
+            self.mission_progress(user_id)]
+        return {'quests': quests, 'missions': missions}
+
+
+def parse_limit(arg):
+    """Parse the number of leaders to return, which must be 1-100."""
+    limit = int(arg)
+    assert 0 < limit <= Leaderboard.max_limit, 'invalid limit'
+    return limit
+
+
+class Leaderboard(flask_restful.Resource):
+    """The learners with the most points, either overall or within an
+    organization, and the rank of the current user.
+    """
+    default_limit = 10
+    max_limit = 100
+
+    parser = resource.RequestParser()
+    parser.add_argument(
+            'limit', type=parse_limit, default=default_limit, location='args')
+
+    @staticmethod
+    def ranked_query(organization_id, *columns):
+        """Return a query of the given columns over the learners in the
+        leaderboard.
+        """
+        query = backend.db.session.query(*columns).select_from(
+                progress_models.LearnerPoints)
+        if organization_id is not None:
+            members = organization_models.join_table
+            query = query.join(
+                    members, sqlalchemy.and_(
+                        members.c.user_id == (
+                            progress_models.LearnerPoints.user_id),
+                        members.c.organization_id == organization_id))
+        return query
+
+    def leaders(self, organization_id, limit):
+        """Return the learners with the most points, most first, with
+        their ranks.  Learners with equal points share a rank.
+        """
+        points = progress_models.LearnerPoints
+        user = user_models.User
+        rows = self.ranked_query(
+                organization_id, points.user_id, user.name, user.avatar_url,
+                points.points).join(user, user.id == points.user_id).order_by(
+                        points.points.desc(), points.user_id).limit(
+                                limit).all()
+
+        leaders = []
+        for position, (user_id, name, avatar_url, user_points) in enumerate(
+                rows):
+            if leaders and leaders[-1]['points'] == user_points:
+                rank = leaders[-1]['rank']
+            else:
+                rank = position + 1
+            leaders.append({
+                'user_id': user_id,
+                'user_url': backend.api.url_for(
+                    backend.user_views.User, user_id=user_id),
+                'name': name,
+                'avatar_url': avatar_url,
+                'points': user_points,
+                'rank': rank})
+        return leaders
+
+    def rank(self, organization_id, user_id):
+        """Return the user's points and rank: one more than the number of
+        learners with more points.
+        """
+        points = progress_models.LearnerPoints
+        user_points = backend.db.session.query(points.points).filter_by(
+                user_id=user_id).scalar() or 0
+        ahead = self.ranked_query(
+                organization_id, sqlalchemy.func.count()).filter(
+                        points.points > user_points).scalar()
+        return {
+            'user_id': user_id,
+            'user_url': backend.api.url_for(
+                backend.user_views.User, user_id=user_id),
+            'points': user_points,
+            'rank': ahead + 1}
+
+    @database.read_replica
+    def get(self, organization_id=None):
+        """Return the top learners and the current user's rank."""
+        if organization_id is not None and not (
+                organization_models.Organization.query.filter_by(
+                    id=organization_id).count()):
+            return flask.Response('', 404)
+
+        limit = self.parser.parse_args()['limit']
+        user_id = flask.session.get('user_id')
+        if user_id is None:
+            current_user = None
+        else:
+            current_user = self.rank(organization_id, user_id)
+        return {
+            'leaders': self.leaders(organization_id, limit),
+            'current_user': current_user}
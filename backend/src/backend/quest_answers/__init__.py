@@ -0,0 +1 @@
+"""quest answer resources"""
@@ -0,0 +1,502 @@
+"""Views for the answers, scores, answer statistics and answer events
+of a quest as a whole.
+"""
+
+
+import collections
+import flask
+import flask_restful
+import json
+import Queue
+import sqlalchemy
+import sqlalchemy.exc
+import werkzeug.exceptions
+
+import backend
+import backend.common.auth as auth
+import backend.common.database as database
+import backend.common.export as export
+import backend.common.notifications as notifications
+import backend.common.resource as resource
+import backend.common.response as response
+import backend.organizations.models as organization_models
+import backend.progress.models as progress_models
+import backend.quests.models as quest_models
+import backend.questions.models as question_models
+import backend.questions.views as question_views
+import backend.users.models as user_models
+
+
+def parse_page_size(arg):
+    """Parse the number of answers to return on a page, 1-100."""
+    limit = int(arg)
+    assert 0 < limit <= QuestAnswerList.max_limit, 'invalid limit'
+    return limit
+
+
+def parse_answer_batch(arg):
+    """Parse a list of up to 100 answers, each checked separately later."""
+    assert isinstance(arg, list), 'expected a list of answers'
+    assert len(arg) <= QuestAnswerList.max_batch, 'too many answers'
+    return arg
+
+
+class QuestAnswerList(question_views.AnswerBase, flask_restful.Resource):
+    """A feed of the answers to a quest's questions for mentors to
+    review, oldest first, paged by answer id.  Learners may also submit
+    answers to several of the quest's questions at once.
+    """
+    default_limit = 50
+    max_limit = 100
+    max_batch = 100
+
+    batch_parser = resource.RequestParser()
+    batch_parser.add_argument(
+            'answers', type=parse_answer_batch, required=True)
+
+    batch_answer_parser = resource.RequestParser()
+    batch_answer_parser.add_argument('question_id', type=int, required=True)
+
+    csv_fields = (
+            'id', 'question_id', 'question_group', 'question_type',
+            'creator_id', 'creator_name', 'answer_text', 'answer_upload_url',
+            'answer_multiple_choice')
+
+    query_parser = resource.RequestParser()
+    query_parser.add_argument(
+            'question_group', type=question_views.parse_question_groups,
+            location='args')
+    query_parser.add_argument('user_id', type=int, location='args')
+    query_parser.add_argument('organization_id', type=int, location='args')
+    query_parser.add_argument('after', type=int, location='args')
+    query_parser.add_argument(
+            'limit', type=parse_page_size, default=default_limit,
+            location='args')
+    query_parser.add_argument(
+            'format', type=str, default='json', choices=('json', 'csv'),
+            location='args')
+
+    @staticmethod
+    def feed_query(quest_id, args, *columns):
+        """Return a query of the given columns over the quest's answers
+        matching the filters in args, joined to their questions and
+        creators and sorted by answer id.
+        """
+        answer = question_models.Answer
+        question = question_models.Question
+        query = backend.db.session.query(*columns).select_from(answer).join(
+                question, question.id == answer.question_id).outerjoin(
+                        user_models.User,
+                        user_models.User.id == answer.creator_id).filter(
+                                question.quest_id == quest_id)
+
+        if args['question_group'] is not None:
+            query = query.filter(
+                    question.question_group.in_(args['question_group']))
+        if args['user_id'] is not None:
+            query = query.filter(answer.creator_id == args['user_id'])
+        if args['organization_id'] is not None:
+            members = organization_models.join_table
+            query = query.filter(answer.creator_id.in_(
+                sqlalchemy.select([members.c.user_id]).where(
+                    members.c.organization_id == args['organization_id'])))
+        if args['after'] is not None:
+            query = query.filter(answer.id > args['after'])
+        return query.order_by(answer.id)
+
+    def as_feed_dict(self, answer, question_group, creator_name):
+        """Return a serializable dictionary representing the answer in
+        the feed.
+        """
+        resp = self.as_dict(answer)
+        resp['question_group'] = question_group
+        resp['creator_name'] = creator_name
+        return resp
+
+    @staticmethod
+    def next_url(quest_id, last_id):
+        """Return the URL of the page after the answer with the given id."""
+        params = flask.request.args.to_dict()
+        params['after'] = last_id
+        return backend.api.url_for(
+                QuestAnswerList, quest_id=quest_id, **params)
+
+    def export(self, quest_id, args):
+        """Stream every matching answer as CSV."""
+        answer = question_models.Answer
+        rows = export.stream(self.feed_query(
+            quest_id, args, answer.id, answer.question_id,
+            question_models.Question.question_group, answer.question_type,
+            answer.creator_id, user_models.User.name, answer.answer_text,
+            answer.answer_upload_url, answer.answer_multiple_choice))
+        return export.csv_response(
+                'quest-%d-answers.csv' % quest_id, self.csv_fields, rows)
+
+    @database.read_replica
+    def get(self, quest_id):
+        """Return a page of answers, or all of them as CSV."""
+        args = self.query_parser.parse_args()
+        if args['format'] == 'csv':
+            if not quest_exists(quest_id):
+                return flask.Response('', 404)
+            else:
+                return self.export(quest_id, args)
+
+        rows = self.feed_query(
+                quest_id, args, question_models.Answer,
+                question_models.Question.question_group,
+                user_models.User.name).limit(args['limit'] + 1).all()
+        if not rows and not quest_exists(quest_id):
+            return flask.Response('', 404)
+
+        page = rows[:args['limit']]
+        if len(rows) > len(page):
+            next_url = self.next_url(quest_id, page[-1][0].id)
+        else:
+            next_url = None
+        return {
+            'answers': [self.as_feed_dict(*row) for row in page],
+            'next': next_url}
+
+    def parse_answer(self, values):
+        """Parse one answer of a batch, aborting if it's malformed."""
+        if not isinstance(values, dict):
+            flask_restful.abort(400, message='Expected an object')
+        return resource.parse_values(
+                (self.parser, self.batch_answer_parser), values)
+
+    @staticmethod
+    def batch_targets(quest_id, question_ids):
+        """Return a dictionary of the types of the quest's questions with
+        the given ids, and a set of the (multiple_choice_id, question_id)
+        pairs of their choices.
+        """
+        if not question_ids:
+            return {}, set()
+        question = question_models.Question
+        question_types = dict(backend.db.session.query(
+            question.id, question.question_type).filter(
+                question.quest_id == quest_id,
+                question.id.in_(question_ids)).all())
+
+        choice_question_ids = [question_id for question_id, question_type in
+                question_types.iteritems() if
+                question_type == 'multiple_choice']
+        if choice_question_ids:
+            choice = question_models.MultipleChoice
+            choices = set(backend.db.session.query(
+                choice.id, choice.question_id).filter(
+                    choice.question_id.in_(choice_question_ids)).all())
+        else:
+            choices = set()
+        return question_types, choices
+
+    @staticmethod
+    def check_answer(args, question_types, choices):
+        """Check the parsed answer against its question, as the single
+        answer end-points do, and add the question's type to it.
+        """
+        question_type = question_types.get(args['question_id'])
+        question_views.assert_answer_matches_question(question_type, args)
+        if question_type == 'multiple_choice' and (
+                args['answer_multiple_choice'],
+                args['question_id']) not in choices:
+            flask_restful.abort(
+                    404, message='No such multiple choice for the question.')
+        args['question_type'] = question_type
+
+    @staticmethod
+    def insert_answers(rows):
+        """Insert the answers, a list of argument dictionaries, with a
+        single executemany.  Their ids are taken from the sequence
+        up front so that they can be returned.
+        """
+        answers = question_models.Answer.__table__
+        ids = backend.db.session.execute(sqlalchemy.text(
+            "SELECT nextval('answers_id_seq') "
+            "FROM generate_series(1, :count)"), {'count': len(rows)})
+        for row, (answer_id,) in zip(rows, ids.fetchall()):
+            row['id'] = answer_id
+        backend.db.session.execute(answers.insert(), rows)
+
+    @staticmethod
+    def error_result(error):
+        """Return the result of an answer rejected with the error."""
+        return {
+            'status': error.code, 'message': resource.error_message(error)}
+
+    def parse_batch(self, batch, results):
+        """Parse each answer of the batch, filling in the results of the
+        malformed ones.  Return (index, args) pairs for the rest.
+        """
+        parsed = []
+        for index, values in enumerate(batch):
+            try:
+                parsed.append((index, self.parse_answer(values)))
+            except werkzeug.exceptions.HTTPException as error:
+                results[index] = self.error_result(error)
+        return parsed
+
+    def check_batch(self, parsed, question_types, choices, results):
+        """Check each parsed answer against its question, filling in the
+        results of the invalid ones.  Return (index, args) pairs for the
+        answers to save.
+        """
+        saved = []
+        for index, args in parsed:
+            try:
+                self.check_answer(args, question_types, choices)
+            except werkzeug.exceptions.HTTPException as error:
+                results[index] = self.error_result(error)
+            else:
+                saved.append((index, args))
+        return saved
+
+    def save_answers(self, creator_id, quest_id, rows):
+        """Insert the answers and count them towards the creator's
+        progress and their choices' counts, committing.  Return False,
+        having rolled back, if a choice was deleted since the answers
+        were checked.
+        """
+        for row in rows:
+            row['creator_id'] = creator_id
+        try:
+            self.insert_answers(rows)
+        except sqlalchemy.exc.IntegrityError:
+            backend.db.session.rollback()
+            return False
+
+        progress_models.answers_added(
+                creator_id, quest_id,
+                collections.Counter(row['question_id'] for row in rows))
+        choice_counts = collections.Counter(
+                (row['answer_multiple_choice'], row['question_id']) for
+                row in rows)
+        for (choice_id, question_id), count in choice_counts.iteritems():
+            question_models.count_choice(choice_id, question_id, count)
+        backend.db.session.commit()
+        return True
+
+    def post(self, quest_id):
+        """Submit answers to several of the quest's questions in one
+        transaction.  Each answer is checked as if it had been posted to
+        its question on its own; the valid ones are saved and the
+        result of each is returned in the order they were given.
+        """
+        batch = self.batch_parser.parse_args()['answers']
+        results = [None] * len(batch)
+        parsed = self.parse_batch(batch, results)
+
+        question_types, choices = self.batch_targets(
+                quest_id, set(args['question_id'] for _, args in parsed))
+        if not question_types and not quest_exists(quest_id):
+            return flask.Response('', 404)
+
+        saved = self.check_batch(parsed, question_types, choices, results)
+        if saved and not self.save_answers(
+                auth.current_user_id(), quest_id,
+                [args for _, args in saved]):
+            return flask.Response('', 404)
+
+        for index, args in saved:
+            results[index] = {'status': 200, 'answer': self.as_dict(
+                question_models.Answer(**args))}
+        return {'answers': results}
+
+
+def score_rows(quest_id, roster):
+    """Score the multiple choice questions of the given quest for each
+    user in the roster, a select of user_id's, in a single query.
+    Each user's latest answer to a question is the one which counts.
+    Return (user_id, question_group, total, answered, correct) rows.
+    """
+    questions = question_models.Question.__table__
+    answers = question_models.Answer.__table__
+    choices = question_models.MultipleChoice.__table__
+    roster = roster.alias('roster')
+
+    latest = sqlalchemy.select([
+        answers.c.creator_id, answers.c.question_id,
+        sqlalchemy.func.max(answers.c.id).label('id')]).where(
+                sqlalchemy.and_(
+                    answers.c.creator_id.in_(
+                        sqlalchemy.select([roster.c.user_id])),
+                    answers.c.question_id.in_(
+                        sqlalchemy.select([questions.c.id]).where(
+                            questions.c.quest_id == quest_id)))).group_by(
+                                answers.c.creator_id,
+                                answers.c.question_id).alias('latest')
+
+    sheet = roster.join(questions, sqlalchemy.true()).outerjoin(
+            latest, sqlalchemy.and_(
+                latest.c.creator_id == roster.c.user_id,
+                latest.c.question_id == questions.c.id)).outerjoin(
+                        answers, answers.c.id == latest.c.id).outerjoin(
+                                choices, choices.c.id == (
+                                    answers.c.answer_multiple_choice))
+
+    query = sqlalchemy.select([
+        roster.c.user_id, questions.c.question_group,
+        sqlalchemy.func.count(questions.c.id),
+        sqlalchemy.func.count(answers.c.id),
+        sqlalchemy.func.count(sqlalchemy.case([(choices.c.is_correct, 1)]))
+        ]).select_from(sheet).where(sqlalchemy.and_(
+            questions.c.quest_id == quest_id,
+            questions.c.question_type == 'multiple_choice')).group_by(
+                    roster.c.user_id, questions.c.question_group).order_by(
+                            roster.c.user_id, questions.c.question_group)
+    return backend.db.session.execute(query).fetchall()
+
+
+def score_dicts(rows):
+    """Return a list of dictionaries, one per user, holding the scores
+    for each question group from the given score rows.
+    """
+    scores = []
+    for user_id, question_group, total, answered, correct in rows:
+        if not scores or scores[-1]['user_id'] != user_id:
+            scores.append({
+                'user_id': user_id,
+                'user_url': backend.api.url_for(
+                    backend.user_views.User, user_id=user_id),
+                'question_groups': {}})
+        scores[-1]['question_groups'][question_group] = {
+                'total': total, 'answered': answered, 'correct': correct}
+    return scores
+
+
+def quest_exists(quest_id):
+    """Return True if a quest with the given id exists."""
+    return bool(quest_models.Quest.query.filter_by(id=quest_id).count())
+
+
+class QuestScore(flask_restful.Resource):
+    """Score a learner's answers to a quest's multiple choice questions."""
+
+    parser = resource.RequestParser()
+    parser.add_argument('user_id', type=int, required=True, location='args')
+
+    @database.read_replica
+    def get(self, quest_id):
+        """Return the user's score for each question group."""
+        user_id = self.parser.parse_args()['user_id']
+        users = user_models.User.__table__
+        roster = sqlalchemy.select([users.c.id.label('user_id')]).where(
+                users.c.id == user_id)
+        scores = score_dicts(score_rows(quest_id, roster))
+        if not scores and not quest_exists(quest_id):
+            return flask.Response('', 404)
+        else:
+            return {
+                'quest_id': quest_id,
+                'user_id': user_id,
+                'question_groups': (
+                    scores[0]['question_groups'] if scores else {})}
+
+
+class QuestScores(flask_restful.Resource):
+    """Score every member of an organization on a quest's multiple
+    choice questions at once.
+    """
+
+    parser = resource.RequestParser()
+    parser.add_argument(
+            'organization_id', type=int, required=True, location='args')
+
+    @database.read_replica
+    def get(self, quest_id):
+        """Return each member's score for each question group."""
+        organization_id = self.parser.parse_args()['organization_id']
+        members = organization_models.join_table
+        roster = sqlalchemy.select([members.c.user_id]).where(
+                members.c.organization_id == organization_id)
+        scores = score_dicts(score_rows(quest_id, roster))
+        if not scores and not quest_exists(quest_id):
+            return flask.Response('', 404)
+        else:
+            return {
+                'quest_id': quest_id,
+                'organization_id': organization_id,
+                'scores': scores}
+
+
+class QuestAnswerStats(flask_restful.Resource):
+    """Answer statistics for every multiple choice question of a quest."""
+
+    @database.read_replica
+    def get(self, quest_id):
+        """Return the number of answers picking each choice of each of
+        the quest's questions.
+        """
+        #pylint: disable=R0201
+        quest_questions = backend.db.session.query(
+                question_models.Question.id).filter_by(quest_id=quest_id)
+        stats = question_views.question_stats(question_views.choice_stats(
+            question_models.MultipleChoice.question_id.in_(
+                quest_questions.subquery())))
+        if not stats and not quest_exists(quest_id):
+            return flask.Response('', 404)
+        else:
+            return {'quest_id': quest_id, 'questions': stats}
+
+
+class QuestAnswerEvents(flask_restful.Resource):
+    """A stream of server-sent events announcing the answers saved to a
+    quest's questions, so that mentors' dashboards needn't poll every
+    question's answers.  Events only carry the answer's ids; the
+    dashboard fetches the answers it wants to show.
+    """
+    listener = notifications.Listener(
+            question_models.ANSWER_CHANNEL, 'quest_id')
+    # Seconds between comments sent to keep idle streams from being
+    # closed by proxies.
+    heartbeat_seconds = 15
+    # Milliseconds browsers wait before reconnecting a dropped stream.
+    retry_ms = 5000
+
+    @staticmethod
+    def event(name, data, event_id=None):
+        """Return a server-sent event with a JSON payload."""
+        lines = ['event: %s' % name, 'data: %s' % json.dumps(data)]
+        if event_id is not None:
+            lines.insert(0, 'id: %s' % event_id)
+        return '\n'.join(lines) + '\n\n'
+
+    def stream(self, quest_id, resync):
+        """Yield the quest's answer events until the client goes away.
+        The subscription is only made once the stream is being read,
+        so that it's always cleaned up when the stream is closed.
+        """
+        queue = self.listener.subscribe(quest_id)
+        try:
+            yield 'retry: %d\n\n' % self.retry_ms
+            if resync:
+                yield self.event('resync', {})
+            while True:
+                try:
+                    event = queue.get(timeout=self.heartbeat_seconds)
+                except Queue.Empty:
+                    yield ': keep-alive\n\n'
+                else:
+                    if event is notifications.RESYNC:
+                        yield self.event('resync', {})
+                    else:
+                        yield self.event('answer', event, event['id'])
+        finally:
+            self.listener.unsubscribe(quest_id, queue)
+
+    @response.no_cache
+    def get(self, quest_id):
+        """Stream events for the answers to the quest.  A client
+        reconnecting with Last-Event-ID may have missed some answers,
+        so it's sent a resync event to reload them first.
+        """
+        if not quest_exists(quest_id):
+            return flask.Response('', 404)
+        # Streams stay open for as long as the dashboard does, so give
+        # the connection back to the pool rather than holding it.
+        backend.db.session.close()
+        resync = 'Last-Event-ID' in flask.request.headers
+        return flask.Response(
+                self.stream(quest_id, resync), mimetype='text/event-stream',
+                headers={'X-Accel-Buffering': 'no'})
@@ -3,7 +3,9 @@
 import sqlalchemy
 
 import backend
+import backend.common.custom_types as custom_types
 import backend.common.models as models
+import backend.common.partitions as partitions
 
 
 db = backend.db
@@ -12,11 +14,24 @@ QUESTION_GROUPS = ('review_quiz', 'lab_report', 'closing_questions')
 QUESTION_TYPES = ('upload', 'text', 'multiple_choice')
 
 
-class Answer(db.Model, models.CreatedBy):
+class Answer(db.Model, models.CreatedBy, models.Timestamps):
     """An answer to a question.  Answers are submitted by learners and
     evaluated by mentors.
     """
     __tablename__ = 'answers'
+    __table_args__ = (
+            # Make sure the answer to a multiple choice question is a
+            # valid choice for that question.  The constraint isn't
+            # checked for answers without a choice.  A choice can't be
+            # deleted while answers still reference it, so the
+            # multiple choice end-point nulls them first; deleting the
+            # whole question deletes its answers too.
+            db.ForeignKeyConstraint(
+                ['answer_multiple_choice', 'question_id'],
+                ['multiple_choices.id', 'multiple_choices.question_id'],
+                name='fk_answers_multiple_choice_question',
+                onupdate='CASCADE'),
+            )
 
     id = db.Column(db.Integer, primary_key=True, nullable=False)
 
@@ -24,14 +39,17 @@ class Answer(db.Model, models.CreatedBy):
             db.Enum(*QUESTION_TYPES, name='question_types'), nullable=False)
     answer_text = db.Column(db.String, nullable=True)
     answer_upload_url = db.Column(db.String, nullable=True)
-    answer_multiple_choice = db.Column(
-            db.Integer, db.ForeignKey(
-                'multiple_choices.id', onupdate='CASCADE', ondelete='SET NULL'),
-            index=True)
+    answer_multiple_choice = db.Column(db.Integer, index=True)
+    # Set on the one answer a learner keeps up to date in place when
+    # answering in latest answer mode; see ux_answers_latest.
+    latest = db.Column(
+            db.Boolean, nullable=False,
+            server_default=sqlalchemy.text('false'))
 
+    # Indexed by ix_answers_question_updated_at.
     question_id = db.Column(
             db.Integer, db.ForeignKey('questions.id', ondelete='cascade'),
-            nullable=False, index=True)
+            nullable=False)
 
     @property
     def url(self):
@@ -47,35 +65,93 @@ class Answer(db.Model, models.CreatedBy):
                 backend.question_views.QuestionView,
                 question_id=self.question_id)
 
-# Make sure the answer to a multiple choice question is a valid choice
-# for that question.
-sqlalchemy.event.listen(Answer.__table__, 'after_create', sqlalchemy.DDL("""
-CREATE OR REPLACE FUNCTION check_valid_mc_answer()
+# Used to look up a user's answers to a question.
+db.Index(
+        'ix_answers_creator_question', Answer.creator_id, Answer.question_id)
+# Serves both listing a question's answers and syncing them with
+# ?updated_since=.
+db.Index(
+        'ix_answers_question_updated_at',
+        Answer.question_id, Answer.updated_at)
+models.record_deletions(Answer.__table__, 'question_id')
+models.record_changes(Answer.__table__)
+# Only one answer per learner and question may be kept in latest answer
+# mode.  Answers submitted otherwise aren't affected.
+db.Index(
+        'ux_answers_latest', Answer.creator_id, Answer.question_id,
+        unique=True, postgresql_where=Answer.latest)
+
+# Channel on which new answers, and answers resubmitted in latest answer
+# mode, are announced to mentors' event streams.  Notifications are only
+# sent once the transaction commits.
+ANSWER_CHANNEL = 'answers'
+
+NOTIFY_ANSWERS = """
+CREATE OR REPLACE FUNCTION notify_answer()
   RETURNS trigger
-  LANGUAGE 'plpgsql'
-  STABLE
-AS '
+  LANGUAGE plpgsql
+AS $$
 BEGIN
-  PERFORM NULL
-  FROM multiple_choices
-  WHERE id=NEW.answer_multiple_choice AND question_id=NEW.question_id;
-
-  IF FOUND THEN
-    RETURN NEW;
-  ELSE
-    RAISE EXCEPTION ''Invalid multiple choice id %% given for question %%'',
-      NEW.answer_multiple_choice, NEW.question_id
-      USING ERRCODE = ''23000'';
-  END IF;
-END';
-
-CREATE TRIGGER multiple_choice_answer BEFORE INSERT OR UPDATE ON answers
-FOR EACH ROW
-WHEN (NEW.answer_multiple_choice IS NOT NULL)
-EXECUTE PROCEDURE check_valid_mc_answer();"""))
-
-
-class Question(db.Model, models.CreatedBy):
+  PERFORM pg_notify(TG_ARGV[0], row_to_json(answer)::text)
+  FROM (
+    SELECT NEW.id AS id, NEW.question_id AS question_id,
+      questions.quest_id AS quest_id, NEW.creator_id AS creator_id
+    FROM questions
+    WHERE questions.id = NEW.question_id) AS answer;
+  RETURN NULL;
+END $$;
+
+CREATE TRIGGER answers_notify AFTER INSERT OR UPDATE ON answers
+FOR EACH ROW EXECUTE PROCEDURE notify_answer('{channel}');"""
+sqlalchemy.event.listen(Answer.__table__, 'after_create', sqlalchemy.DDL(
+    NOTIFY_ANSWERS.format(channel=ANSWER_CHANNEL)))
+
+
+# Answers superseded by a newer answer from the same learner to the same
+# question, or whose learner has been deleted.
+ARCHIVABLE_ANSWERS = """
+answers.updated_at < :before AND (
+  answers.creator_id IS NULL OR EXISTS (
+    SELECT 1 FROM answers AS newer
+    WHERE newer.creator_id = answers.creator_id
+      AND newer.question_id = answers.question_id
+      AND newer.id > answers.id))"""
+
+
+def archive_answers(before, file_name):
+    """Move the answers last updated before the given time which are
+    superseded, or whose learner is gone, to a gzipped CSV file in the
+    current transaction, returning how many were archived.
+
+    Each learner's last answer to each question is kept, so whether
+    they've answered it stays the same.  Progress and choice counts are
+    kept up to date separately and still count the archived answers.
+    """
+    return partitions.archive_rows(
+            'answers', ARCHIVABLE_ANSWERS, {'before': before}, file_name)
+
+# Every submission of an answer in latest answer mode, which otherwise
+# only keeps the last one.  Rows are only ever appended, to partitions
+# by the month they were submitted in.
+answer_history = db.Table('answer_history', db.Model.metadata,
+    db.Column('answer_id', db.Integer, nullable=False, index=True),
+    db.Column('question_id', db.Integer, nullable=False),
+    db.Column('creator_id', db.Integer),
+    db.Column(
+        'question_type', db.Enum(*QUESTION_TYPES, name='question_types'),
+        nullable=False),
+    db.Column('answer_text', db.String),
+    db.Column('answer_upload_url', db.String),
+    db.Column('answer_multiple_choice', db.Integer),
+    db.Column(
+        'submitted_at', custom_types.UTCDateTime, nullable=False,
+        server_default=sqlalchemy.text("(now() AT TIME ZONE 'utc')")),
+    implicit_returning=False
+)
+partitions.partition_by_month(answer_history, 'submitted_at')
+
+
+class Question(db.Model, models.CreatedBy, models.Timestamps):
     """Quests are linked to assessment questions, which learners
     answer to complete quests.
     """
@@ -89,10 +165,13 @@ class Question(db.Model, models.CreatedBy):
     question_group = db.Column(
             db.Enum(*QUESTION_GROUPS, name='question_group'),
             nullable=False, index=True)
+    # The question's place in its quest, counting from 1.
+    order = db.Column(db.Integer, nullable=False)
 
+    # Indexed by ix_questions_quest_group_order.
     quest_id = db.Column(
             db.Integer, db.ForeignKey('quests.id', ondelete='cascade'),
-            nullable=False, index=True)
+            nullable=False)
 
     answers = db.relationship("Answer", backref="question")
     answered_by = db.relationship(
@@ -115,20 +194,40 @@ class Question(db.Model, models.CreatedBy):
                 backend.quest_views.Quest, quest_id=self.quest_id)
 
 
-class MultipleChoice(db.Model, models.CreatedBy):
+# Reading a quest's questions from one question group in order is a
+# single range scan of this index, and its quest_id prefix serves
+# reading all of a quest's questions.
+db.Index(
+        'ix_questions_quest_group_order',
+        Question.quest_id, Question.question_group, Question.order)
+# Serves syncing a quest's questions with ?updated_since=.
+db.Index(
+        'ix_questions_quest_updated_at',
+        Question.quest_id, Question.updated_at)
+models.record_deletions(Question.__table__, 'quest_id')
+models.record_changes(Question.__table__)
+
+
+class MultipleChoice(db.Model, models.CreatedBy, models.Timestamps):
     """A multiple choice option linked to a question."""
 
     __tablename__ = 'multiple_choices'
+    __table_args__ = (
+            # Referenced by fk_answers_multiple_choice_question.
+            db.UniqueConstraint(
+                'id', 'question_id', name='uq_multiple_choices_id_question'),
+            )
 
     id = db.Column(db.Integer, primary_key=True, nullable=False)
     answer = db.Column(db.String, nullable=False)
     is_correct = db.Column(db.Boolean, default=False, nullable=False)
     order = db.Column(db.Integer, nullable=False, index=True)
 
+    # Indexed by ix_multiple_choices_question_updated_at.
     question_id = db.Column(
             db.Integer, db.ForeignKey(
                 'questions.id', onupdate='CASCADE', ondelete='CASCADE'),
-            nullable=False, index=True)
+            nullable=False)
     answered_with = db.relationship(
             "Answer", backref="multiple_choice")
 
@@ -145,3 +244,72 @@ class MultipleChoice(db.Model, models.CreatedBy):
         return backend.api.url_for(
                 backend.question_views.QuestionView,
                 question_id=self.question_id)
+
+# Serves both listing a question's choices and syncing them with
+# ?updated_since=.
+db.Index(
+        'ix_multiple_choices_question_updated_at',
+        MultipleChoice.question_id, MultipleChoice.updated_at)
+models.record_deletions(MultipleChoice.__table__, 'question_id')
+models.record_changes(MultipleChoice.__table__)
+
+
+class ChoiceCount(db.Model):
+    """The number of answers picking a multiple choice, kept up to date
+    as answers are written so answer statistics don't scan answers.
+    """
+
+    __tablename__ = 'choice_counts'
+
+    multiple_choice_id = db.Column(
+            db.Integer, db.ForeignKey(
+                'multiple_choices.id', onupdate='CASCADE', ondelete='CASCADE'),
+            nullable=False, primary_key=True)
+    question_id = db.Column(
+            db.Integer, db.ForeignKey(
+                'questions.id', onupdate='CASCADE', ondelete='CASCADE'),
+            nullable=False, index=True)
+    answer_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Count the answers to every choice without a count, e.g. choices made
+# before counting began, whenever the tables are created: on upgrading,
+# bin/create_db creates choice_counts and fills it in.
+BACKFILL_CHOICE_COUNTS = """
+INSERT INTO choice_counts (multiple_choice_id, question_id, answer_count)
+SELECT multiple_choices.id, multiple_choices.question_id, count(answers.id)
+FROM multiple_choices
+LEFT OUTER JOIN answers
+ON answers.answer_multiple_choice = multiple_choices.id
+WHERE NOT EXISTS (
+  SELECT 1 FROM choice_counts
+  WHERE choice_counts.multiple_choice_id = multiple_choices.id)
+GROUP BY multiple_choices.id, multiple_choices.question_id"""
+sqlalchemy.event.listen(db.Model.metadata, 'after_create', sqlalchemy.DDL(
+    BACKFILL_CHOICE_COUNTS))
+
+
+def count_choice(multiple_choice_id, question_id, delta):
+    """Add delta to the number of answers picking the given choice.
+    Call after the change to the answers has been flushed.
+    """
+    if multiple_choice_id is None:
+        return
+    choice_counts = ChoiceCount.__table__
+    answers = Answer.__table__
+    updated = backend.db.session.execute(choice_counts.update().where(
+        choice_counts.c.multiple_choice_id == multiple_choice_id).values(
+            answer_count=choice_counts.c.answer_count + delta))
+    if not updated.rowcount:
+        # Counts are created along with their choices, so only choices
+        # made before counting began get here.  Count their answers from
+        # scratch, which takes in the flushed change.
+        backend.db.session.execute(
+                choice_counts.insert(inline=True).from_select(
+                    ['multiple_choice_id', 'question_id', 'answer_count'],
+                    sqlalchemy.select([
+                        sqlalchemy.literal(multiple_choice_id),
+                        sqlalchemy.literal(question_id),
+                        sqlalchemy.func.count(answers.c.id)]).where(
+                            answers.c.answer_multiple_choice == (
+                                multiple_choice_id))))
@@ -3,12 +3,18 @@
 
 import flask
 import flask_restful
+import flask_restful.types
+import sqlalchemy
 import sqlalchemy.exc
 import sqlalchemy.orm as orm
 import werkzeug.exceptions
 
 import backend
+import backend.common.database as database
+import backend.common.ordering as ordering
 import backend.common.resource as resource
+import backend.common.sync as sync
+import backend.progress.models as progress_models
 import backend.quests.models as quest_models
 import backend.questions.models as question_models
 
@@ -35,7 +41,7 @@ class QuestionBase(object):
 
     view_fields = (
             'id', 'url', 'description', 'question_type', 'question_group',
-            'quest_id', 'quest_url', 'creator_id', 'creator_url')
+            'order', 'quest_id', 'quest_url', 'creator_id', 'creator_url')
     multiple_choice_fields = (
             'id', 'url', 'answer', 'is_correct', 'order',
             'question_id', 'question_url', 'creator_id', 'creator_url')
@@ -67,6 +73,17 @@ class Question(QuestionBase, resource.SimpleResource):
                 orm.joinedload('multiple_choices'))
         return question_query
 
+    def delete(self, quest_id, question_id):
+        """Delete the question, taking it out of its answerers' progress."""
+        if not self.query(quest_id, question_id).count():
+            return flask.Response('', 404)
+        else:
+            progress_models.question_removed(question_id, quest_id)
+            question_models.Question.query.filter_by(id=question_id).delete(
+                    synchronize_session=False)
+            progress_models.quest_changed(quest_id)
+            backend.db.session.commit()
+
 
 class QuestionView(QuestionBase, resource.SimpleResource):
     """View a single quest by id."""
@@ -107,7 +124,9 @@ class QuestionList(QuestionBase, resource.ManyToOneLink):
 
     resource_type = question_models.Question
     parent_resource_type = quest_models.Quest
+    child_options = (orm.joinedload('multiple_choices'),)
 
+    @database.read_replica
     def get(self, parent_id):
         """Retrieve all questions linked to the given quest,
         optionally filtering them by question_group.
@@ -118,6 +137,11 @@ class QuestionList(QuestionBase, resource.ManyToOneLink):
 
         if question_groups is None:
             return super(QuestionList, self).get(parent_id)
+        since = sync.updated_since()
+        if since is not None:
+            return self.sync(
+                    parent_id, since, self.resource_type.question_group.in_(
+                        question_groups))
         else:
             parent_count = self.parent_resource_type.query.filter_by(
                     id=parent_id).count()
@@ -133,10 +157,59 @@ class QuestionList(QuestionBase, resource.ManyToOneLink):
                     child_query = child_query.filter(
                             self.resource_type.question_group.in_(
                                 question_groups))
-                children = child_query.all()
+                children = child_query.order_by(
+                        self.resource_type.order).options(
+                                orm.joinedload('multiple_choices')).all()
                 return {self.child_link_name: [
                     self.as_dict(child) for child in children]}
 
+    def build_args(self, parent_id):
+        """Put new questions last in their quest."""
+        args = super(QuestionList, self).build_args(parent_id)
+        question = question_models.Question
+        args['order'] = sqlalchemy.select([
+            sqlalchemy.func.coalesce(sqlalchemy.func.max(question.order), 0)
+            + 1]).where(question.quest_id == parent_id).as_scalar()
+        return args
+
+
+class QuestionOrder(QuestionBase, flask_restful.Resource):
+    """The order of a quest's questions."""
+
+    parser = resource.RequestParser()
+    parser.add_argument('question_ids', type=ordering.parse_ids, required=True)
+
+    def put(self, quest_id):
+        """Put the quest's questions in the given order, which must list
+        every one of them, returning the reordered questions.
+        """
+        question_ids = self.parser.parse_args()['question_ids']
+        question = question_models.Question
+
+        # Lock the quest so that concurrent reorders don't interleave.
+        if backend.db.session.query(quest_models.Quest.id).filter_by(
+                id=quest_id).with_for_update().first() is None:
+            return flask.Response('', 404)
+        current = [question_id for question_id, in backend.db.session.query(
+            question.id).filter_by(quest_id=quest_id)]
+        if sorted(current) != sorted(question_ids):
+            backend.db.session.rollback()
+            flask_restful.abort(
+                    400, message='question_ids must list each of the '
+                    'quest\'s questions once')
+
+        ordering.set_positions(
+                question.__table__.c.order, question.__table__.c.id,
+                question.__table__.c.quest_id, quest_id, [
+                    (question_id, order) for order, question_id in
+                    enumerate(question_ids, 1)])
+        questions = [self.as_dict(reordered) for
+                reordered in question.query.filter_by(
+                    quest_id=quest_id).order_by(question.order).options(
+                        orm.joinedload('multiple_choices'))]
+        backend.db.session.commit()
+        return {'questions': questions}
+
 
 class AnswerBase(object):
     """Provide an as_dict method and a parser."""
@@ -224,9 +297,38 @@ class Answer(AnswerBase, resource.SimpleResource):
             # Tried to link a multiple choice answer to a bad choice
             return flask.Response('', 404)
 
+    @staticmethod
+    def after_update(answer, previous):
+        """Move the answer's count to its new choice."""
+        if answer.answer_multiple_choice != (
+                previous['answer_multiple_choice']):
+            question_models.count_choice(
+                    previous['answer_multiple_choice'], answer.question_id, -1)
+            question_models.count_choice(
+                    answer.answer_multiple_choice, answer.question_id, 1)
+
+    def delete(self, question_id, answer_id):
+        """Delete the answer, updating its creator's progress if it was
+        their last answer to the question.
+        """
+        answer = self.query(question_id, answer_id).first()
+        if answer is None:
+            return flask.Response('', 404)
+        else:
+            backend.db.session.delete(answer)
+            backend.db.session.flush()
+            progress_models.answer_removed(answer.creator_id, question_id)
+            question_models.count_choice(
+                    answer.answer_multiple_choice, question_id, -1)
+            backend.db.session.commit()
+
 
 class AnswerList(AnswerBase, resource.ManyToOneLink):
-    """Resource for working with collections of answers."""
+    """Resource for working with collections of answers.  In latest
+    answer mode a learner's answer to the question is kept up to date
+    in place, each submission being recorded in the answer history,
+    rather than a new answer being added each time.
+    """
 
     parent_id_name = 'question_id'
     child_link_name = 'answers'
@@ -234,6 +336,77 @@ class AnswerList(AnswerBase, resource.ManyToOneLink):
     resource_type = question_models.Answer
     parent_resource_type = question_models.Question
 
+    mode_parser = resource.RequestParser()
+    mode_parser.add_argument(
+            'latest', type=flask_restful.types.boolean, default=False,
+            location='args')
+
+    def post(self, parent_id):
+        """Create a new answer, or in latest answer mode create or
+        update the learner's answer.
+        """
+        if not self.mode_parser.parse_args()['latest']:
+            return super(AnswerList, self).post(parent_id)
+
+        args = self.build_args(parent_id)
+        answer = self.upsert_latest(args)
+        if answer is None:
+            # Tried to pick a bad choice
+            backend.db.session.rollback()
+            return flask.Response('', 404)
+
+        backend.db.session.execute(question_models.answer_history.insert(
+            ).values(
+                answer_id=answer.id, question_id=answer.question_id,
+                creator_id=answer.creator_id,
+                question_type=answer.question_type,
+                answer_text=answer.answer_text,
+                answer_upload_url=answer.answer_upload_url,
+                answer_multiple_choice=answer.answer_multiple_choice))
+        backend.db.session.commit()
+        return self.as_dict(answer)
+
+    def upsert_latest(self, args):
+        """Update the learner's latest answer to the question with the
+        given arguments, inserting it if they don't have one yet.
+        Return the answer, or None if it picks a bad choice.
+
+        Postgres 9.3 has no upsert, so the answer is locked and updated
+        if it exists, or else inserted in a savepoint.  If a concurrent
+        request inserts it first the insert fails on ux_answers_latest,
+        and the answer is updated instead.
+        """
+        answer_query = question_models.Answer.query.filter_by(
+                creator_id=args['creator_id'],
+                question_id=args['question_id'], latest=True).with_for_update()
+        answer = answer_query.first()
+        if answer is None:
+            #pylint: disable=E1123
+            answer = question_models.Answer(latest=True, **args)
+            backend.db.session.begin_nested()
+            try:
+                backend.db.session.add(answer)
+                backend.db.session.flush()
+            except sqlalchemy.exc.IntegrityError:
+                backend.db.session.rollback()
+                answer = answer_query.first()
+                if answer is None:
+                    return None
+            else:
+                backend.db.session.commit()
+                self.after_create(answer)
+                return answer
+
+        previous = {key: getattr(answer, key) for key in args}
+        for key, value in args.iteritems():
+            setattr(answer, key, value)
+        try:
+            backend.db.session.flush()
+        except sqlalchemy.exc.IntegrityError:
+            return None
+        Answer.after_update(answer, previous)
+        return answer
+
     def build_args(self, parent_id):
         """Check that the answer type matches the question type
         before creating the answer.  Add the question type from the
@@ -245,6 +418,80 @@ class AnswerList(AnswerBase, resource.ManyToOneLink):
         args['question_type'] = question_type
         return args
 
+    def after_create(self, new_resource):
+        """Update the creator's progress and the count of answers picking
+        the answer's choice in the same transaction.
+        """
+        progress_models.answer_added(
+                new_resource.creator_id, new_resource.question_id)
+        question_models.count_choice(
+                new_resource.answer_multiple_choice,
+                new_resource.question_id, 1)
+
+
+def choice_stats(question_filter):
+    """Return (question_id, multiple_choice_id, answer, is_correct,
+    answer_count) rows for the choices of the questions selected by
+    question_filter, read from the precomputed counts.
+    """
+    choice = question_models.MultipleChoice
+    count = question_models.ChoiceCount
+    return backend.db.session.query(
+            choice.question_id, choice.id, choice.answer, choice.is_correct,
+            sqlalchemy.func.coalesce(count.answer_count, 0)).outerjoin(
+                    count, count.multiple_choice_id == choice.id).filter(
+                            question_filter).order_by(
+                                    choice.question_id, choice.order,
+                                    choice.id).all()
+
+
+def question_stats(rows):
+    """Return a list of dictionaries, one per question, of the answer
+    counts for each choice from the given choice_stats rows.
+    """
+    stats = []
+    for question_id, choice_id, answer, is_correct, answer_count in rows:
+        if not stats or stats[-1]['question_id'] != question_id:
+            stats.append({
+                'question_id': question_id,
+                'question_url': backend.api.url_for(
+                    QuestionView, question_id=question_id),
+                'answer_count': 0,
+                'multiple_choices': []})
+        stats[-1]['answer_count'] += answer_count
+        stats[-1]['multiple_choices'].append({
+            'id': choice_id,
+            'url': backend.api.url_for(
+                MultipleChoice, question_id=question_id,
+                multiple_choice_id=choice_id),
+            'answer': answer,
+            'is_correct': is_correct,
+            'answer_count': answer_count})
+    return stats
+
+
+class AnswerStats(flask_restful.Resource):
+    """How many answers to a multiple choice question picked each choice."""
+
+    @database.read_replica
+    def get(self, question_id):
+        """Return the number of answers picking each choice."""
+        #pylint: disable=R0201
+        stats = question_stats(choice_stats(
+            question_models.MultipleChoice.question_id == question_id))
+        if stats:
+            return stats[0]
+        elif not question_models.Question.query.filter_by(
+                id=question_id).count():
+            return flask.Response('', 404)
+        else:
+            return {
+                'question_id': question_id,
+                'question_url': backend.api.url_for(
+                    QuestionView, question_id=question_id),
+                'answer_count': 0,
+                'multiple_choices': []}
+
 
 class MultipleChoiceBase(object):
     """Provide an as_dict method and a parser."""
@@ -277,6 +524,18 @@ class MultipleChoice(MultipleChoiceBase, resource.SimpleResource):
                             question_query.subquery()))
         return multiple_choice_query
 
+    def delete(self, question_id, multiple_choice_id):
+        """Delete the choice, first taking it away from the answers
+        which picked it.
+        """
+        answers = question_models.Answer.__table__
+        backend.db.session.execute(answers.update().where(sqlalchemy.and_(
+            answers.c.answer_multiple_choice == multiple_choice_id,
+            answers.c.question_id == question_id)).values(
+                answer_multiple_choice=None))
+        return super(MultipleChoice, self).delete(
+                question_id, multiple_choice_id)
+
 
 class MultipleChoiceList(MultipleChoiceBase, resource.ManyToOneLink):
     """Resource for working with collections of multiple choices."""
@@ -305,3 +564,48 @@ class MultipleChoiceList(MultipleChoiceBase, resource.ManyToOneLink):
                         'to a non-multiple choice question')
             else:
                 return super(MultipleChoiceList, self).create_resource(args)
+
+    def after_create(self, new_resource):
+        """Start counting the answers which pick the new choice."""
+        #pylint: disable=E1120,E1123
+        backend.db.session.add(question_models.ChoiceCount(
+            multiple_choice_id=new_resource.id,
+            question_id=new_resource.question_id, answer_count=0))
+
+
+class MultipleChoiceOrder(MultipleChoiceBase, flask_restful.Resource):
+    """The order of a question's multiple choices."""
+
+    parser = resource.RequestParser()
+    parser.add_argument(
+            'multiple_choice_ids', type=ordering.parse_ids, required=True)
+
+    def put(self, question_id):
+        """Put the question's multiple choices in the given order, which
+        must list every one of them, returning the reordered choices.
+        """
+        multiple_choice_ids = self.parser.parse_args()['multiple_choice_ids']
+        choice = question_models.MultipleChoice
+
+        # Lock the question so that concurrent reorders don't interleave.
+        if backend.db.session.query(question_models.Question.id).filter_by(
+                id=question_id).with_for_update().first() is None:
+            return flask.Response('', 404)
+        current = [choice_id for choice_id, in backend.db.session.query(
+            choice.id).filter_by(question_id=question_id)]
+        if sorted(current) != sorted(multiple_choice_ids):
+            backend.db.session.rollback()
+            flask_restful.abort(
+                    400, message='multiple_choice_ids must list each of the '
+                    'question\'s multiple choices once')
+
+        ordering.set_positions(
+                choice.__table__.c.order, choice.__table__.c.id,
+                choice.__table__.c.question_id, question_id, [
+                    (choice_id, order) for order, choice_id in
+                    enumerate(multiple_choice_ids, 1)])
+        multiple_choices = [self.as_dict(multiple_choice) for
+                multiple_choice in choice.query.filter_by(
+                    question_id=question_id).order_by(choice.order)]
+        backend.db.session.commit()
+        return {'multiple_choices': multiple_choices}
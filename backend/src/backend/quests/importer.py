@@ -0,0 +1,446 @@
+"""Bulk import of quests along with their tags, questions and multiple
+choices.
+
+Curriculum bundles may hold hundreds of quests, far too many to create
+one request at a time.  A bundle is either a JSON object nesting the
+questions and multiple choices inside their quests:
+
+    {"quests": [{"name": ..., "tags": ["physics"], "questions": [
+        {"description": ..., "question_type": "multiple_choice",
+         "question_group": "review_quiz", "multiple_choices": [
+            {"answer": ..., "is_correct": true, "order": 1}]}]}]}
+
+or three CSV files, quests, questions and multiple_choices, whose rows
+refer to each other through "ref", "quest_ref" and "question_ref"
+columns.  List and boolean CSV cells are written as JSON.
+
+Every row is checked with the same parsers as the quest, question and
+multiple choice end-points.  A bundle with any invalid rows imports
+nothing; otherwise its rows are COPY'd into temporary staging tables
+and merged into the real ones with a handful of statements, all in the
+caller's transaction.
+"""
+
+
+import collections
+import csv
+import io
+import json
+
+import werkzeug.exceptions
+
+import backend
+import backend.common.resource as resource
+
+
+# The columns of CSV files which hold JSON rather than plain text.
+JSON_COLUMNS = ('inquiry_questions', 'video_links', 'tags', 'is_correct')
+
+QUEST_FIELDS = (
+        'name', 'summary', 'inquiry_questions', 'pbl_description',
+        'mentor_guide', 'min_grade_level', 'max_grade_level',
+        'hours_required', 'minutes_required', 'video_links', 'icon_url')
+QUESTION_FIELDS = ('description', 'question_type', 'question_group')
+MULTIPLE_CHOICE_FIELDS = ('answer', 'is_correct', 'order')
+
+
+def parse_tags(arg):
+    """Parse a list of tag names."""
+    assert isinstance(arg, list), 'tags must be a list of names'
+    return map(str, arg)
+
+QUEST_REF_PARSER = resource.RequestParser()
+QUEST_REF_PARSER.add_argument('ref', type=str, required=True)
+QUEST_REF_PARSER.add_argument('tags', type=parse_tags, default=list)
+
+QUESTION_REF_PARSER = resource.RequestParser()
+QUESTION_REF_PARSER.add_argument('ref', type=str, required=True)
+QUESTION_REF_PARSER.add_argument('quest_ref', type=str, required=True)
+
+MULTIPLE_CHOICE_REF_PARSER = resource.RequestParser()
+MULTIPLE_CHOICE_REF_PARSER.add_argument(
+        'question_ref', type=str, required=True)
+
+STAGING_DDL = """
+CREATE TEMPORARY TABLE import_quests (
+  ref text PRIMARY KEY, id integer, name text, summary text,
+  inquiry_questions text[], pbl_description text, mentor_guide text,
+  min_grade_level integer, max_grade_level integer,
+  hours_required integer, minutes_required integer,
+  video_links text[], icon_url text, tags text[]
+) ON COMMIT DROP;
+CREATE TEMPORARY TABLE import_questions (
+  ref text PRIMARY KEY, quest_ref text NOT NULL, id integer,
+  quest_id integer, description text, question_type question_types,
+  question_group question_group, "order" integer
+) ON COMMIT DROP;
+CREATE TEMPORARY TABLE import_multiple_choices (
+  question_ref text NOT NULL, id integer, question_id integer,
+  answer text, is_correct boolean, "order" integer
+) ON COMMIT DROP;
+"""
+
+# Ids are handed out in the staging tables first so that questions and
+# multiple choices can be pointed at their new parents before anything
+# is inserted.
+MERGE_SQL = (
+    "UPDATE import_quests SET id = nextval('quests_id_seq')",
+    """UPDATE import_questions SET
+         id = nextval('questions_id_seq'), quest_id = import_quests.id
+       FROM import_quests WHERE import_quests.ref = import_questions.quest_ref
+    """,
+    """UPDATE import_multiple_choices SET
+         id = nextval('multiple_choices_id_seq'),
+         question_id = import_questions.id
+       FROM import_questions
+       WHERE import_questions.ref = import_multiple_choices.question_ref
+    """,
+    """INSERT INTO quests (
+         id, name, summary, inquiry_questions, pbl_description,
+         mentor_guide, min_grade_level, max_grade_level, hours_required,
+         minutes_required, video_links, icon_url, creator_id)
+       SELECT
+         id, name, summary, coalesce(inquiry_questions, '{}'),
+         pbl_description, mentor_guide, min_grade_level, max_grade_level,
+         hours_required, minutes_required, coalesce(video_links, '{}'),
+         icon_url, CAST(:creator_id AS integer)
+       FROM import_quests
+    """,
+    """INSERT INTO quest_tags (quest_id, tag_id)
+       SELECT DISTINCT import_quests.id, tags.id
+       FROM import_quests, unnest(import_quests.tags) AS tag_names(name),
+         tags
+       WHERE tags.name = tag_names.name
+    """,
+    """INSERT INTO questions (
+         id, description, question_type, question_group, "order",
+         quest_id, creator_id)
+       SELECT
+         id, description, question_type, question_group, "order",
+         quest_id, CAST(:creator_id AS integer)
+       FROM import_questions
+    """,
+    """INSERT INTO multiple_choices (
+         id, answer, is_correct, "order", question_id, creator_id)
+       SELECT
+         id, answer, is_correct, "order", question_id,
+         CAST(:creator_id AS integer)
+       FROM import_multiple_choices
+    """,
+    """INSERT INTO choice_counts (
+         multiple_choice_id, question_id, answer_count)
+       SELECT id, question_id, 0 FROM import_multiple_choices
+    """,
+)
+
+CREATE_TAGS_SQL = """
+INSERT INTO tags (name, creator_id)
+SELECT DISTINCT tag_names.name, CAST(:creator_id AS integer)
+FROM import_quests, unnest(import_quests.tags) AS tag_names(name)
+WHERE NOT EXISTS (SELECT 1 FROM tags WHERE tags.name = tag_names.name)
+"""
+
+
+class BundleError(Exception):
+    """Raised for a bundle with invalid rows, none of which have been
+    imported.  errors holds a {'row': ..., 'message': ...} dictionary
+    for each of them, row saying where in the bundle the row is.
+    """
+
+    def __init__(self, errors):
+        super(BundleError, self).__init__(
+                '%d invalid rows in the bundle' % len(errors))
+        self.errors = errors
+
+
+def parse_row(parsers, location, values, errors):
+    """Parse the row's values with each of the parsers, returning the
+    combined arguments, or None after adding to errors if the row is
+    invalid.
+    """
+    if not isinstance(values, dict):
+        errors.append({'row': location, 'message': 'Expected an object'})
+        return None
+    try:
+        return resource.parse_values(parsers, values)
+    except werkzeug.exceptions.HTTPException as error:
+        errors.append({
+            'row': location, 'message': resource.error_message(error)})
+        return None
+
+
+def children(values, key, location, errors):
+    """Return the list of child rows under the key of a JSON row."""
+    if not isinstance(values, dict) or values.get(key) is None:
+        return []
+    elif not isinstance(values[key], list):
+        errors.append({
+            'row': location, 'message': '%s must be a list' % key})
+        return []
+    else:
+        return values[key]
+
+
+def flatten_json(bundle, errors):
+    """Return lists of (location, values) pairs for the quests, questions
+    and multiple choices of a JSON bundle, with refs linking them up.
+    """
+    quests = []
+    questions = []
+    multiple_choices = []
+    if not isinstance(bundle, dict):
+        errors.append({'row': 'bundle', 'message': 'Expected an object'})
+        return quests, questions, multiple_choices
+
+    for quest_index, quest in enumerate(
+            children(bundle, 'quests', 'bundle', errors)):
+        quest_location = 'quests[%d]' % quest_index
+        if isinstance(quest, dict):
+            quest = dict(quest, ref=quest_location)
+        quests.append((quest_location, quest))
+
+        for question_index, question in enumerate(
+                children(quest, 'questions', quest_location, errors)):
+            question_location = '%s.questions[%d]' % (
+                    quest_location, question_index)
+            if isinstance(question, dict):
+                question = dict(
+                        question, ref=question_location,
+                        quest_ref=quest_location)
+            questions.append((question_location, question))
+
+            for choice_index, choice in enumerate(children(
+                    question, 'multiple_choices', question_location,
+                    errors)):
+                choice_location = '%s.multiple_choices[%d]' % (
+                        question_location, choice_index)
+                if isinstance(choice, dict):
+                    choice = dict(choice, question_ref=question_location)
+                multiple_choices.append((choice_location, choice))
+
+    return quests, questions, multiple_choices
+
+
+def read_csv(name, csv_file, errors):
+    """Return (location, values) pairs for the rows of a CSV file.
+    Empty cells are null.
+    """
+    rows = []
+    if csv_file is None:
+        return rows
+    # The header is line 1.
+    for line, cells in enumerate(csv.DictReader(csv_file), 2):
+        location = '%s.csv line %d' % (name, line)
+        values = {}
+        for column, cell in cells.iteritems():
+            if column is None or cell is None or cell == '':
+                continue
+            elif column in JSON_COLUMNS:
+                try:
+                    values[column] = json.loads(cell)
+                except ValueError:
+                    errors.append({
+                        'row': location,
+                        'message': 'Invalid JSON in column %s' % column})
+                    values = None
+                    break
+            else:
+                values[column] = cell
+        if values is not None:
+            rows.append((location, values))
+    return rows
+
+
+def flatten_csv(files, errors):
+    """Return lists of (location, values) pairs for the quests, questions
+    and multiple choices in a dictionary of CSV files, any of which may
+    be missing.
+    """
+    return tuple(read_csv(name, files.get(name), errors) for name in (
+        'quests', 'questions', 'multiple_choices'))
+
+
+def invalid_ref(values, key='ref'):
+    """Return the ref of an invalid row, if it has one, so that rows
+    referring to it aren't reported as well.
+    """
+    if isinstance(values, dict) and isinstance(values.get(key), basestring):
+        return values[key]
+    else:
+        return None
+
+
+def validate_quests(quests, errors):
+    """Parse the quest rows of a bundle, returning a list of the valid
+    rows' arguments and the set of refs, valid or not, that questions
+    may refer to, and adding to errors for the rest.
+    """
+    parsers = (QUEST_REF_PARSER, backend.quest_views.QuestBase.parser)
+    valid_quests = []
+    quest_refs = set()
+    for location, values in quests:
+        args = parse_row(parsers, location, values, errors)
+        if args is None:
+            quest_refs.add(invalid_ref(values))
+        elif args['ref'] in quest_refs:
+            errors.append({
+                'row': location, 'message': 'Duplicate ref %s' % args['ref']})
+        else:
+            quest_refs.add(args['ref'])
+            valid_quests.append(args)
+    return valid_quests, quest_refs
+
+
+def validate_questions(questions, quest_refs, errors):
+    """Parse the question rows of a bundle and check they refer to known
+    quests, returning a list of the valid rows' arguments and a
+    dictionary of the types of the questions by ref, None for invalid
+    questions, and adding to errors for the rest.
+    """
+    parsers = (
+            QUESTION_REF_PARSER,
+            backend.question_views.make_parser(with_question_type=True))
+    valid_questions = []
+    question_types = {}
+    question_counts = collections.Counter()
+    for location, values in questions:
+        args = parse_row(parsers, location, values, errors)
+        if args is None:
+            question_types[invalid_ref(values)] = None
+        elif args['ref'] in question_types:
+            errors.append({
+                'row': location, 'message': 'Duplicate ref %s' % args['ref']})
+        elif args['quest_ref'] not in quest_refs:
+            errors.append({
+                'row': location,
+                'message': 'Unknown quest_ref %s' % args['quest_ref']})
+        else:
+            question_types[args['ref']] = args['question_type']
+            # Questions keep their order in the bundle.
+            question_counts[args['quest_ref']] += 1
+            args['order'] = question_counts[args['quest_ref']]
+            valid_questions.append(args)
+    return valid_questions, question_types
+
+
+def validate_choices(multiple_choices, question_types, errors):
+    """Parse the multiple choice rows of a bundle and check they refer
+    to known multiple choice questions, returning a list of the valid
+    rows' arguments and adding to errors for the rest.
+    """
+    parsers = (
+            MULTIPLE_CHOICE_REF_PARSER,
+            backend.question_views.MultipleChoiceBase.parser)
+    valid_choices = []
+    for location, values in multiple_choices:
+        args = parse_row(parsers, location, values, errors)
+        if args is None:
+            continue
+        elif args['question_ref'] not in question_types:
+            errors.append({
+                'row': location,
+                'message': 'Unknown question_ref %s' % args['question_ref']})
+        elif question_types[args['question_ref']] not in (
+                None, 'multiple_choice'):
+            errors.append({
+                'row': location,
+                'message': 'Tried to link a multiple choice answer '
+                'to a non-multiple choice question'})
+        else:
+            valid_choices.append(args)
+    return valid_choices
+
+
+def validate(quests, questions, multiple_choices, errors):
+    """Parse and cross-check the flattened rows of a bundle, returning
+    lists of the valid rows' arguments and adding to errors for the
+    rest.
+    """
+    valid_quests, quest_refs = validate_quests(quests, errors)
+    valid_questions, question_types = validate_questions(
+            questions, quest_refs, errors)
+    valid_choices = validate_choices(multiple_choices, question_types, errors)
+    return valid_quests, valid_questions, valid_choices
+
+
+def encode(value):
+    """Return the value as a byte string."""
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    else:
+        return str(value)
+
+
+def copy_text(value):
+    """Return the value as an escaped field of COPY's text format.
+    Lists become array literals, whose elements are quoted for the
+    array and then escaped for COPY along with the rest of the field.
+    """
+    if value is None:
+        return '\\N'
+    elif isinstance(value, bool):
+        return 't' if value else 'f'
+    elif isinstance(value, list):
+        value = '{%s}' % ','.join('"%s"' % encode(element).replace(
+            '\\', '\\\\').replace('"', '\\"') for element in value)
+    else:
+        value = encode(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace(
+            '\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(cursor, table, columns, rows):
+    """COPY the given columns of the rows, dictionaries, into the table."""
+    data = io.BytesIO()
+    for row in rows:
+        data.write('\t'.join(copy_text(row[column]) for column in columns))
+        data.write('\n')
+    data.seek(0)
+    cursor.copy_expert('COPY %s (%s) FROM STDIN' % (
+        table, ', '.join('"%s"' % column for column in columns)), data)
+
+
+def import_bundle(rows, errors, creator_id):
+    """Validate the rows of a bundle, as flattened by flatten_json or
+    flatten_csv along with any errors found doing so, and import them
+    in the current transaction, leaving the caller to commit.  Raises
+    BundleError, having imported nothing, if any rows are invalid.
+    Returns the refs and new ids of the quests, in bundle order, and
+    counts of what was created.
+    """
+    errors = list(errors)
+    quests, questions, multiple_choices = validate(*rows, errors=errors)
+    if errors:
+        raise BundleError(errors)
+
+    session = backend.db.session
+    session.execute(STAGING_DDL)
+    cursor = session.connection().connection.cursor()
+    try:
+        copy_rows(
+                cursor, 'import_quests', ('ref',) + QUEST_FIELDS + ('tags',),
+                quests)
+        copy_rows(
+                cursor, 'import_questions',
+                ('ref', 'quest_ref') + QUESTION_FIELDS + ('order',),
+                questions)
+        copy_rows(
+                cursor, 'import_multiple_choices',
+                ('question_ref',) + MULTIPLE_CHOICE_FIELDS, multiple_choices)
+    finally:
+        cursor.close()
+
+    params = {'creator_id': creator_id}
+    tags_created = session.execute(CREATE_TAGS_SQL, params).rowcount
+    for statement in MERGE_SQL:
+        session.execute(statement, params)
+    quest_ids = dict(session.execute(
+            'SELECT ref, id FROM import_quests').fetchall())
+
+    return {
+        'quests': [{
+            'ref': quest['ref'], 'id': quest_ids[quest['ref']]} for
+            quest in quests],
+        'tags_created': tags_created,
+        'question_count': len(questions),
+        'multiple_choice_count': len(multiple_choices)}
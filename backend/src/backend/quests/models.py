@@ -12,14 +12,20 @@ join_table = db.Table('mission_quests', db.Model.metadata,
     db.Column(
         'mission_id', db.Integer, db.ForeignKey('missions.id'), index=True),
     db.Column('quest_id', db.Integer, db.ForeignKey('quests.id'), index=True),
+    db.Column('position', db.Integer, nullable=False),
     db.UniqueConstraint('mission_id', 'quest_id')
 )
 db.Index(
         'ix_mission_quests_id_combo',
         join_table.c.mission_id, join_table.c.quest_id)
+# Used to read a mission's quests in order.
+db.Index(
+        'ix_mission_quests_position',
+        join_table.c.mission_id, join_table.c.position)
+models.record_changes(join_table, 'mission_id', 'quest_id')
 
 
-class Tag(db.Model, models.CreatedBy):
+class Tag(db.Model, models.CreatedBy, models.Timestamps):
     """Tags are associated with quests to aid their searchability."""
 
     __tablename__ = 'tags'
@@ -32,6 +38,11 @@ class Tag(db.Model, models.CreatedBy):
         """Return the URL for this resource."""
         return backend.api.url_for(backend.quest_views.Tag, tag_id=self.id)
 
+# Serves syncing the tags with ?updated_since=.
+db.Index('ix_tags_updated_at', Tag.updated_at)
+models.record_deletions(Tag.__table__)
+models.record_changes(Tag.__table__)
+
 
 class QuestTags(db.Model):
     """Join table linking quests to tags."""
@@ -47,8 +58,10 @@ class QuestTags(db.Model):
                 'quests.id', onupdate='CASCADE', ondelete='CASCADE'),
             nullable=False, index=True, primary_key=True)
 
+models.record_changes(QuestTags.__table__, 'quest_id', 'tag_id')
+
 
-class Quest(db.Model, models.CreatedBy):
+class Quest(db.Model, models.CreatedBy, models.Timestamps):
     """Quests are activities within a mission.  Mentors create quests
     and link them to missions.  Learners complete quests.
     """
@@ -73,10 +86,13 @@ class Quest(db.Model, models.CreatedBy):
             postgresql.ARRAY(db.String), nullable=False, default=[])
     icon_url = db.Column(db.String, nullable=True)
 
-    questions = db.relationship("Question", backref="quest")
+    questions = db.relationship(
+            "Question", backref="quest",
+            order_by="Question.order")
 
     missions = db.relationship(
-            "Mission", secondary=join_table, backref="quests")
+            "Mission", secondary=join_table, backref=db.backref(
+                "quests", order_by=join_table.c.position))
     tags = db.relationship(
             "Tag", secondary=QuestTags.__table__, backref="quests")
 
@@ -85,3 +101,9 @@ class Quest(db.Model, models.CreatedBy):
         """Return the URL for this resource."""
         return backend.api.url_for(
                 backend.quest_views.Quest, quest_id=self.id)
+
+# Serves syncing a user's quests with ?updated_since=.
+db.Index(
+        'ix_quests_creator_updated_at', Quest.creator_id, Quest.updated_at)
+models.record_deletions(Quest.__table__)
+models.record_changes(Quest.__table__)
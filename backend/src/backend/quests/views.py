@@ -3,12 +3,21 @@
 
 import flask
 import flask_restful
+import sqlalchemy
 import sqlalchemy.orm as orm
 import sqlalchemy.exc
 
+import backend
+import backend.common.auth as auth
+import backend.common.database as database
+import backend.common.instrumentation as instrumentation
+import backend.common.ordering as ordering
 import backend.common.resource as resource
 import backend.common.s3 as s3
+import backend.common.sync as sync
 import backend.missions.models as mission_models
+import backend.progress.models as progress_models
+import backend.quests.importer as importer
 import backend.quests.models as quest_models
 
 
@@ -61,6 +70,23 @@ class Quest(QuestBase, resource.SimpleResource):
         return quest_models.Quest.query.filter_by(id=quest_id).options(
                 orm.joinedload('tags'))
 
+    def delete(self, quest_id):
+        """Delete the quest, first un-linking it from its missions, which
+        takes progress through it out of their progress.  Its own
+        progress is deleted along with it.
+        """
+        if not quest_models.Quest.query.filter_by(id=quest_id).count():
+            return flask.Response('', 404)
+        else:
+            mission_ids = [mission_id for (mission_id,) in
+                    backend.db.session.execute(
+                        progress_models.missions_of(quest_id))]
+            for mission_id in mission_ids:
+                QuestMissionLinkList.unlink(mission_id, [quest_id])
+            quest_models.Quest.query.filter_by(id=quest_id).delete(
+                    synchronize_session=False)
+            backend.db.session.commit()
+
 
 class QuestList(QuestBase, resource.SimpleCreate):
     """Resource for working with collections of quests."""
@@ -68,15 +94,177 @@ class QuestList(QuestBase, resource.SimpleCreate):
     resource_type = quest_models.Quest
 
 
+class QuestClone(QuestBase, flask_restful.Resource):
+    """Deep copies of quests, made for mentors to adapt."""
+
+    parser = resource.RequestParser()
+    parser.add_argument('name', type=str)
+    parser.add_argument('copy_assets', type=bool, default=False)
+
+    # Ids for the copied questions are drawn in the original order
+    # before anything is inserted, so that the copies of the multiple
+    # choices can be pointed at the copies of their questions.
+    copy_questions_sql = """
+        WITH question_ids AS (
+          SELECT id AS old_id, nextval('questions_id_seq') AS new_id
+          FROM (SELECT id FROM questions
+                WHERE quest_id = :quest_id ORDER BY id) AS originals
+        ), new_questions AS (
+          INSERT INTO questions (
+            id, description, question_type, question_group, "order",
+            quest_id, creator_id)
+          SELECT
+            question_ids.new_id, description, question_type,
+            question_group, "order", :new_quest_id, :creator_id
+          FROM questions
+          JOIN question_ids ON question_ids.old_id = questions.id
+        ), new_choices AS (
+          INSERT INTO multiple_choices (
+            answer, is_correct, "order", question_id, creator_id)
+          SELECT
+            answer, is_correct, "order", question_ids.new_id, :creator_id
+          FROM multiple_choices
+          JOIN question_ids
+            ON question_ids.old_id = multiple_choices.question_id
+          ORDER BY multiple_choices.id
+          RETURNING id, question_id
+        )
+        INSERT INTO choice_counts (
+          multiple_choice_id, question_id, answer_count)
+        SELECT id, question_id, 0 FROM new_choices
+    """
+
+    @staticmethod
+    def copy_quest(quest_id, name, creator_id):
+        """Copy the quest's row and tag links, returning the new id or
+        None if there is no such quest.
+        """
+        quests = quest_models.Quest.__table__
+        quest_tags = quest_models.QuestTags.__table__
+
+        # The copy's timestamps are its own, so that syncing picks it up.
+        columns = [column for column in quests.c if column.name not in (
+            'id', 'name', 'creator_id', 'created_at', 'updated_at')]
+        new_name = quests.c.name if name is None else sqlalchemy.literal(name)
+        new_quest_id = backend.db.session.execute(
+                quests.insert(inline=True).from_select(
+                    [column.name for column in columns] + [
+                        'name', 'creator_id'],
+                    sqlalchemy.select(columns + [
+                        new_name, sqlalchemy.literal(creator_id)]).where(
+                            quests.c.id == quest_id)).returning(
+                                quests.c.id)).scalar()
+        if new_quest_id is not None:
+            backend.db.session.execute(
+                    quest_tags.insert(inline=True).from_select(
+                        ['quest_id', 'tag_id'], sqlalchemy.select([
+                            sqlalchemy.literal(new_quest_id),
+                            quest_tags.c.tag_id]).where(
+                                quest_tags.c.quest_id == quest_id)))
+        return new_quest_id
+
+    @staticmethod
+    def copy_assets(quest, quest_id):
+        """Copy the assets uploaded for the quest with the given id to
+        the new quest, within S3, and point the new quest's links at the
+        copies.
+        """
+        old_prefix = 'quests/%s/' % quest_id
+        new_prefix = 'quests/%s/' % quest.id
+        bucket = s3.get_bucket()
+        with instrumentation.timed('s3'):
+            for key in bucket.list(prefix=old_prefix):
+                if len(key.key) != len(old_prefix):
+                    bucket.copy_key(
+                            new_prefix + key.key[len(old_prefix):],
+                            bucket.name, key.key,
+                            headers={'x-amz-acl': 'public-read'})
+
+        old_path = '/' + old_prefix
+        new_path = '/' + new_prefix
+        if quest.icon_url is not None:
+            quest.icon_url = quest.icon_url.replace(old_path, new_path)
+        quest.video_links = [
+                link.replace(old_path, new_path) for link in quest.video_links]
+
+    def post(self, quest_id):
+        """Copy the quest with its tags, questions and multiple choices,
+        and optionally its uploaded assets, returning the copy.
+        """
+        args = self.parser.parse_args()
+        creator_id = auth.current_user_id()
+        new_quest_id = self.copy_quest(quest_id, args['name'], creator_id)
+        if new_quest_id is None:
+            backend.db.session.rollback()
+            return flask.Response('', 404)
+
+        backend.db.session.execute(sqlalchemy.text(self.copy_questions_sql), {
+            'quest_id': quest_id, 'new_quest_id': new_quest_id,
+            'creator_id': creator_id})
+        quest = Quest.query(new_quest_id).one()
+        if args['copy_assets']:
+            self.copy_assets(quest, quest_id)
+        backend.db.session.commit()
+        return self.as_dict(quest)
+
+
+class QuestImport(flask_restful.Resource):
+    """Bulk import of quests with their tags, questions and multiple
+    choices.
+    """
+
+    @staticmethod
+    def post():
+        """Import a JSON bundle, or CSV files uploaded as a multipart
+        form, all or nothing.
+        """
+        errors = []
+        if flask.request.files:
+            rows = importer.flatten_csv(flask.request.files, errors)
+        else:
+            rows = importer.flatten_json(
+                    flask.request.get_json(force=True, silent=True), errors)
+
+        try:
+            result = importer.import_bundle(
+                    rows, errors, auth.current_user_id())
+        except importer.BundleError as error:
+            flask_restful.abort(
+                    400, message='The bundle has invalid rows.',
+                    errors=error.errors)
+        except sqlalchemy.exc.IntegrityError:
+            # e.g. a tag of the same name was created concurrently
+            backend.db.session.rollback()
+            flask_restful.abort(
+                    409, message='The import clashed with another change, '
+                    'please try again.')
+        backend.db.session.commit()
+
+        for quest in result['quests']:
+            quest['url'] = backend.api.url_for(Quest, quest_id=quest['id'])
+        return result
+
+
 class QuestUserList(QuestBase, flask_restful.Resource):
     """Resource for working with collections of quests linked to users."""
 
+    @database.read_replica
     def get(self, user_id):
-        """Return a list of quests linked to the given user_id."""
-        query = quest_models.Quest.query.filter_by(creator_id=user_id)
-        quests = query.all()
-
-        return {'quests': [self.as_dict(quest) for quest in quests]}
+        """Return a list of quests linked to the given user_id, or with
+        ?updated_since= those changed since the given time.
+        """
+        quest_model = quest_models.Quest
+        query = quest_model.query.filter_by(creator_id=user_id)
+        since = sync.updated_since()
+        if since is None:
+            quests = query.all()
+            return {'quests': [self.as_dict(quest) for quest in quests]}
+        else:
+            quests = query.filter(quest_model.updated_at >= since).order_by(
+                    quest_model.updated_at, quest_model.id)
+            return sync.changes(
+                    'quests', [self.as_dict(quest) for quest in quests],
+                    quest_model.__tablename__, since, creator_id=user_id)
 
 
 class QuestMissionLink(resource.ManyToManyLink):
@@ -86,10 +274,30 @@ class QuestMissionLink(resource.ManyToManyLink):
     right_id_name = quest_models.join_table.c.quest_id
     join_table = quest_models.join_table
 
+    def link_values(self, left_id, right_id):
+        """Add newly linked quests to the end of the mission."""
+        position = quest_models.join_table.c.position
+        return {position: sqlalchemy.select([
+            sqlalchemy.func.coalesce(sqlalchemy.func.max(position), 0) + 1
+            ]).where(self.left_id_name == left_id).as_scalar()}
+
+    def after_link(self, left_id, right_id):
+        """Count progress through the quest towards the mission."""
+        progress_models.quest_linked(left_id, right_id, 1)
+
+    def after_unlink(self, left_id, right_id):
+        """Stop counting progress through the quest towards the mission."""
+        progress_models.quest_linked(left_id, right_id, -1)
+
 
 class QuestMissionLinkList(QuestBase, flask_restful.Resource):
-    """List quests linked to a given mission."""
+    """List quests linked to a given mission, in order."""
+
+    parser = resource.RequestParser()
+    parser.add_argument(
+            'quest_ids', type=ordering.parse_ids, required=True)
 
+    @database.read_replica
     def get(self, mission_id):
         """List quests linked to a given mission."""
         mission = mission_models.Mission.query.filter_by(
@@ -101,6 +309,73 @@ class QuestMissionLinkList(QuestBase, flask_restful.Resource):
             return {'quests': [self.as_dict(quest) for
                 quest in mission.quests]}
 
+    @staticmethod
+    def unlink(mission_id, quest_ids):
+        """Un-link the quests from the mission."""
+        mission_quests = quest_models.join_table
+        backend.db.session.execute(mission_quests.delete().where(
+            sqlalchemy.and_(
+                mission_quests.c.mission_id == mission_id,
+                mission_quests.c.quest_id.in_(quest_ids))))
+        for quest_id in quest_ids:
+            progress_models.quest_linked(mission_id, quest_id, -1)
+
+    @staticmethod
+    def link(mission_id, positions):
+        """Link the quests to the mission at the given positions, a list
+        of (quest_id, position) pairs.
+        """
+        backend.db.session.execute(
+                quest_models.join_table.insert(), [{
+                    'mission_id': mission_id, 'quest_id': quest_id,
+                    'position': position} for quest_id, position in positions])
+        for quest_id, _ in positions:
+            progress_models.quest_linked(mission_id, quest_id, 1)
+
+    def put(self, mission_id):
+        """Set the mission's quests to the given ordered list of quest
+        ids, linking, un-linking and moving quests as needed.
+        """
+        quest_ids = self.parser.parse_args()['quest_ids']
+        mission_quests = quest_models.join_table
+
+        # Lock the mission so that concurrent changes to its quests are
+        # applied one after the other.
+        mission = mission_models.Mission.query.filter_by(
+                id=mission_id).with_for_update().first()
+        if mission is None:
+            return flask.Response('', 404)
+        if quest_ids and quest_models.Quest.query.filter(
+                quest_models.Quest.id.in_(quest_ids)).count() != len(
+                        quest_ids):
+            backend.db.session.rollback()
+            flask_restful.abort(400, message='Unknown quest ids')
+
+        current = dict(backend.db.session.query(
+            mission_quests.c.quest_id, mission_quests.c.position).filter(
+                mission_quests.c.mission_id == mission_id).all())
+        positions = [
+                (quest_id, position) for
+                position, quest_id in enumerate(quest_ids, 1)]
+
+        wanted = set(quest_ids)
+        removed = [
+                quest_id for quest_id in current if quest_id not in wanted]
+        if removed:
+            self.unlink(mission_id, removed)
+        added = [(quest_id, position) for quest_id, position in positions if
+                quest_id not in current]
+        if added:
+            self.link(mission_id, added)
+        ordering.set_positions(
+                mission_quests.c.position, mission_quests.c.quest_id,
+                mission_quests.c.mission_id, mission_id, [
+                    (quest_id, position) for quest_id, position in positions if
+                    current.get(quest_id, position) != position])
+        backend.db.session.commit()
+
+        return {'quests': [self.as_dict(quest) for quest in mission.quests]}
+
 
 class QuestStaticAsset(flask_restful.Resource):
     """Handle individual assets attached to a quest."""
@@ -119,7 +394,8 @@ class QuestStaticAsset(flask_restful.Resource):
         """Delete the given asset."""
         bucket = s3.get_bucket()
         key = 'quests/%s/%s' % (quest_id, file_name)
-        bucket.delete_key(key)
+        with instrumentation.timed('s3'):
+            bucket.delete_key(key)
 
 
 class QuestStaticAssets(flask_restful.Resource):
@@ -133,8 +409,9 @@ class QuestStaticAssets(flask_restful.Resource):
         prefix_len = len(prefix)
         # The prefix itself may appear as a key, so we filter
         # it out leaving only its children.
-        keys = [key for key in bucket.list(prefix=prefix) if
-                len(key.key) != prefix_len]
+        with instrumentation.timed('s3'):
+            keys = [key for key in bucket.list(prefix=prefix) if
+                    len(key.key) != prefix_len]
         return {'assets': [{
             'url': key.generate_url(0, query_auth=False),
             'file_name': key.key[prefix_len:]} for key in keys]}
@@ -180,10 +457,23 @@ class TagList(TagBase, resource.SimpleCreate):
         except sqlalchemy.exc.IntegrityError:
             flask_restful.abort(400, message=DUPE_TAG_MSG)
 
+    @database.read_replica
     def get(self):
-        """Return all available tags."""
-        tags = self.resource_type.query.all()
-        return {'tags': [self.as_dict(tag) for tag in tags]}
+        """Return all available tags, or with ?updated_since= those
+        changed since the given time.
+        """
+        tag_model = self.resource_type
+        since = sync.updated_since()
+        if since is None:
+            tags = tag_model.query.all()
+            return {'tags': [self.as_dict(tag) for tag in tags]}
+        else:
+            tags = tag_model.query.filter(
+                    tag_model.updated_at >= since).order_by(
+                            tag_model.updated_at, tag_model.id)
+            return sync.changes(
+                    'tags', [self.as_dict(tag) for tag in tags],
+                    tag_model.__tablename__, since)
 
 
 class QuestTagLink(resource.ManyToManyLink):
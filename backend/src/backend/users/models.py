@@ -4,6 +4,7 @@
 import flask_user
 
 import backend
+import backend.common.models as models
 
 db = backend.db
 
@@ -12,7 +13,7 @@ DEFAULT_AVATAR_URL = 'http://s3.amazonaws.com/%s/default-avatar.jpg' % (
         backend.app.config['S3_BUCKET'])
 
 
-class User(db.Model, flask_user.UserMixin):
+class User(db.Model, flask_user.UserMixin, models.Timestamps):
     """A user account for either a learner or a mentor."""
     __tablename__ = 'users'
 
@@ -37,3 +38,6 @@ class User(db.Model, flask_user.UserMixin):
     def url(self):
         """URL for the resource."""
         return backend.api.url_for(backend.user_views.User, user_id=self.id)
+
+models.record_deletions(User.__table__)
+models.record_changes(User.__table__)
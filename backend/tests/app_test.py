@@ -4,6 +4,7 @@
 import json
 import unittest
 
+import backend
 import harness
 
 
@@ -30,6 +31,26 @@ class AppTest(harness.TestHarness):
         resp = self.app.get("/current-user")
         self.assertEqual(json.loads(resp.data), {'user_id': None})
 
+    def test_db_pool_metrics(self):
+        """Test the database pool metrics end-point."""
+        resp = self.app.get("/internal/metrics/db-pool")
+        self.assertEqual(resp.status_code, 200)
+        status = json.loads(resp.data)['primary']
+        self.assertEqual(status['max_overflow'], 10)
+        self.assertIn('+Inf', status['wait_seconds']['buckets'])
+
+        # require the token when one is configured
+        backend.app.config['INTERNAL_TOKEN'] = 'ladders'
+        try:
+            resp = self.app.get("/internal/metrics/db-pool")
+            self.assertEqual(resp.status_code, 404)
+            resp = self.app.get(
+                    "/internal/metrics/db-pool",
+                    headers={'X-Internal-Token': 'ladders'})
+            self.assertEqual(resp.status_code, 200)
+        finally:
+            backend.app.config['INTERNAL_TOKEN'] = None
+
 
 if __name__ == '__main__':
     unittest.main()
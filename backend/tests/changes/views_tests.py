@@ -0,0 +1,119 @@
+"""Tests for the change feed end-point."""
+
+
+import json
+import unittest
+
+import backend
+import backend.common.models as models
+import harness
+
+
+class ChangeTest(harness.TestHarness):
+    """Tests for the change feed end-point."""
+
+    def changes(self, query=''):
+        """Return the page of the change feed for the query string."""
+        resp = self.app.get('/v1/changes' + query)
+        self.assertEqual(resp.status_code, 200)
+        return json.loads(resp.data)
+
+    @staticmethod
+    def summary(page):
+        """Return the (action, resource_type, resource_id, related_id) of
+        each change on the page.
+        """
+        return [(
+            change['action'], change['resource_type'],
+            change['resource_id'], change['related_id']) for
+            change in page['changes']]
+
+    @harness.with_sess(user_id=1)
+    def test_feed(self):
+        """Test resource and link changes are recorded in order."""
+        harness.create_user(name='snakes')
+        resp = self.post_json(
+                self.url_for(backend.quest_views.QuestList),
+                {"name": "mouse", "summary": "nap"})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.post_json(
+                self.url_for(backend.quest_views.TagList), {"name": "cat"})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.app.put('/v1/quests/1/tags/1')
+        self.assertEqual(resp.status_code, 200)
+
+        first_page = self.changes()
+        self.assertEqual(self.summary(first_page), [
+            ('create', 'users', 1, None),
+            ('create', 'quests', 1, None),
+            ('create', 'tags', 1, None),
+            ('link', 'quest_tags', 1, 1)])
+        after = first_page['after']
+        self.assertEqual(after, first_page['changes'][-1]['seq'])
+        self.assertIn('changed_at', first_page['changes'][0])
+
+        # nothing new yet
+        self.assertEqual(
+                self.changes('?after=%d' % after),
+                {'changes': [], 'after': after})
+
+        resp = self.put_json('/v1/quest-tags/1', {"name": "kitten"})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.app.delete('/v1/quests/1/tags/1')
+        self.assertEqual(resp.status_code, 200)
+        # cascaded deletes are recorded too
+        resp = self.post_json(
+                '/v1/quests/1/questions',
+                {"question_type": "text", "description": "?",
+                    'question_group': 'review_quiz'})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.app.delete('/v1/quests/1')
+        self.assertEqual(resp.status_code, 200)
+
+        self.assertEqual(self.summary(self.changes('?after=%d' % after)), [
+            ('update', 'tags', 1, None),
+            ('unlink', 'quest_tags', 1, 1),
+            ('create', 'questions', 1, None),
+            ('delete', 'quests', 1, None),
+            ('delete', 'questions', 1, None)])
+
+        # paging
+        page = self.changes('?limit=2')
+        self.assertEqual(len(page['changes']), 2)
+        self.assertEqual(
+                self.summary(self.changes('?after=%d&limit=1' % (
+                    page['after']))),
+                [('create', 'tags', 1, None)])
+
+        resp = self.app.get('/v1/changes?after=1000')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.app.get('/v1/changes?limit=0')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_running_transactions(self):
+        """Test the changes of unfinished transactions hold back the
+        changes after them.
+        """
+        harness.create_user(name='snakes')
+        self.assertEqual(len(self.changes()['changes']), 1)
+
+        # a transaction writing a change which hasn't committed yet
+        connection = backend.db.engine.connect()
+        transaction = connection.begin()
+        try:
+            connection.execute(models.Change.__table__.insert().values(
+                action='update', resource_type='users', resource_id=1))
+            harness.create_user(name='mice')
+            self.assertEqual(len(self.changes()['changes']), 1)
+        finally:
+            transaction.commit()
+            connection.close()
+
+        self.assertEqual(self.summary(self.changes()), [
+            ('create', 'users', 1, None),
+            ('update', 'users', 1, None),
+            ('create', 'users', 2, None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
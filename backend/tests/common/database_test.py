@@ -0,0 +1,83 @@
+"""Tests for the database module."""
+
+
+import flask
+import json
+import time
+import unittest
+
+import backend
+import backend.common.database as database
+import harness
+
+
+class RoutingSessionTest(harness.TestHarness):
+    """Tests for routing reads to the read replica."""
+
+    def setUp(self):
+        """Point the replica bind at the test database."""
+        super(RoutingSessionTest, self).setUp()
+        self.binds = backend.app.config['SQLALCHEMY_BINDS']
+        backend.app.config['SQLALCHEMY_BINDS'] = {
+                database.REPLICA_BIND:
+                    backend.app.config['SQLALCHEMY_DATABASE_URI']}
+
+    def tearDown(self):
+        """Restore the original binds."""
+        backend.db.session.remove()
+        backend.app.config['SQLALCHEMY_BINDS'] = self.binds
+
+    def test_get_bind(self):
+        """Test picking the engine for a query."""
+        with backend.app.test_request_context():
+            primary = backend.db.get_engine(backend.app)
+            replica = backend.db.get_engine(
+                    backend.app, bind=database.REPLICA_BIND)
+            self.assertIsNot(primary, replica)
+            session = backend.db.session()
+
+            # requests must opt in to the replica
+            self.assertIs(session.get_bind(), primary)
+            flask.g.read_replica = True
+            self.assertIs(session.get_bind(), replica)
+
+            # stick to the primary for a while after writes
+            flask.session['last_write_at'] = time.time()
+            self.assertIs(session.get_bind(), primary)
+            flask.session['last_write_at'] = time.time() - (
+                    backend.app.config['REPLICA_STICKY_SECONDS'] + 1)
+            self.assertIs(session.get_bind(), replica)
+
+            # no replica configured, no replica used
+            backend.app.config['SQLALCHEMY_BINDS'] = None
+            self.assertIs(session.get_bind(), primary)
+
+    @harness.with_sess(user_id=1)
+    def test_record_write(self):
+        """Test that writes are remembered in the session."""
+        harness.create_user(name='snakes')
+        resp = self.app.get('/v1/users/1')
+        self.assertEqual(json.loads(resp.data)['name'], 'snakes')
+        with self.app.session_transaction() as sess:
+            self.assertNotIn('last_write_at', sess)
+
+        resp = self.put_json('/v1/users/1', {
+            'name': 'ladders', 'avatar_url': 'ladders.png'})
+        self.assertEqual(resp.status_code, 200)
+        with self.app.session_transaction() as sess:
+            self.assertIn('last_write_at', sess)
+
+        resp = self.app.get('/v1/users/1')
+        self.assertEqual(json.loads(resp.data)['name'], 'ladders')
+
+        # failed writes don't count
+        with self.app.session_transaction() as sess:
+            del sess['last_write_at']
+        resp = self.put_json('/v1/users/2', {'name': 'ladders'})
+        self.assertEqual(resp.status_code, 404)
+        with self.app.session_transaction() as sess:
+            self.assertNotIn('last_write_at', sess)
+
+
+if __name__ == '__main__':
+    unittest.main()
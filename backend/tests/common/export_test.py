@@ -0,0 +1,62 @@
+"""Tests for the export module."""
+
+
+import json
+import unittest
+
+import backend
+import backend.common.export as export
+import backend.users.models as user_models
+import harness
+
+
+class ExportTest(harness.TestHarness):
+    """Tests for the export module."""
+
+    def test_csv_line(self):
+        """Values are quoted as needed, None is empty and unicode is
+        encoded as utf-8.
+        """
+        self.assertEqual(
+                export.csv_line([1, None, 'a, b', u'\xfc']),
+                '1,,"a, b",\xc3\xbc\r\n')
+
+    def test_stream(self):
+        """Rows are read through a server-side cursor in batches."""
+        harness.create_user(name='snakes')
+        harness.create_user(name='ladders')
+        query = export.stream(backend.db.session.query(
+            user_models.User.id, user_models.User.name).order_by(
+                user_models.User.id))
+        self.assertTrue(query._execution_options['stream_results'])
+        self.assertEqual(query._yield_per, export.YIELD_PER)
+        self.assertEqual(
+                [tuple(row) for row in query], [(1, 'snakes'), (2, 'ladders')])
+
+    def test_responses(self):
+        """Rows are streamed as CSV or NDJSON downloads."""
+        def rows():
+            """Lazily yield some rows."""
+            yield (1, 'snakes')
+            yield (2, None)
+
+        with backend.app.test_request_context():
+            resp = export.csv_response('snakes.csv', ('id', 'name'), rows())
+            self.assertTrue(resp.is_streamed)
+            self.assertEqual(resp.mimetype, 'text/csv')
+            self.assertEqual(
+                    resp.headers['Content-Disposition'],
+                    'attachment; filename=snakes.csv')
+            self.assertEqual(resp.data, 'id,name\r\n1,snakes\r\n2,\r\n')
+
+            resp = export.ndjson_response(
+                    'snakes.ndjson', ('id', 'name'), rows())
+            self.assertTrue(resp.is_streamed)
+            self.assertEqual(resp.mimetype, 'application/x-ndjson')
+            self.assertEqual(
+                    [json.loads(line) for line in resp.data.splitlines()],
+                    [{'id': 1, 'name': 'snakes'}, {'id': 2, 'name': None}])
+
+
+if __name__ == '__main__':
+    unittest.main()
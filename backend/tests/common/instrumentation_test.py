@@ -0,0 +1,68 @@
+"""Tests for the instrumentation module."""
+
+
+import unittest
+
+import backend
+import backend.common.instrumentation as instrumentation
+import harness
+
+
+class InstrumentationTest(harness.TestHarness):
+    """Tests for the instrumentation module."""
+
+    def test_query_hooks(self):
+        """Test timing and counting statements."""
+        statements = []
+
+        def listener(_, statement, parameters, __, seconds):
+            """Remember the statements we are told about."""
+            statements.append((statement, parameters))
+            self.assertGreaterEqual(seconds, 0)
+
+        instrumentation.add_query_listener(listener)
+        try:
+            with backend.app.test_request_context():
+                backend.db.session.execute('SELECT 1')
+                backend.db.session.execute('SELECT 2')
+                self.assertEqual(instrumentation.query_count(), 2)
+                self.assertIn('db', instrumentation.timings())
+        finally:
+            instrumentation.remove_query_listener(listener)
+            backend.db.session.remove()
+
+        self.assertEqual(statements, [('SELECT 1', {}), ('SELECT 2', {})])
+
+    def test_timed(self):
+        """Test the timed context manager."""
+        with backend.app.test_request_context():
+            with instrumentation.timed('s3'):
+                pass
+            with instrumentation.timed('s3'):
+                pass
+            self.assertGreaterEqual(instrumentation.timings()['s3'], 0)
+
+        # no request, nothing to record against
+        with instrumentation.timed('s3'):
+            pass
+
+    def test_request_id(self):
+        """Test the request id comes from the router's header."""
+        with backend.app.test_request_context(
+                headers={'X-Request-Id': 'abc'}):
+            self.assertEqual(instrumentation.request_id(), 'abc')
+        with backend.app.test_request_context():
+            request_id = instrumentation.request_id()
+            self.assertEqual(len(request_id), 32)
+            self.assertEqual(instrumentation.request_id(), request_id)
+
+    def test_resource_name(self):
+        """Test naming the resource handling a request."""
+        with backend.app.test_request_context('/v1/users/1'):
+            self.assertEqual(instrumentation.resource_name(), 'User')
+        with backend.app.test_request_context('/'):
+            self.assertEqual(instrumentation.resource_name(), 'index')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+"""Tests for the logs module."""
+
+
+import flask
+import importlib
+import json
+import logging
+import Queue
+import sys
+import unittest
+
+import backend
+import backend.common.logs as logs
+
+
+class RecordingHandler(logging.Handler):
+    """Logging handler which remembers the formatted records it is given."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.lines = []
+
+    def emit(self, record):
+        """Remember the formatted record."""
+        self.lines.append(self.format(record))
+
+
+class LogsTest(unittest.TestCase):
+    """Tests for the logs module."""
+
+    def setUp(self):
+        """Set up a logger to write through a queue."""
+        self.handler = RecordingHandler()
+        self.logger = logging.getLogger('backend.logs_test')
+        self.logger.propagate = False
+        self.queue_handler = self.listener = None
+
+    def tearDown(self):
+        """Stop logging through the queue."""
+        self.logger.removeHandler(self.queue_handler)
+
+    def log_through_queue(self, max_size):
+        """Send our logger's records through a queue of the given size."""
+        self.queue_handler, self.listener = logs.queue_logging(
+                self.handler, max_size)
+        self.logger.addHandler(self.queue_handler)
+
+    def test_json(self):
+        """Test writing records as JSON with the request's details."""
+        self.log_through_queue(100)
+        self.listener.start()
+        with backend.app.test_request_context(
+                '/v1/users/1', headers={'X-Request-Id': 'abc'}):
+            flask.session['user_id'] = 3
+            self.logger.warning('snakes %s', 'ladders', extra={'status': 404})
+            try:
+                raise ValueError('cats')
+            except ValueError:
+                self.logger.exception('oops')
+        self.logger.info('no request')
+        self.listener.stop()
+
+        lines = [json.loads(line) for line in self.handler.lines]
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].pop('time').endswith('Z'))
+        self.assertEqual(lines[0], {
+            'level': 'WARNING', 'logger': 'backend.logs_test',
+            'message': 'snakes ladders', 'status': 404,
+            'request_id': 'abc', 'route': 'User', 'method': 'GET',
+            'path': '/v1/users/1', 'user_id': 3})
+        self.assertIn('ValueError: cats', lines[1]['exception'])
+        self.assertNotIn('request_id', lines[2])
+
+    def test_drops(self):
+        """Test that records are dropped rather than waited on."""
+        self.log_through_queue(2)
+        for i in range(4):
+            self.logger.warning('record %s', i)
+        self.assertEqual(self.queue_handler.dropped, 2)
+
+        self.listener.start()
+        self.listener.stop()
+        self.assertEqual(
+                [json.loads(line)['message'] for line in self.handler.lines],
+                ['record 0', 'record 1'])
+
+    def test_gevent(self):
+        """Test the listener and its queue use the unpatched thread
+        module under gevent's monkey-patching.
+        """
+        class Monkey(object):
+            """Stand in for gevent.monkey, recording what's asked for."""
+            originals = []
+
+            def get_original(self, module_name, name):
+                """Return the attribute as it is, noting the request."""
+                self.originals.append((module_name, name))
+                return getattr(importlib.import_module(module_name), name)
+
+        sys.modules['gevent.monkey'] = Monkey()
+        try:
+            self.log_through_queue(10)
+            self.listener.start()
+            self.logger.warning('snakes')
+            self.listener.stop()
+        finally:
+            del sys.modules['gevent.monkey']
+
+        self.assertEqual(
+                [json.loads(line)['message'] for line in self.handler.lines],
+                ['snakes'])
+        self.assertIn(('thread', 'start_new_thread'), Monkey.originals)
+        self.assertIn(('thread', 'allocate_lock'), Monkey.originals)
+
+    def test_native_queue(self):
+        """Test the queue hands items over in order, up to its size."""
+        queue = logs.NativeQueue(2)
+        queue.put_nowait(1)
+        queue.put_nowait(2)
+        self.assertRaises(Queue.Full, queue.put_nowait, 3)
+        queue.put(None)
+        self.assertEqual(queue.qsize(), 3)
+        self.assertEqual([queue.get() for _ in range(3)], [1, 2, None])
+        self.assertEqual(queue.qsize(), 0)
+
+    def test_log_access(self):
+        """Test the access log entry."""
+        queue = Queue.Queue()
+        queue_handler = logs.QueueHandler(queue)
+        logs.access_logger.addHandler(queue_handler)
+        try:
+            with backend.app.test_request_context('/v1/users/1'):
+                flask.g.request_start_time = 0
+                logs.log_access(flask.Response(status=404))
+        finally:
+            logs.access_logger.removeHandler(queue_handler)
+
+        record = queue.get_nowait()
+        self.assertEqual(record.getMessage(), 'GET /v1/users/1 404')
+        self.assertEqual(record.status, 404)
+        self.assertEqual(record.query_count, 0)
+        self.assertGreater(record.duration, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""Tests for the metrics module."""
+
+
+import os
+import prometheus_client
+import shutil
+import tempfile
+import unittest
+
+import backend.common.metrics as metrics
+import harness
+
+
+class MetricsTest(harness.TestHarness):
+    """Tests for the metrics module."""
+
+    @harness.with_sess(user_id=1)
+    def test_exposition(self):
+        """Test the metrics end-point reports on requests."""
+        harness.create_user(name='snakes')
+        self.app.get('/v1/users/1')
+        self.app.get('/v1/users/2')
+
+        resp = self.app.get('/internal/metrics')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+                resp.headers['Content-Type'],
+                prometheus_client.CONTENT_TYPE_LATEST)
+        for line in (
+                'parklab_http_requests_total{method="GET",'
+                    'resource="User",status="200"}',
+                'parklab_http_requests_total{method="GET",'
+                    'resource="User",status="404"}',
+                'parklab_http_request_seconds_count{method="GET",'
+                    'resource="User"}',
+                'parklab_db_seconds_count{method="GET",resource="User"}',
+                'parklab_serialization_seconds_count{method="GET",'
+                    'resource="User"}',
+                'parklab_response_bytes_count{method="GET",'
+                    'resource="User"}'):
+            self.assertIn(line, resp.data)
+
+    def test_registry(self):
+        """Test aggregating metrics across processes."""
+        self.assertIs(metrics.registry(), prometheus_client.REGISTRY)
+
+        multiproc_dir = tempfile.mkdtemp()
+        os.environ[metrics.MULTIPROC_DIR_VAR] = multiproc_dir
+        try:
+            registry = metrics.registry()
+            self.assertIsNot(registry, prometheus_client.REGISTRY)
+            self.assertEqual(list(registry.collect()), [])
+        finally:
+            del os.environ[metrics.MULTIPROC_DIR_VAR]
+            shutil.rmtree(multiproc_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""Test the common.notifications module."""
+
+
+import Queue
+import unittest
+
+import backend.common.notifications as notifications
+
+
+class TestPut(unittest.TestCase):
+    """Test the put function."""
+
+    def test_put(self):
+        """Test subscribers which fall behind are sent RESYNC."""
+        queue = Queue.Queue(2)
+        notifications.put(queue, 1)
+        notifications.put(queue, 2)
+        self.assertEqual(queue.qsize(), 2)
+
+        notifications.put(queue, 3)
+        self.assertEqual(queue.get_nowait(), notifications.RESYNC)
+        self.assertTrue(queue.empty())
+
+
+class TestListener(unittest.TestCase):
+    """Test the Listener class without a database connection."""
+
+    def setUp(self):
+        """Subscribe to keys 1 and 2 without starting to listen."""
+        self.listener = notifications.Listener('snakes', 'quest_id')
+        self.listener.thread = 'running'
+        self.listener.listening.set()
+        self.first = self.listener.subscribe(1)
+        self.second = self.listener.subscribe(1)
+        self.other = self.listener.subscribe(2)
+
+    def test_publish(self):
+        """Test events go to the subscribers to their key."""
+        self.listener.publish(1, {'quest_id': 1})
+        self.listener.publish(3, {'quest_id': 3})
+        self.assertEqual(self.first.get_nowait(), {'quest_id': 1})
+        self.assertEqual(self.second.get_nowait(), {'quest_id': 1})
+        self.assertTrue(self.other.empty())
+
+        self.listener.unsubscribe(1, self.first)
+        self.listener.publish(1, {'quest_id': 1})
+        self.assertTrue(self.first.empty())
+        self.assertEqual(self.second.get_nowait(), {'quest_id': 1})
+
+        self.listener.unsubscribe(1, self.second)
+        self.assertEqual(self.listener.subscribers.keys(), [2])
+
+    def test_resync(self):
+        """Test every subscriber is sent RESYNC."""
+        self.listener.resync()
+        for queue in (self.first, self.second, self.other):
+            self.assertEqual(queue.get_nowait(), notifications.RESYNC)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+"""Tests for the partitions module."""
+
+
+import csv
+import datetime
+import gzip
+import os
+import pytz
+import shutil
+import sqlalchemy
+import tempfile
+import unittest
+
+import backend
+import backend.common.partitions as partitions
+import backend.common.slow_queries as slow_queries
+import backend.questions.models as question_models
+import harness
+
+
+class PartitionsTest(harness.TestHarness):
+    """Tests for the partitions module."""
+
+    def setUp(self):
+        """Make a directory for archives."""
+        super(PartitionsTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the archive directory."""
+        shutil.rmtree(self.directory)
+
+    @staticmethod
+    def submit(answer_id, year, month):
+        """Add a row to the answer history submitted in the given month."""
+        backend.db.session.execute(
+                question_models.answer_history.insert().values(
+                    answer_id=answer_id, question_id=1,
+                    question_type='text', answer_text='cats',
+                    submitted_at=datetime.datetime(
+                        year, month, 15, tzinfo=pytz.utc)))
+
+    def test_months_before(self):
+        """Months are counted back across years."""
+        day = datetime.date(2026, 2, 17)
+        self.assertEqual(
+                partitions.months_before(day, 0), datetime.date(2026, 2, 1))
+        self.assertEqual(
+                partitions.months_before(day, 2), datetime.date(2025, 12, 1))
+        self.assertEqual(
+                partitions.months_before(day, 14), datetime.date(2024, 12, 1))
+
+    def test_partitions(self):
+        """Rows go to their month's partition, created as needed, and
+        queries on a range of months only scan its partitions.
+        """
+        self.submit(1, 2026, 1)
+        self.submit(2, 2026, 3)
+        self.submit(3, 2026, 3)
+        backend.db.session.commit()
+
+        self.assertEqual(partitions.partition_months('answer_history'), [
+            (datetime.date(2026, 1, 1), 'answer_history_2026_01'),
+            (datetime.date(2026, 3, 1), 'answer_history_2026_03')])
+        self.assertEqual(backend.db.session.execute(
+            'SELECT answer_id FROM answer_history_2026_03 '
+            'ORDER BY answer_id').fetchall(), [(2,), (3,)])
+        self.assertEqual(backend.db.session.execute(
+            'SELECT count(*) FROM ONLY answer_history').scalar(), 0)
+
+        plan = '\n'.join(slow_queries.explain_rows(
+            backend.db.engine,
+            'SELECT * FROM answer_history WHERE answer_id = 2 '
+            "AND submitted_at >= '2026-03-01'", {}))
+        self.assertIn('answer_history_2026_03', plan)
+        self.assertNotIn('answer_history_2026_01', plan)
+
+    def test_archive(self):
+        """Partitions before the given month are archived and dropped."""
+        self.submit(1, 2025, 12)
+        self.submit(2, 2026, 1)
+        self.submit(3, 2026, 2)
+        backend.db.session.commit()
+
+        file_names = partitions.archive_before(
+                'answer_history', datetime.date(2026, 2, 1), self.directory)
+        self.assertEqual(file_names, [
+            os.path.join(self.directory, 'answer_history_2025_12.csv.gz'),
+            os.path.join(self.directory, 'answer_history_2026_01.csv.gz')])
+        with gzip.open(file_names[1]) as archive:
+            lines = archive.read().splitlines()
+        self.assertEqual(lines[0], ','.join(
+            column.name for column in question_models.answer_history.c))
+        self.assertEqual(
+                lines[1].split(',')[:5], ['2', '1', '', 'text', 'cats'])
+        self.assertEqual(len(lines), 2)
+
+        self.assertEqual(partitions.partition_months('answer_history'), [
+            (datetime.date(2026, 2, 1), 'answer_history_2026_02')])
+        self.assertEqual(
+                [row.answer_id for row in backend.db.session.execute(
+                    sqlalchemy.select([question_models.answer_history]))],
+                [3])
+        self.assertEqual(partitions.archive_before(
+            'answer_history', datetime.date(2026, 2, 1), self.directory), [])
+
+
+    @harness.with_sess(user_id=1)
+    def test_archive_answers(self):
+        """Superseded answers last updated before the given time and
+        answers without a learner are archived and deleted.
+        """
+        harness.create_user(name='snakes')
+        harness.create_user(name='ladders')
+        resp = self.post_json(
+                self.url_for(backend.quest_views.QuestList), {"name": "mouse"})
+        self.assertEqual(resp.status_code, 200)
+        for _ in range(2):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.QuestionList, parent_id=1),
+                    {"question_type": "text", "description": "?",
+                        'question_group': 'review_quiz'})
+            self.assertEqual(resp.status_code, 200)
+
+        # (creator, question, year, month) of answers 1 to 7
+        for creator_id, question_id, year, month in (
+                (1, 1, 2025, 6), (1, 1, 2025, 7), (1, 1, 2026, 3),
+                (1, 2, 2025, 6), (2, 1, 2025, 6), (2, 1, 2025, 6),
+                (None, 1, 2025, 6)):
+            backend.db.session.execute(
+                    question_models.Answer.__table__.insert().values(
+                        creator_id=creator_id, question_id=question_id,
+                        question_type='text', answer_text='cats',
+                        updated_at=datetime.datetime(
+                            year, month, 15, tzinfo=pytz.utc)))
+        backend.db.session.commit()
+
+        file_name = os.path.join(self.directory, 'answers.csv.gz')
+        self.assertEqual(question_models.archive_answers(
+            datetime.datetime(2026, 1, 1, tzinfo=pytz.utc), file_name), 4)
+        backend.db.session.commit()
+
+        with gzip.open(file_name) as archive:
+            rows = list(csv.DictReader(archive))
+        self.assertEqual(
+                sorted(int(row['id']) for row in rows), [1, 2, 5, 7])
+        self.assertEqual(rows[0]['answer_text'], 'cats')
+        self.assertEqual(
+                [answer.id for answer in question_models.Answer.query.order_by(
+                    question_models.Answer.id)],
+                [3, 4, 6])
+
+if __name__ == '__main__':
+    unittest.main()
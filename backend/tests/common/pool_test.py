@@ -0,0 +1,68 @@
+"""Tests for the pool module."""
+
+
+import sqlalchemy
+import sqlalchemy.exc
+import unittest
+
+import backend
+import backend.common.pool as pool
+
+
+class HistogramTest(unittest.TestCase):
+    """Tests for the Histogram class."""
+
+    def test_observe(self):
+        """Test counting observations into buckets."""
+        histogram = pool.Histogram((1, 5))
+        for value in (0.5, 1, 3, 10, 20):
+            histogram.observe(value)
+        self.assertEqual(histogram.as_dict(), {
+            'buckets': {'1': 2, '5': 1, '+Inf': 2},
+            'count': 5,
+            'sum': 34.5})
+
+
+class InstrumentedQueuePoolTest(unittest.TestCase):
+    """Tests for the InstrumentedQueuePool class."""
+
+    def setUp(self):
+        """Create an engine with a single pooled connection."""
+        self.engine = sqlalchemy.create_engine(
+                backend.app.config['SQLALCHEMY_DATABASE_URI'],
+                poolclass=pool.InstrumentedQueuePool,
+                pool_size=1, max_overflow=0, pool_timeout=0,
+                pool_events=[(pool.ping_connection, 'checkout')])
+
+    def tearDown(self):
+        """Close all connections."""
+        self.engine.dispose()
+
+    def test_stats(self):
+        """Test the stats recorded by the pool."""
+        conn = self.engine.connect()
+        status = self.engine.pool.as_dict()
+        self.assertEqual(status['size'], 1)
+        self.assertEqual(status['checked_out'], 1)
+        self.assertEqual(status['checked_in'], 0)
+        self.assertEqual(status['wait_seconds']['count'], 1)
+        self.assertEqual(status['connection_age_seconds']['count'], 1)
+
+        # the pool is exhausted
+        self.assertRaises(sqlalchemy.exc.TimeoutError, self.engine.connect)
+        self.assertEqual(self.engine.pool.as_dict()['timeouts'], 1)
+
+        conn.close()
+        status = self.engine.pool.as_dict()
+        self.assertEqual(status['checked_out'], 0)
+        self.assertEqual(status['checked_in'], 1)
+        self.assertEqual(status['wait_seconds']['count'], 2)
+
+        # stats carry over when the pool is recreated
+        self.engine.dispose()
+        self.assertEqual(
+                self.engine.pool.as_dict()['wait_seconds']['count'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
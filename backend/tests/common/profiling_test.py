@@ -0,0 +1,120 @@
+"""Tests for the profiling module."""
+
+
+import os
+import shutil
+import sys
+import tempfile
+import thread
+import time
+import unittest
+
+import backend
+import backend.common.profiling as profiling
+import harness
+
+
+class ProfilingTest(harness.TestHarness):
+    """Tests for the profiling module."""
+
+    def setUp(self):
+        """Write profiles to a temporary directory."""
+        super(ProfilingTest, self).setUp()
+        self.profile_dir = tempfile.mkdtemp()
+        backend.app.config['PROFILE_DIR'] = self.profile_dir
+
+    def tearDown(self):
+        """Clean up the profiles."""
+        shutil.rmtree(self.profile_dir)
+        backend.app.config['PROFILE_RESOURCES'] = []
+
+    def test_collapse(self):
+        """Test formatting stacks."""
+        stack = profiling.collapse(sys._getframe()).split(';')
+        self.assertTrue(
+                stack[-1].startswith('test_collapse (profiling_test.py:'))
+        self.assertGreater(len(stack), 1)
+
+    def test_sampler(self):
+        """Test sampling a thread's stack."""
+        sampler = profiling.Sampler(thread.get_ident(), 0.001)
+        sampler.start()
+        time.sleep(0.05)
+        sampler.stop()
+        self.assertTrue(sampler.stacks)
+        self.assertIn('test_sampler (profiling_test.py:', sampler.collapsed())
+
+    def test_sample_greenlet(self):
+        """Test sampling the frame a switched out greenlet waits in."""
+        def waiting():
+            """Stand in for a greenlet waiting on Postgres."""
+            yield
+        suspended = waiting()
+        next(suspended)
+
+        class Greenlet(object):
+            """Stand in for a switched out greenlet."""
+            gr_frame = suspended.gi_frame
+
+        sampler = profiling.Sampler(thread.get_ident(), 0.001, Greenlet())
+        sampler.start()
+        time.sleep(0.05)
+        sampler.stop()
+        self.assertEqual(sampler.stacks.keys(), [
+            profiling.collapse(suspended.gi_frame)])
+        self.assertIn('waiting (profiling_test.py:', sampler.collapsed())
+
+    def test_original(self):
+        """Test the standard library is used as is without gevent."""
+        self.assertIs(profiling.original('thread', 'get_ident'),
+                thread.get_ident)
+        self.assertIsNone(profiling.current_greenlet())
+
+    def test_tokens(self):
+        """Test signing and checking profiling tokens."""
+        with backend.app.app_context():
+            token = profiling.make_token()
+            self.assertTrue(profiling.valid_token(token))
+            self.assertFalse(profiling.valid_token(token + 'x'))
+            self.assertFalse(profiling.valid_token('snakes'))
+
+    def test_profile_request(self):
+        """Test profiling requests."""
+        # no profiling by default
+        resp = self.app.get('/v1/users/1')
+        self.assertNotIn('X-Profile-Id', resp.headers)
+        resp = self.app.get(
+                '/v1/users/1', headers={'X-Profile': 'snakes'})
+        self.assertNotIn('X-Profile-Id', resp.headers)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+        # profile with a token
+        with backend.app.app_context():
+            token = profiling.make_token()
+        resp = self.app.get('/v1/users/1', headers={
+            'X-Profile': token, 'X-Request-Id': 'abc'})
+        self.assertEqual(resp.headers['X-Profile-Id'], 'abc')
+        self.assertTrue(os.path.exists(
+            os.path.join(self.profile_dir, 'abc.folded')))
+
+        # request ids which aren't safe file names are replaced
+        for request_id in ('../../x', '/tmp/x', 'a.b'):
+            resp = self.app.get('/v1/users/1', headers={
+                'X-Profile': token, 'X-Request-Id': request_id})
+            profile_id = resp.headers['X-Profile-Id']
+            self.assertRegexpMatches(profile_id, '^[a-f0-9-]{36}$')
+            self.assertTrue(os.path.exists(
+                os.path.join(self.profile_dir, '%s.folded' % profile_id)))
+        self.assertEqual(len(os.listdir(self.profile_dir)), 4)
+
+        # or by resource
+        backend.app.config['PROFILE_RESOURCES'] = ['User']
+        resp = self.app.get('/v1/users/1')
+        self.assertTrue(os.path.exists(os.path.join(
+            self.profile_dir, '%s.folded' % resp.headers['X-Profile-Id'])))
+        resp = self.app.get('/v1/quests/1')
+        self.assertNotIn('X-Profile-Id', resp.headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
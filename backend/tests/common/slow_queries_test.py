@@ -0,0 +1,70 @@
+"""Tests for the slow_queries module."""
+
+
+import logging
+import unittest
+
+import backend
+import backend.common.slow_queries as slow_queries
+import harness
+
+
+class RecordingHandler(logging.Handler):
+    """Logging handler which remembers the messages it is given."""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        """Remember the formatted message."""
+        self.messages.append(record.getMessage())
+
+
+class SlowQueriesTest(harness.TestHarness):
+    """Tests for the slow_queries module."""
+
+    def setUp(self):
+        """Capture the slow query log."""
+        super(SlowQueriesTest, self).setUp()
+        self.handler = RecordingHandler()
+        slow_queries.logger.addHandler(self.handler)
+        self.threshold = backend.app.config['SLOW_QUERY_SECONDS']
+
+    def tearDown(self):
+        """Stop capturing the slow query log."""
+        slow_queries.logger.removeHandler(self.handler)
+        backend.app.config['SLOW_QUERY_SECONDS'] = self.threshold
+
+    def test_explain(self):
+        """Test explaining statements."""
+        with backend.app.app_context():
+            engine = backend.db.engine
+            plan = slow_queries.explain(
+                    engine, 'SELECT * FROM users WHERE id = %(id)s', {'id': 1})
+            self.assertIn('users', plan)
+            self.assertIsNone(slow_queries.explain(engine, 'VACUUM', {}))
+            self.assertIsNone(slow_queries.explain(
+                engine, 'SELECT 1; DELETE FROM users', {}))
+            self.assertIsNotNone(
+                    slow_queries.explain(engine, 'SELECT 1;', {}))
+
+    @harness.with_sess(user_id=1)
+    def test_log_slow_query(self):
+        """Test that slow statements are logged with their plans."""
+        harness.create_user(name='snakes')
+        self.app.get('/v1/users/1')
+        self.assertEqual(self.handler.messages, [])
+
+        backend.app.config['SLOW_QUERY_SECONDS'] = 0
+        self.app.get('/v1/users/1')
+        self.assertTrue(self.handler.messages)
+        message = self.handler.messages[0]
+        self.assertIn('in GET User', message)
+        self.assertIn('FROM users', message)
+        self.assertIn("'id_1': 1", message)
+        self.assertIn('Scan', message)
+
+
+if __name__ == '__main__':
+    unittest.main()
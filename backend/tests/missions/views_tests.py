@@ -154,6 +154,67 @@ class MissionTest(harness.TestHarness):
                     "creator_url": "/v1/users/1",
                     "name": "mouse", "creator_id": 1}]})
 
+    @harness.with_sess(user_id=1)
+    def test_export(self):
+        """Test streaming a mission's quests, questions and answers."""
+        harness.create_user(name='snakes')
+        resp = self.post_json(
+                self.url_for(backend.mission_views.MissionList),
+                {"name": "snakes", "description": "ladders", "points": 3})
+        self.assertEqual(resp.status_code, 200)
+        for quest_name in ('mouse', 'house'):
+            resp = self.post_json(
+                    self.url_for(backend.quest_views.QuestList),
+                    {"name": quest_name})
+            self.assertEqual(resp.status_code, 200)
+            quest_id = json.loads(resp.data)['id']
+            self.app.put('/v1/missions/1/quests/%d' % quest_id)
+        for description in ('why?', 'how?'):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.QuestionList, parent_id=1),
+                    {"question_type": "text", "description": description,
+                        'question_group': 'review_quiz'})
+            self.assertEqual(resp.status_code, 200)
+        for answer_text in ('because', 'just because'):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.AnswerList, parent_id=1),
+                    {"answer_text": answer_text})
+            self.assertEqual(resp.status_code, 200)
+
+        resp = self.app.get('/v1/missions/1/export')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in resp.data.splitlines()]
+        self.assertEqual(rows[0], {
+            'quest_id': 1, 'quest_name': 'mouse', 'question_id': 1,
+            'question_group': 'review_quiz', 'question_type': 'text',
+            'question_description': 'why?', 'answer_id': 1,
+            'creator_id': 1, 'creator_name': 'snakes',
+            'answer_text': 'because', 'answer_upload_url': None,
+            'answer_multiple_choice': None})
+        self.assertEqual(
+                [(row['quest_id'], row['question_id'], row['answer_id']) for
+                    row in rows],
+                [(1, 1, 1), (1, 1, 2), (1, 2, None), (2, None, None)])
+
+        resp = self.app.get('/v1/missions/1/export?format=csv')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'text/csv')
+        lines = resp.data.splitlines()
+        self.assertEqual(lines[0], ','.join(
+            backend.mission_views.MissionExport.fields))
+        self.assertEqual(
+                lines[1], '1,mouse,1,review_quiz,text,why?,1,1,snakes,'
+                'because,,')
+        self.assertEqual(len(lines), 5)
+
+        resp = self.app.get('/v1/missions/1/export?format=xml')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.app.get('/v1/missions/2/export')
+        self.assertEqual(resp.status_code, 404)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,197 @@
+"""Query plan regression tests.
+
+Seeds the database with enough rows for the planner to prefer indexes,
+runs every end-point and fails if any of the statements they run would
+sequentially scan one of the large tables.
+
+Seeding takes a while, so these tests are tagged with the 'plans'
+attribute, left out of be_tests and run on their own by plan_tests.
+"""
+
+
+import nose.plugins.attrib
+import unittest
+
+import backend
+import backend.common.query_plans as query_plans
+import harness
+
+
+# Tables which grow with usage and must always be read through an index.
+WATCHED_TABLES = (
+        'answers', 'questions', 'quest_tags', 'mission_quests',
+        'user_organizations', 'changes')
+# Tables with fewer rows than this may be scanned.
+MIN_ROWS = 1000
+
+SEED_SQL = """
+INSERT INTO users (id, active, username, password, avatar_url)
+SELECT i, true, 'user' || i, '', 'avatar.png'
+FROM generate_series(1, 2000) AS i;
+
+INSERT INTO organizations (id, name, description, creator_id)
+SELECT i, 'org', 'desc', i FROM generate_series(1, 100) AS i;
+
+INSERT INTO user_organizations (organization_id, user_id)
+SELECT i % 100 + 1, i FROM generate_series(1, 2000) AS i;
+
+INSERT INTO missions (id, name, description, points, creator_id)
+SELECT i, 'mission', 'desc', 10, i % 2000 + 1
+FROM generate_series(1, 500) AS i;
+
+INSERT INTO quests (id, name, inquiry_questions, video_links, creator_id)
+SELECT i, 'quest', '{}', '{}', i % 2000 + 1
+FROM generate_series(1, 2000) AS i;
+
+INSERT INTO mission_quests (mission_id, quest_id, position)
+SELECT i % 500 + 1, i, i / 500 FROM generate_series(1, 2000) AS i;
+
+INSERT INTO tags (id, name, creator_id)
+SELECT i, 'tag' || i, 1 FROM generate_series(1, 200) AS i;
+
+INSERT INTO quest_tags (tag_id, quest_id)
+SELECT i % 200 + 1, i FROM generate_series(1, 2000) AS i;
+
+INSERT INTO questions (
+    id, description, question_type, question_group, "order", quest_id,
+    creator_id)
+SELECT i, 'question', 'multiple_choice',
+    (ARRAY['review_quiz', 'lab_report', 'closing_questions']
+        ::question_group[])[i % 3 + 1],
+    (i - 1) / 2000 + 1, i % 2000 + 1, 1
+FROM generate_series(1, 10000) AS i;
+
+INSERT INTO multiple_choices (id, answer, is_correct, "order", question_id)
+SELECT i, 'choice', i % 4 = 0, i % 4, i % 10000 + 1
+FROM generate_series(1, 40000) AS i;
+
+INSERT INTO answers (
+    id, question_type, answer_multiple_choice, question_id, creator_id)
+SELECT i, 'multiple_choice', i % 40000 + 1, (i % 40000 + 1) % 10000 + 1,
+    i % 2000 + 1
+FROM generate_series(1, 50000) AS i;
+
+SELECT setval(pg_get_serial_sequence(t, 'id'), 100000)
+FROM unnest(ARRAY['users', 'organizations', 'missions', 'quests', 'tags',
+    'questions', 'multiple_choices', 'answers']) AS t;
+"""
+
+
+@nose.plugins.attrib.attr('plans')
+class PlanRegressionTest(harness.TestHarness):
+    """Check the plans of the statements run by each end-point."""
+
+    def setUp(self):
+        """Seed the database and update the planner's statistics."""
+        super(PlanRegressionTest, self).setUp()
+        backend.db.session.execute(SEED_SQL)
+        backend.db.session.commit()
+        connection = backend.db.engine.raw_connection()
+        isolation_level = connection.isolation_level
+        try:
+            # ANALYZE can't run inside a transaction block
+            connection.set_isolation_level(0)
+            connection.cursor().execute('ANALYZE')
+        finally:
+            connection.set_isolation_level(isolation_level)
+            connection.close()
+
+    def assert_no_seq_scans(self, recorder):
+        """Fail if any recorded statement scans a watched table."""
+        sizes = query_plans.table_sizes(backend.db.engine, WATCHED_TABLES)
+        for statement, plan in recorder.plans():
+            scanned = query_plans.seq_scans(plan, sizes, MIN_ROWS)
+            self.assertEqual(scanned, [], 'Sequential scan on %s by:\n%s' % (
+                ', '.join(scanned), statement))
+
+    def test_detects_seq_scans(self):
+        """Make sure a missing index is caught."""
+        backend.db.session.execute('DROP INDEX ix_answers_question_updated_at')
+        backend.db.session.execute('DROP INDEX ix_answers_creator_question')
+        backend.db.session.commit()
+        with query_plans.PlanRecorder() as recorder:
+            self.app.get('/v1/questions/1/answers')
+        sizes = query_plans.table_sizes(backend.db.engine, WATCHED_TABLES)
+        scanned = sum((query_plans.seq_scans(plan, sizes, MIN_ROWS) for
+            _, plan in recorder.plans()), [])
+        self.assertEqual(scanned, ['answers'])
+
+    @harness.with_sess(user_id=1)
+    def test_reads(self):
+        """Check the plans of GET end-points."""
+        urls = (
+                '/v1/users/1',
+                '/v1/users/1/missions',
+                '/v1/users/1/quests',
+                '/v1/missions/1',
+                '/v1/missions/1/quests',
+                '/v1/quests/1',
+                '/v1/quest-tags/1',
+                '/v1/quests/2/questions',
+                '/v1/quests/2/questions?question_group=review_quiz',
+                '/v1/quests/2/questions?question_group=review_quiz,lab_report',
+                '/v1/quests/2/questions/1',
+                '/v1/questions/1',
+                '/v1/questions/1/answers',
+                '/v1/questions/3/answers/1',
+                '/v1/questions/1/multiple_choices',
+                '/v1/questions/2/multiple_choices/1',
+                '/v1/organizations/1',
+                '/v1/users/1/progress',
+                '/v1/leaderboard',
+                '/v1/organizations/1/leaderboard',
+                '/v1/quests/2/score?user_id=1',
+                '/v1/quests/2/scores?organization_id=1',
+                '/v1/questions/1/answer-stats',
+                '/v1/users/1/missions?updated_since=2000-01-01',
+                '/v1/users/1/quests?updated_since=2000-01-01',
+                '/v1/quests/2/questions?updated_since=2000-01-01',
+                '/v1/questions/1/answers?updated_since=2000-01-01',
+                '/v1/questions/1/multiple_choices?updated_since=2000-01-01',
+                '/v1/quests/2/answer-stats',
+                '/v1/quests/2/answers?question_group=review_quiz',
+                '/v1/quests/2/answers?organization_id=1&after=10',
+                '/v1/quests/2/answers?user_id=3&format=csv',
+                '/v1/missions/1/export',
+                '/v1/changes',
+                '/v1/changes?after=50000')
+        with query_plans.PlanRecorder() as recorder:
+            for url in urls:
+                resp = self.app.get(url)
+                self.assertEqual(resp.status_code, 200, url)
+                # Streamed responses only run their queries when read.
+                resp.get_data()
+        self.assertTrue(recorder.statements)
+        self.assert_no_seq_scans(recorder)
+
+    @harness.with_sess(user_id=1)
+    def test_writes(self):
+        """Check the plans of end-points which write."""
+        with query_plans.PlanRecorder() as recorder:
+            resp = self.post_json(
+                    '/v1/questions/1/answers',
+                    {'answer_multiple_choice': 10000})
+            self.assertEqual(resp.status_code, 200)
+            resp = self.put_json(
+                    '/v1/questions/3/answers/1',
+                    {'answer_multiple_choice': 20002})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(
+                    self.app.delete('/v1/questions/3/answers/1').status_code,
+                    200)
+            self.assertEqual(
+                    self.app.put('/v1/missions/1/quests/2').status_code, 200)
+            self.assertEqual(
+                    self.app.delete('/v1/missions/1/quests/2').status_code,
+                    200)
+            self.assertEqual(
+                    self.app.put('/v1/organizations/1/users/2').status_code,
+                    200)
+            self.assertEqual(
+                    self.app.delete('/v1/quests/3/questions/2').status_code,
+                    200)
+        self.assert_no_seq_scans(recorder)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,290 @@
+"""Tests for learner progress end-points."""
+
+
+import json
+import sqlalchemy.exc
+import threading
+import unittest
+
+import backend
+import backend.common.instrumentation as instrumentation
+import backend.progress.models as progress_models
+import harness
+
+
+class ProgressTest(harness.TestHarness):
+    """Tests for learner progress end-points."""
+
+    def create_quest(self, name, question_count):
+        """Create a quest with the given number of text questions."""
+        resp = self.post_json(
+                self.url_for(backend.quest_views.QuestList), {"name": name})
+        self.assertEqual(resp.status_code, 200)
+        quest_id = json.loads(resp.data)['id']
+        for _ in range(question_count):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.QuestionList,
+                        parent_id=quest_id),
+                    {"question_type": "text", "description": "why?",
+                        'question_group': 'review_quiz'})
+            self.assertEqual(resp.status_code, 200)
+        return quest_id
+
+    def answer(self, question_id):
+        """Answer the given question, returning the new answer's id."""
+        resp = self.post_json(
+                self.url_for(
+                    backend.question_views.AnswerList, parent_id=question_id),
+                {"answer_text": "because"})
+        self.assertEqual(resp.status_code, 200)
+        return json.loads(resp.data)['id']
+
+    def progress(self, user_id):
+        """Return the user's progress."""
+        resp = self.app.get(self.url_for(
+            backend.progress_views.UserProgress, user_id=user_id))
+        self.assertEqual(resp.status_code, 200)
+        return json.loads(resp.data)
+
+    @harness.with_sess(user_id=1)
+    def test_progress(self):
+        """Progress follows answers, questions and mission links."""
+        harness.create_user(name='snakes')
+        harness.create_user(name='ladders')
+        self.assertEqual(self.progress(1), {'quests': [], 'missions': []})
+
+        # quest 1 has questions 1-3 and quest 2 has questions 4-5
+        self.create_quest('mouse', 3)
+        self.create_quest('house', 2)
+        resp = self.post_json(
+                self.url_for(backend.mission_views.MissionList),
+                {"name": "cheese", "description": "hunt", "points": 3})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.app.put('/v1/missions/1/quests/1')
+        self.assertEqual(resp.status_code, 200)
+
+        # answering a question twice only counts once
+        first_answer = self.answer(1)
+        second_answer = self.answer(1)
+        self.answer(2)
+        self.answer(4)
+        self.assertEqual(self.progress(1), {
+            'quests': [
+                {'quest_id': 1, 'quest_url': '/v1/quests/1',
+                    'questions_answered': 2, 'question_count': 3},
+                {'quest_id': 2, 'quest_url': '/v1/quests/2',
+                    'questions_answered': 1, 'question_count': 2}],
+            'missions': [
+                {'mission_id': 1, 'mission_url': '/v1/missions/1',
+                    'questions_answered': 2, 'question_count': 3}]})
+        self.assertEqual(self.progress(2), {'quests': [], 'missions': []})
+
+        # linking a started quest adds its progress to the mission
+        resp = self.app.put('/v1/missions/1/quests/2')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.progress(1)['missions'], [
+            {'mission_id': 1, 'mission_url': '/v1/missions/1',
+                'questions_answered': 3, 'question_count': 5}])
+
+        # the question stays answered until its last answer is deleted
+        resp = self.app.delete('/v1/questions/1/answers/%d' % first_answer)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+                self.progress(1)['missions'][0]['questions_answered'], 3)
+        resp = self.app.delete('/v1/questions/1/answers/%d' % second_answer)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+                self.progress(1)['missions'][0]['questions_answered'], 2)
+        resp = self.app.delete('/v1/questions/1/answers/%d' % second_answer)
+        self.assertEqual(resp.status_code, 404)
+
+        # deleting an answered question takes it out of the counts
+        resp = self.app.delete('/v1/quests/2/questions/4')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.progress(1), {
+            'quests': [
+                {'quest_id': 1, 'quest_url': '/v1/quests/1',
+                    'questions_answered': 1, 'question_count': 3}],
+            'missions': [
+                {'mission_id': 1, 'mission_url': '/v1/missions/1',
+                    'questions_answered': 1, 'question_count': 4}]})
+
+        # as does un-linking a quest from the mission
+        resp = self.app.delete('/v1/missions/1/quests/1')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.progress(1)['missions'], [])
+
+    @harness.with_sess(user_id=1)
+    def test_quest_deleted(self):
+        """Deleting a quest takes it out of its missions' progress."""
+        harness.create_user(name='snakes')
+        self.create_quest('mouse', 1)
+        self.create_quest('house', 1)
+        resp = self.post_json(
+                self.url_for(backend.mission_views.MissionList),
+                {"name": "cheese", "description": "hunt", "points": 3})
+        self.assertEqual(resp.status_code, 200)
+        for quest_id in (1, 2):
+            resp = self.app.put('/v1/missions/1/quests/%d' % quest_id)
+            self.assertEqual(resp.status_code, 200)
+        self.answer(1)
+
+        resp = self.app.delete('/v1/quests/1')
+        self.assertEqual(resp.status_code, 200)
+        resp = self.app.delete('/v1/quests/1')
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(self.progress(1)['missions'], [])
+        # not completed by the deleted quest's answers
+        self.assertEqual(
+                self.leaderboard('/v1/leaderboard')['current_user']['points'],
+                0)
+
+        self.answer(2)
+        self.assertEqual(
+                self.leaderboard('/v1/leaderboard')['current_user']['points'],
+                3)
+
+    @harness.with_sess(user_id=1)
+    def test_query_count(self):
+        """The progress end-point runs the same number of queries however
+        many quests and missions the user has started.
+        """
+        harness.create_user(name='snakes')
+        for quest_id in range(1, 4):
+            self.create_quest('mouse', 2)
+            resp = self.post_json(
+                    self.url_for(backend.mission_views.MissionList),
+                    {"name": "cheese", "description": "hunt", "points": 3})
+            self.assertEqual(resp.status_code, 200)
+            self.app.put('/v1/missions/%d/quests/%d' % (quest_id, quest_id))
+            self.answer(quest_id * 2)
+
+        url = self.url_for(backend.progress_views.UserProgress, user_id=1)
+        with backend.app.test_request_context(url):
+            backend.app.preprocess_request()
+            progress = backend.progress_views.UserProgress().get(1)
+            self.assertEqual(len(progress['quests']), 3)
+            self.assertEqual(len(progress['missions']), 3)
+            self.assertEqual(instrumentation.query_count(), 2)
+
+    def leaderboard(self, url):
+        """Return the leaderboard at the given url."""
+        resp = self.app.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return json.loads(resp.data)
+
+    @harness.with_sess(user_id=1)
+    def test_leaderboard(self):
+        """Completing missions earns points which are ranked."""
+        for name in ('snakes', 'ladders', 'chutes'):
+            harness.create_user(name=name, avatar_url=name + '.png')
+        self.assertEqual(self.leaderboard('/v1/leaderboard'), {
+            'leaders': [],
+            'current_user': {
+                'user_id': 1, 'user_url': '/v1/users/1',
+                'points': 0, 'rank': 1}})
+
+        # mission 1 has quest 1 (questions 1-2) and is worth 5 points,
+        # mission 2 has quest 2 (question 3) and is worth 2 points.
+        self.create_quest('mouse', 2)
+        self.create_quest('house', 1)
+        for points in (5, 2):
+            resp = self.post_json(
+                    self.url_for(backend.mission_views.MissionList),
+                    {"name": "cheese", "description": "hunt",
+                        "points": points})
+            self.assertEqual(resp.status_code, 200)
+        self.app.put('/v1/missions/1/quests/1')
+        self.app.put('/v1/missions/2/quests/2')
+
+        # user 1 completes mission 1, user 2 both and user 3 mission 2
+        first_answer = self.answer(1)
+        self.answer(2)
+        self.update_session(user_id=2)
+        for question_id in (1, 2, 3):
+            self.answer(question_id)
+        self.update_session(user_id=3)
+        self.answer(3)
+        self.answer(1)
+
+        resp = self.post_json(
+                self.url_for(backend.organization_views.OrganizationList),
+                {"name": "cats", "description": "meow"})
+        self.assertEqual(resp.status_code, 200)
+        self.app.put('/v1/organizations/1/users/1')
+        self.app.put('/v1/organizations/1/users/3')
+
+        self.assertEqual(self.leaderboard('/v1/leaderboard?limit=2'), {
+            'leaders': [
+                {'user_id': 2, 'user_url': '/v1/users/2', 'name': 'ladders',
+                    'avatar_url': 'ladders.png', 'points': 7, 'rank': 1},
+                {'user_id': 1, 'user_url': '/v1/users/1', 'name': 'snakes',
+                    'avatar_url': 'snakes.png', 'points': 5, 'rank': 2}],
+            'current_user': {
+                'user_id': 3, 'user_url': '/v1/users/3',
+                'points': 2, 'rank': 3}})
+        self.assertEqual(
+                self.leaderboard('/v1/organizations/1/leaderboard'), {
+                    'leaders': [
+                        {'user_id': 1, 'user_url': '/v1/users/1',
+                            'name': 'snakes', 'avatar_url': 'snakes.png',
+                            'points': 5, 'rank': 1},
+                        {'user_id': 3, 'user_url': '/v1/users/3',
+                            'name': 'chutes', 'avatar_url': 'chutes.png',
+                            'points': 2, 'rank': 2}],
+                    'current_user': {
+                        'user_id': 3, 'user_url': '/v1/users/3',
+                        'points': 2, 'rank': 2}})
+
+        # deleting a question completes mission 1 for user 3, tying them
+        # with user 2.  Points, once earned, are kept.
+        resp = self.app.delete('/v1/quests/1/questions/2')
+        self.assertEqual(resp.status_code, 200)
+        self.update_session(user_id=1)
+        resp = self.app.delete('/v1/questions/1/answers/%d' % first_answer)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([(leader['user_id'], leader['rank']) for
+            leader in self.leaderboard('/v1/leaderboard')['leaders']],
+            [(2, 1), (3, 1), (1, 3)])
+
+        resp = self.app.get('/v1/leaderboard?limit=101')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.app.get('/v1/organizations/2/leaderboard')
+        self.assertEqual(resp.status_code, 404)
+
+
+    def test_concurrent_insert(self):
+        """Test a row inserted by a concurrent transaction is added to
+        rather than failing the insert.
+        """
+        harness.create_user(name='snakes')
+        learner_points = progress_models.LearnerPoints.__table__
+
+        # another transaction inserts the row first, committing while
+        # the insert waits on it
+        connection = backend.db.engine.connect()
+        transaction = connection.begin()
+        connection.execute(learner_points.insert().values(
+            user_id=1, points=5))
+        timer = threading.Timer(0.5, transaction.commit)
+        timer.start()
+        try:
+            progress_models.award_points(1, 3)
+            backend.db.session.commit()
+        finally:
+            timer.join()
+            connection.close()
+
+        self.assertEqual(
+                progress_models.LearnerPoints.query.get(1).points, 8)
+
+    def test_insert_error(self):
+        """Test errors other than concurrent inserts aren't retried."""
+        self.assertRaises(
+                sqlalchemy.exc.IntegrityError,
+                progress_models.award_points, 10, 3)
+        backend.db.session.rollback()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,337 @@
+"""Tests for the quest answer, score and event end-points."""
+
+
+import json
+import unittest
+
+import backend
+import harness
+
+
+class QuestAnswerTest(harness.TestHarness):
+    """Tests for the quest answer, score and event end-points."""
+
+    @harness.with_sess(user_id=1)
+    def test_scores(self):
+        """Test scoring learners' multiple choice answers."""
+        for name in ('snakes', 'ladders', 'chutes'):
+            harness.create_user(name=name)
+        resp = self.post_json(
+                self.url_for(backend.quest_views.QuestList),
+                {"name": "mouse", "summary": "nap"})
+        self.assertEqual(resp.status_code, 200)
+
+        # questions 1 and 2 are in the review quiz, 3 in the lab report
+        # and 4 isn't multiple choice so isn't scored.
+        for question_group in ('review_quiz', 'review_quiz', 'lab_report'):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.QuestionList, parent_id=1),
+                    {"question_type": "multiple_choice", "description": "?",
+                        'question_group': question_group})
+            self.assertEqual(resp.status_code, 200)
+        resp = self.post_json(
+                self.url_for(backend.question_views.QuestionList, parent_id=1),
+                {"question_type": "text", "description": "?",
+                    'question_group': 'review_quiz'})
+        self.assertEqual(resp.status_code, 200)
+
+        # choice 2n - 1 is right and choice 2n is wrong for question n
+        for question_id in (1, 2, 3):
+            for is_correct in (True, False):
+                resp = self.post_json(
+                        self.url_for(
+                            backend.question_views.MultipleChoiceList,
+                            parent_id=question_id),
+                        {'answer': 'a', 'is_correct': is_correct, 'order': 1})
+                self.assertEqual(resp.status_code, 200)
+
+        def answer(question_id, choice_id):
+            """Answer a question with the given choice."""
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.AnswerList,
+                        parent_id=question_id),
+                    {'answer_multiple_choice': choice_id})
+            self.assertEqual(resp.status_code, 200)
+
+        # user 1 gets one right, user 2 changes a wrong answer to a
+        # right one, user 3 doesn't answer.
+        answer(1, 1)
+        answer(2, 4)
+        self.update_session(user_id=2)
+        answer(1, 2)
+        answer(1, 1)
+        answer(3, 5)
+
+        resp = self.app.get('/v1/quests/1/score?user_id=2')
+        self.assertEqual(json.loads(resp.data), {
+            'quest_id': 1, 'user_id': 2, 'question_groups': {
+                'review_quiz': {'total': 2, 'answered': 1, 'correct': 1},
+                'lab_report': {'total': 1, 'answered': 1, 'correct': 1}}})
+
+        resp = self.post_json(
+                self.url_for(backend.organization_views.OrganizationList),
+                {"name": "cats", "description": "meow"})
+        self.assertEqual(resp.status_code, 200)
+        for user_id in (1, 3):
+            self.app.put('/v1/organizations/1/users/%d' % user_id)
+        resp = self.app.get('/v1/quests/1/scores?organization_id=1')
+        self.assertEqual(json.loads(resp.data), {
+            'quest_id': 1, 'organization_id': 1, 'scores': [
+                {'user_id': 1, 'user_url': '/v1/users/1', 'question_groups': {
+                    'review_quiz': {'total': 2, 'answered': 2, 'correct': 1},
+                    'lab_report': {'total': 1, 'answered': 0, 'correct': 0}}},
+                {'user_id': 3, 'user_url': '/v1/users/3', 'question_groups': {
+                    'review_quiz': {'total': 2, 'answered': 0, 'correct': 0},
+                    'lab_report': {
+                        'total': 1, 'answered': 0, 'correct': 0}}}]})
+
+        resp = self.app.get('/v1/quests/1/score')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.app.get('/v1/quests/2/score?user_id=2')
+        self.assertEqual(resp.status_code, 404)
+        resp = self.app.get('/v1/quests/2/scores?organization_id=1')
+        self.assertEqual(resp.status_code, 404)
+
+    @harness.with_sess(user_id=1)
+    def test_quest_answers(self):
+        """Test the paged feed of a quest's answers."""
+        for name in ('snakes', 'ladders', 'chutes "n" ladders'):
+            harness.create_user(name=name)
+        for quest_name in ('mouse', 'house'):
+            resp = self.post_json(
+                    self.url_for(backend.quest_views.QuestList),
+                    {"name": quest_name})
+            self.assertEqual(resp.status_code, 200)
+        # questions 1 and 2 are in quest 1, 3 in quest 2
+        for quest_id, question_group in (
+                (1, 'review_quiz'), (1, 'lab_report'), (2, 'review_quiz')):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.QuestionList,
+                        parent_id=quest_id),
+                    {"question_type": "text", "description": "?",
+                        'question_group': question_group})
+            self.assertEqual(resp.status_code, 200)
+
+        # answers 1-3 by user 1, 4-6 by user 2 and 7-9 by user 3, each
+        # to questions 1, 2 and 3 in turn
+        for user_id in (1, 2, 3):
+            self.update_session(user_id=user_id)
+            for question_id in (1, 2, 3):
+                resp = self.post_json(
+                        self.url_for(
+                            backend.question_views.AnswerList,
+                            parent_id=question_id),
+                        {'answer_text': 'cats, %d' % user_id})
+                self.assertEqual(resp.status_code, 200)
+
+        resp = self.app.get('/v1/quests/1/answers?limit=2')
+        page = json.loads(resp.data)
+        self.assertEqual(page['answers'][0], {
+            'id': 1, 'url': '/v1/questions/1/answers/1',
+            'question_type': 'text', 'answer_text': 'cats, 1',
+            'answer_upload_url': None, 'answer_multiple_choice': None,
+            'question_id': 1, 'question_url': '/v1/questions/1',
+            'question_group': 'review_quiz',
+            'creator_id': 1, 'creator_url': '/v1/users/1',
+            'creator_name': 'snakes'})
+        self.assertEqual(
+                [answer['id'] for answer in page['answers']], [1, 2])
+        self.assertEqual(page['next'], '/v1/quests/1/answers?after=2&limit=2')
+
+        resp = self.app.get(page['next'])
+        page = json.loads(resp.data)
+        self.assertEqual(
+                [answer['id'] for answer in page['answers']], [4, 5])
+        resp = self.app.get('/v1/quests/1/answers?after=5')
+        page = json.loads(resp.data)
+        self.assertEqual(
+                [answer['id'] for answer in page['answers']], [7, 8])
+        self.assertEqual(page['next'], None)
+
+        # filters
+        def answer_ids(query):
+            """Return the ids of the answers in the feed with the given
+            query string.
+            """
+            resp = self.app.get('/v1/quests/1/answers?' + query)
+            self.assertEqual(resp.status_code, 200)
+            return [answer['id'] for
+                    answer in json.loads(resp.data)['answers']]
+
+        self.assertEqual(answer_ids('question_group=lab_report'), [2, 5, 8])
+        self.assertEqual(
+                answer_ids('question_group=lab_report,review_quiz'),
+                [1, 2, 4, 5, 7, 8])
+        self.assertEqual(answer_ids('user_id=2'), [4, 5])
+        resp = self.post_json(
+                self.url_for(backend.organization_views.OrganizationList),
+                {"name": "cats", "description": "meow"})
+        self.assertEqual(resp.status_code, 200)
+        for user_id in (1, 3):
+            self.app.put('/v1/organizations/1/users/%d' % user_id)
+        self.assertEqual(answer_ids('organization_id=1'), [1, 2, 7, 8])
+        self.assertEqual(
+                answer_ids('organization_id=1&question_group=review_quiz'),
+                [1, 7])
+
+        # csv export
+        resp = self.app.get(
+                '/v1/quests/1/answers?format=csv&question_group=review_quiz')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'text/csv')
+        self.assertEqual(resp.data.splitlines(), [
+            'id,question_id,question_group,question_type,creator_id,'
+            'creator_name,answer_text,answer_upload_url,'
+            'answer_multiple_choice',
+            '1,1,review_quiz,text,1,snakes,"cats, 1",,',
+            '4,1,review_quiz,text,2,ladders,"cats, 2",,',
+            '7,1,review_quiz,text,3,"chutes ""n"" ladders","cats, 3",,'])
+
+        resp = self.app.get('/v1/quests/1/answers?limit=101')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.app.get('/v1/quests/1/answers?format=xml')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.app.get('/v1/quests/3/answers')
+        self.assertEqual(resp.status_code, 404)
+        resp = self.app.get('/v1/quests/3/answers?format=csv')
+        self.assertEqual(resp.status_code, 404)
+
+    @harness.with_sess(user_id=1)
+    def test_answer_batch(self):
+        """Test submitting several answers to a quest at once."""
+        harness.create_user(name='snakes')
+        for name in ('mouse', 'house'):
+            resp = self.post_json(
+                    self.url_for(backend.quest_views.QuestList),
+                    {"name": name, "summary": "nap"})
+            self.assertEqual(resp.status_code, 200)
+        # quest 1 has questions 1-2 and quest 2 has question 3
+        for quest_id, question_type in (
+                (1, 'text'), (1, 'multiple_choice'), (2, 'text')):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.QuestionList,
+                        parent_id=quest_id),
+                    {"question_type": question_type, "description": "?",
+                        'question_group': 'review_quiz'})
+            self.assertEqual(resp.status_code, 200)
+        for answer in ('a', 'b'):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.MultipleChoiceList,
+                        parent_id=2),
+                    {'answer': answer, 'is_correct': answer == 'a',
+                        'order': 1})
+            self.assertEqual(resp.status_code, 200)
+
+        resp = self.post_json('/v1/quests/1/answers', {'answers': [
+            {'question_id': 1, 'answer_text': 'cheese'},
+            {'question_id': 2, 'answer_multiple_choice': 2},
+            {'question_id': 2, 'answer_text': 'cheese'},
+            {'question_id': 3, 'answer_text': 'cheese'},
+            {'question_id': 2, 'answer_multiple_choice': 3},
+            {'answer_text': 'cheese'},
+            'cheese',
+            {'question_id': 2, 'answer_multiple_choice': 2}]})
+        self.assertEqual(resp.status_code, 200)
+        results = json.loads(resp.data)['answers']
+        self.assertEqual(
+                [result['status'] for result in results],
+                [200, 200, 400, 404, 404, 400, 400, 200])
+        self.assertEqual(results[0]['answer'], {
+            'id': 1, 'url': '/v1/questions/1/answers/1',
+            'question_type': 'text', 'answer_text': 'cheese',
+            'answer_upload_url': None, 'answer_multiple_choice': None,
+            'question_id': 1, 'question_url': '/v1/questions/1',
+            'creator_id': 1, 'creator_url': '/v1/users/1'})
+        self.assertEqual(
+                results[2]['message'], 'If question_type is multiple_choice, '
+                'the answer_multiple_choice field must only be present.')
+
+        # the saved answers are in the feed, the counts and progress
+        resp = self.app.get('/v1/quests/1/answers')
+        self.assertEqual(
+                [answer['id'] for answer in json.loads(resp.data)['answers']],
+                [1, 2, 3])
+        resp = self.app.get('/v1/questions/2/answer-stats')
+        self.assertEqual(
+                [choice['answer_count'] for choice in
+                    json.loads(resp.data)['multiple_choices']], [0, 2])
+        resp = self.app.get('/v1/users/1/progress')
+        self.assertEqual(json.loads(resp.data)['quests'], [
+            {'quest_id': 1, 'quest_url': '/v1/quests/1',
+                'questions_answered': 2, 'question_count': 2}])
+
+        resp = self.post_json('/v1/quests/1/answers', {'answers': [
+            {'question_id': 1, 'answer_text': 'cheese'}] * 101})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.post_json('/v1/quests/1/answers', {'answers': 'cheese'})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.post_json('/v1/quests/3/answers', {'answers': [
+            {'question_id': 1, 'answer_text': 'cheese'}]})
+        self.assertEqual(resp.status_code, 404)
+        resp = self.post_json('/v1/quests/2/answers', {'answers': []})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data), {'answers': []})
+
+    @harness.with_sess(user_id=1)
+    def test_answer_events(self):
+        """Test streaming events for the answers to a quest."""
+        harness.create_user(name='snakes')
+        for name in ('mouse', 'house'):
+            resp = self.post_json(
+                    self.url_for(backend.quest_views.QuestList),
+                    {"name": name, "summary": "nap"})
+            self.assertEqual(resp.status_code, 200)
+        # quest 1 has question 1 and quest 2 has question 2
+        for quest_id in (1, 2):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.QuestionList,
+                        parent_id=quest_id),
+                    {"question_type": "text", "description": "?",
+                        'question_group': 'review_quiz'})
+            self.assertEqual(resp.status_code, 200)
+
+        resp = self.app.get('/v1/quests/3/answer-events')
+        self.assertEqual(resp.status_code, 404)
+
+        resp = self.app.get('/v1/quests/1/answer-events', buffered=False)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'text/event-stream')
+        events = iter(resp.response)
+        try:
+            # subscribed once the stream starts
+            self.assertEqual(next(events), 'retry: 5000\n\n')
+            for question_id in (2, 1):
+                resp = self.post_json(
+                        '/v1/questions/%d/answers' % question_id,
+                        {'answer_text': 'cheese'})
+                self.assertEqual(resp.status_code, 200)
+
+            lines = next(events).splitlines()
+            self.assertEqual(lines[:2], ['id: 2', 'event: answer'])
+            self.assertEqual(json.loads(lines[2][len('data: '):]), {
+                'id': 2, 'question_id': 1, 'quest_id': 1, 'creator_id': 1})
+        finally:
+            events.close()
+        listener = backend.quest_answer_views.QuestAnswerEvents.listener
+        self.assertNotIn(1, listener.subscribers)
+
+        # clients reconnecting may have missed answers
+        resp = self.app.get(
+                '/v1/quests/1/answer-events', buffered=False,
+                headers={'Last-Event-ID': '2'})
+        events = iter(resp.response)
+        try:
+            self.assertEqual(next(events), 'retry: 5000\n\n')
+            self.assertEqual(next(events), 'event: resync\ndata: {}\n\n')
+        finally:
+            events.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
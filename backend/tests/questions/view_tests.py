@@ -1,10 +1,15 @@
 """Tests for question endpoints."""
 
 
+import datetime
 import json
+import pytz
 import unittest
 
+import sqlalchemy
+
 import backend
+import backend.questions.models as question_models
 import harness
 
 
@@ -38,7 +43,7 @@ class QuestionTest(harness.TestHarness):
         self.assertEqual(json.loads(resp.data), {
             "multiple_choices": [],'question_group': 'lab_report',
             "description": "cat hotel", "question_type": "text",
-            "id": 1, "url": "/v1/quests/1/questions/1",
+            "id": 1, "url": "/v1/quests/1/questions/1", "order": 1,
             "creator_id": 1, "creator_url": "/v1/users/1",
             "quest_id": 1, "quest_url": "/v1/quests/1"})
 
@@ -50,7 +55,7 @@ class QuestionTest(harness.TestHarness):
         self.assertEqual(json.loads(resp.data), {
             "multiple_choices": [],'question_group': 'review_quiz',
             "description": "snake farm", "question_type": "upload",
-            "id": 2, "url": "/v1/quests/1/questions/2",
+            "id": 2, "url": "/v1/quests/1/questions/2", "order": 2,
             "creator_id": 1, "creator_url": "/v1/users/1",
             "quest_id": 1, "quest_url": "/v1/quests/1"})
 
@@ -78,7 +83,7 @@ class QuestionTest(harness.TestHarness):
         self.assertEqual(json.loads(resp.data), {
             "multiple_choices": [], 'question_group': 'lab_report',
             "description": "cat hotel", "question_type": "text",
-            "id": 1, "url": "/v1/quests/1/questions/1",
+            "id": 1, "url": "/v1/quests/1/questions/1", "order": 1,
             "creator_id": 1, "creator_url": "/v1/users/1",
             "quest_id": 1, "quest_url": "/v1/quests/1"})
 
@@ -89,12 +94,12 @@ class QuestionTest(harness.TestHarness):
             backend.question_views.QuestionList, parent_id=1))
         self.assertEqual(json.loads(resp.data)['questions'], [
             {"description": "cat hotel", "question_type": "text",
-                "id": 1, "url": "/v1/quests/1/questions/1",
+                "id": 1, "url": "/v1/quests/1/questions/1", "order": 1,
                 "creator_id": 1, "creator_url": "/v1/users/1",
                 "multiple_choices": [], 'question_group': 'lab_report',
                 "quest_id": 1, "quest_url": "/v1/quests/1"},
             {"description": "snake farm", "question_type": "upload",
-                "id": 2, "url": "/v1/quests/1/questions/2",
+                "id": 2, "url": "/v1/quests/1/questions/2", "order": 2,
                 "creator_id": 1, "creator_url": "/v1/users/1",
                 "multiple_choices": [], 'question_group': 'review_quiz',
                 "quest_id": 1, "quest_url": "/v1/quests/1"}])
@@ -109,7 +114,7 @@ class QuestionTest(harness.TestHarness):
             parent_id=1, question_group='lab_report'))
         self.assertEqual(json.loads(resp.data)['questions'], [
             {"description": "cat hotel", "question_type": "text",
-                "id": 1, "url": "/v1/quests/1/questions/1",
+                "id": 1, "url": "/v1/quests/1/questions/1", "order": 1,
                 "creator_id": 1, "creator_url": "/v1/users/1",
                 "multiple_choices": [], 'question_group': 'lab_report',
                 "quest_id": 1, "quest_url": "/v1/quests/1"}])
@@ -119,7 +124,7 @@ class QuestionTest(harness.TestHarness):
             parent_id=1, question_group='lab_report,closing_questions'))
         self.assertEqual(json.loads(resp.data)['questions'], [
             {"description": "cat hotel", "question_type": "text",
-                "id": 1, "url": "/v1/quests/1/questions/1",
+                "id": 1, "url": "/v1/quests/1/questions/1", "order": 1,
                 "creator_id": 1, "creator_url": "/v1/users/1",
                 "multiple_choices": [], 'question_group': 'lab_report',
                 "quest_id": 1, "quest_url": "/v1/quests/1"}])
@@ -129,12 +134,12 @@ class QuestionTest(harness.TestHarness):
             parent_id=1, question_group='lab_report,review_quiz'))
         self.assertEqual(json.loads(resp.data)['questions'], [
             {"description": "cat hotel", "question_type": "text",
-                "id": 1, "url": "/v1/quests/1/questions/1",
+                "id": 1, "url": "/v1/quests/1/questions/1", "order": 1,
                 "creator_id": 1, "creator_url": "/v1/users/1",
                 "multiple_choices": [], 'question_group': 'lab_report',
                 "quest_id": 1, "quest_url": "/v1/quests/1"},
             {"description": "snake farm", "question_type": "upload",
-                "id": 2, "url": "/v1/quests/1/questions/2",
+                "id": 2, "url": "/v1/quests/1/questions/2", "order": 2,
                 "creator_id": 1, "creator_url": "/v1/users/1",
                 "multiple_choices": [], 'question_group': 'review_quiz',
                 "quest_id": 1, "quest_url": "/v1/quests/1"}])
@@ -155,7 +160,7 @@ class QuestionTest(harness.TestHarness):
         resp = self.app.get("/v1/questions/1")
         self.assertEqual(json.loads(resp.data), {
             "description": "cat hotel", "question_type": "text",
-            "id": 1, "url": "/v1/quests/1/questions/1",
+            "id": 1, "url": "/v1/quests/1/questions/1", "order": 1,
             "creator_id": 1, "creator_url": "/v1/users/1",
             "multiple_choices": [], 'question_group': 'lab_report',
             "quest_id": 1, "quest_url": "/v1/quests/1"})
@@ -186,7 +191,7 @@ class QuestionTest(harness.TestHarness):
         resp = self.app.get("/v1/quests/1/questions/1")
         self.assertEqual(json.loads(resp.data), {
             "description": "a blue house", "question_type": "text",
-            "id": 1, "url": "/v1/quests/1/questions/1",
+            "id": 1, "url": "/v1/quests/1/questions/1", "order": 1,
             "creator_id": 1, "creator_url": "/v1/users/1",
             "multiple_choices": [], 'question_group': 'review_quiz',
             "quest_id": 1, "quest_url": "/v1/quests/1"})
@@ -590,6 +595,380 @@ class QuestionTest(harness.TestHarness):
                     question_id=1, multiple_choice_id=2))
         self.assertEqual(resp.status_code, 404)
 
+    @harness.with_sess(user_id=1)
+    def test_answer_stats(self):
+        """Test counting the answers picking each choice."""
+        harness.create_user(name='snakes')
+        resp = self.post_json(
+                self.url_for(backend.quest_views.QuestList),
+                {"name": "mouse", "summary": "nap"})
+        self.assertEqual(resp.status_code, 200)
+        for question_type in ('multiple_choice', 'multiple_choice', 'text'):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.QuestionList, parent_id=1),
+                    {"question_type": question_type, "description": "?",
+                        'question_group': 'review_quiz'})
+            self.assertEqual(resp.status_code, 200)
+        for question_id, answer in ((1, 'a'), (1, 'b'), (2, 'c')):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.MultipleChoiceList,
+                        parent_id=question_id),
+                    {'answer': answer, 'is_correct': answer == 'a',
+                        'order': 1})
+            self.assertEqual(resp.status_code, 200)
+
+        def answer(question_id, choice_id):
+            """Answer a question with the given choice."""
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.AnswerList,
+                        parent_id=question_id),
+                    {'answer_multiple_choice': choice_id})
+            self.assertEqual(resp.status_code, 200)
+            return json.loads(resp.data)['id']
+
+        answer(1, 1)
+        changed_answer = answer(1, 1)
+        deleted_answer = answer(1, 2)
+        answer(2, 3)
+        resp = self.put_json(
+                '/v1/questions/1/answers/%d' % changed_answer,
+                {'answer_multiple_choice': 2})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.app.delete('/v1/questions/1/answers/%d' % deleted_answer)
+        self.assertEqual(resp.status_code, 200)
+
+        question_stats = {
+            'question_id': 1, 'question_url': '/v1/questions/1',
+            'answer_count': 2, 'multiple_choices': [
+                {'id': 1, 'url': '/v1/questions/1/multiple_choices/1',
+                    'answer': 'a', 'is_correct': True, 'answer_count': 1},
+                {'id': 2, 'url': '/v1/questions/1/multiple_choices/2',
+                    'answer': 'b', 'is_correct': False, 'answer_count': 1}]}
+        resp = self.app.get('/v1/questions/1/answer-stats')
+        self.assertEqual(json.loads(resp.data), question_stats)
+
+        # choices made before counting began are counted from scratch
+        question_models.ChoiceCount.query.filter_by(
+                multiple_choice_id=3).delete()
+        backend.db.session.commit()
+        answer(2, 3)
+        resp = self.app.get('/v1/quests/1/answer-stats')
+        self.assertEqual(json.loads(resp.data), {
+            'quest_id': 1, 'questions': [question_stats, {
+                'question_id': 2, 'question_url': '/v1/questions/2',
+                'answer_count': 2, 'multiple_choices': [
+                    {'id': 3, 'url': '/v1/questions/2/multiple_choices/3',
+                        'answer': 'c', 'is_correct': False,
+                        'answer_count': 2}]}]})
+
+        # and counted when the tables are created
+        question_models.ChoiceCount.query.filter_by(question_id=1).delete()
+        backend.db.session.commit()
+        backend.db.create_all()
+        resp = self.app.get('/v1/questions/1/answer-stats')
+        self.assertEqual(json.loads(resp.data), question_stats)
+
+        resp = self.app.get('/v1/questions/3/answer-stats')
+        self.assertEqual(json.loads(resp.data), {
+            'question_id': 3, 'question_url': '/v1/questions/3',
+            'answer_count': 0, 'multiple_choices': []})
+        resp = self.app.get('/v1/questions/4/answer-stats')
+        self.assertEqual(resp.status_code, 404)
+        resp = self.app.get('/v1/quests/2/answer-stats')
+        self.assertEqual(resp.status_code, 404)
+
+    @harness.with_sess(user_id=1)
+    def test_multiple_choice_order(self):
+        """Test reordering a question's multiple choices."""
+        harness.create_user(name='snakes')
+        resp = self.post_json(
+                self.url_for(backend.quest_views.QuestList),
+                {"name": "mouse", "summary": "nap"})
+        self.assertEqual(resp.status_code, 200)
+        for _ in range(2):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.QuestionList, parent_id=1),
+                    {"question_type": "multiple_choice", "description": "?",
+                        'question_group': 'review_quiz'})
+            self.assertEqual(resp.status_code, 200)
+        for question_id, answer in ((1, 'a'), (1, 'b'), (1, 'c'), (2, 'd')):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.MultipleChoiceList,
+                        parent_id=question_id),
+                    {'answer': answer, 'is_correct': False, 'order': 1})
+            self.assertEqual(resp.status_code, 200)
+
+        url = self.url_for(
+                backend.question_views.MultipleChoiceOrder, question_id=1)
+        resp = self.put_json(url, {'multiple_choice_ids': [3, 1, 2]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+                [(choice['id'], choice['answer'], choice['order']) for
+                    choice in json.loads(resp.data)['multiple_choices']],
+                [(3, 'c', 1), (1, 'a', 2), (2, 'b', 3)])
+        resp = self.app.get(self.url_for(
+            backend.question_views.MultipleChoiceList, parent_id=1))
+        self.assertEqual(
+                [choice['answer'] for choice in
+                    json.loads(resp.data)['multiple_choices']],
+                ['c', 'a', 'b'])
+
+        # every choice of the question must be listed once
+        for choice_ids in ([3, 1], [3, 1, 2, 4], [3, 1, 1, 2], 'abc'):
+            resp = self.put_json(url, {'multiple_choice_ids': choice_ids})
+            self.assertEqual(resp.status_code, 400)
+        resp = self.put_json(
+                self.url_for(
+                    backend.question_views.MultipleChoiceOrder, question_id=3),
+                {'multiple_choice_ids': []})
+        self.assertEqual(resp.status_code, 404)
+
+    @harness.with_sess(user_id=1)
+    def test_question_order(self):
+        """Test the order of a quest's questions."""
+        harness.create_user(name='snakes')
+        for _ in range(2):
+            resp = self.post_json(
+                    self.url_for(backend.quest_views.QuestList),
+                    {"name": "mouse", "summary": "nap"})
+            self.assertEqual(resp.status_code, 200)
+        for quest_id, question_group in (
+                (1, 'review_quiz'), (1, 'lab_report'), (2, 'lab_report'),
+                (1, 'review_quiz')):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.QuestionList,
+                        parent_id=quest_id),
+                    {"question_type": "text", "description": "?",
+                        'question_group': question_group})
+            self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data)['order'], 3)
+
+        def orders(query_string=''):
+            """Return the (id, order) of quest 1's questions, in order."""
+            resp = self.app.get('/v1/quests/1/questions' + query_string)
+            self.assertEqual(resp.status_code, 200)
+            return [(question['id'], question['order']) for
+                    question in json.loads(resp.data)['questions']]
+
+        self.assertEqual(orders(), [(1, 1), (2, 2), (4, 3)])
+
+        url = self.url_for(backend.question_views.QuestionOrder, quest_id=1)
+        resp = self.put_json(url, {'question_ids': [4, 2, 1]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+                [(question['id'], question['order']) for
+                    question in json.loads(resp.data)['questions']],
+                [(4, 1), (2, 2), (1, 3)])
+        self.assertEqual(orders(), [(4, 1), (2, 2), (1, 3)])
+        self.assertEqual(
+                orders('?question_group=review_quiz'), [(4, 1), (1, 3)])
+
+        # every question of the quest must be listed once
+        for question_ids in ([4, 2], [4, 2, 1, 3], [4, 2, 2, 1], 'abc'):
+            resp = self.put_json(url, {'question_ids': question_ids})
+            self.assertEqual(resp.status_code, 400)
+        resp = self.put_json(
+                self.url_for(
+                    backend.question_views.QuestionOrder, quest_id=3),
+                {'question_ids': []})
+        self.assertEqual(resp.status_code, 404)
+
+    @harness.with_sess(user_id=1)
+    def test_answer_choice_constraint(self):
+        """Answers may only pick choices of their own question, and lose
+        their choice when it is deleted.
+        """
+        harness.create_user(name='snakes')
+        resp = self.post_json(
+                self.url_for(backend.quest_views.QuestList),
+                {"name": "mouse", "summary": "nap"})
+        self.assertEqual(resp.status_code, 200)
+        for question_id in (1, 2):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.QuestionList, parent_id=1),
+                    {"question_type": "multiple_choice", "description": "?",
+                        'question_group': 'review_quiz'})
+            self.assertEqual(resp.status_code, 200)
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.MultipleChoiceList,
+                        parent_id=question_id),
+                    {'answer': 'a', 'is_correct': True, 'order': 1})
+            self.assertEqual(resp.status_code, 200)
+
+        resp = self.post_json(
+                '/v1/questions/1/answers', {"answer_multiple_choice": 2})
+        self.assertEqual(resp.status_code, 404)
+        resp = self.post_json(
+                '/v1/questions/1/answers', {"answer_multiple_choice": 1})
+        self.assertEqual(resp.status_code, 200)
+        answer_url = json.loads(resp.data)['url']
+        resp = self.put_json(answer_url, {"answer_multiple_choice": 2})
+        self.assertEqual(resp.status_code, 404)
+
+        resp = self.app.delete('/v1/questions/1/multiple_choices/1')
+        self.assertEqual(resp.status_code, 200)
+        resp = self.app.get(answer_url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsNone(json.loads(resp.data)['answer_multiple_choice'])
+
+    @harness.with_sess(user_id=1)
+    def test_latest_answer(self):
+        """Test keeping a learner's latest answer in place."""
+        harness.create_user(name='snakes')
+        harness.create_user(name='ladders')
+        resp = self.post_json(
+                self.url_for(backend.quest_views.QuestList),
+                {"name": "mouse", "summary": "nap"})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.post_json(
+                self.url_for(backend.question_views.QuestionList, parent_id=1),
+                {"question_type": "multiple_choice", "description": "?",
+                    'question_group': 'review_quiz'})
+        self.assertEqual(resp.status_code, 200)
+        for answer in ('a', 'b'):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.MultipleChoiceList,
+                        parent_id=1),
+                    {'answer': answer, 'is_correct': answer == 'a',
+                        'order': 1})
+            self.assertEqual(resp.status_code, 200)
+
+        def answer(choice_id, status_code=200):
+            """Submit the given choice in latest answer mode."""
+            resp = self.post_json(
+                    '/v1/questions/1/answers?latest=true',
+                    {'answer_multiple_choice': choice_id})
+            self.assertEqual(resp.status_code, status_code)
+            if status_code == 200:
+                return json.loads(resp.data)
+
+        # resubmitting updates the same answer
+        self.assertEqual(answer(1)['id'], 1)
+        self.assertEqual(answer(2), {
+            'id': 1, 'url': '/v1/questions/1/answers/1',
+            'question_type': 'multiple_choice', 'answer_text': None,
+            'answer_upload_url': None, 'answer_multiple_choice': 2,
+            'question_id': 1, 'question_url': '/v1/questions/1',
+            'creator_id': 1, 'creator_url': '/v1/users/1'})
+        answer(3, 404)
+        resp = self.app.get('/v1/questions/1/answers')
+        self.assertEqual(
+                [(row['id'], row['answer_multiple_choice']) for
+                    row in json.loads(resp.data)['answers']], [(1, 2)])
+        resp = self.app.get('/v1/questions/1/answer-stats')
+        self.assertEqual(
+                [choice['answer_count'] for choice in
+                    json.loads(resp.data)['multiple_choices']], [0, 1])
+        resp = self.app.get('/v1/users/1/progress')
+        self.assertEqual(
+                json.loads(resp.data)['quests'][0]['questions_answered'], 1)
+
+        # every submission is kept in the history, partitioned by month
+        history = question_models.answer_history
+        self.assertEqual(sorted(backend.db.session.execute(
+            sqlalchemy.select([
+                history.c.answer_id, history.c.answer_multiple_choice]))),
+            [(1, 1), (1, 2)])
+        self.assertEqual(backend.db.session.execute(
+            "SELECT count(*) FROM ONLY answer_history").scalar(), 0)
+        self.assertEqual(backend.db.session.execute(
+            "SELECT count(*) FROM pg_inherits "
+            "WHERE inhparent = 'answer_history'::regclass").scalar(), 1)
+        backend.db.session.commit()
+
+        # other learners and answers outside of the mode are separate
+        self.update_session(user_id=2)
+        self.assertEqual(answer(1)['id'], 2)
+        resp = self.post_json(
+                '/v1/questions/1/answers', {'answer_multiple_choice': 1})
+        self.assertEqual(json.loads(resp.data)['id'], 3)
+        self.assertEqual(answer(2)['id'], 2)
+
+        resp = self.post_json(
+                '/v1/questions/1/answers?latest=maybe',
+                {'answer_multiple_choice': 1})
+        self.assertEqual(resp.status_code, 400)
+        resp = self.post_json(
+                '/v1/questions/2/answers?latest=true',
+                {'answer_multiple_choice': 1})
+        self.assertEqual(resp.status_code, 404)
+
+    @harness.with_sess(user_id=1)
+    def test_sync(self):
+        """Test syncing the changes to a quest's questions."""
+        harness.create_user(name='snakes')
+        resp = self.post_json(
+                self.url_for(backend.quest_views.QuestList),
+                {"name": "mouse", "summary": "nap"})
+        self.assertEqual(resp.status_code, 200)
+        for question_group in ('review_quiz', 'review_quiz', 'lab_report'):
+            resp = self.post_json(
+                    self.url_for(
+                        backend.question_views.QuestionList, parent_id=1),
+                    {"question_type": "text", "description": "?",
+                        'question_group': question_group})
+            self.assertEqual(resp.status_code, 200)
+
+        def sync(since, query=''):
+            """Return the questions changed since the given time."""
+            resp = self.app.get(
+                    '/v1/quests/1/questions?updated_since=%s%s' % (
+                        since, query))
+            self.assertEqual(resp.status_code, 200)
+            return json.loads(resp.data)
+
+        first_sync = sync('2000-01-01T00:00:00Z')
+        self.assertEqual(
+                [question['id'] for question in first_sync['questions']],
+                [1, 2, 3])
+        self.assertEqual(first_sync['deleted'], [])
+
+        # writes are stamped with the time their transaction began, so
+        # stand in for a sync made a while after these ones
+        question_models.Question.query.update({
+            'created_at': datetime.datetime(2000, 1, 1, tzinfo=pytz.utc),
+            'updated_at': datetime.datetime(2000, 1, 1, tzinfo=pytz.utc)},
+            synchronize_session=False)
+        backend.db.session.commit()
+        since = '2000-01-02T00:00:00'
+        unchanged = sync(since)
+        self.assertEqual(unchanged['questions'], [])
+        self.assertEqual(unchanged['deleted'], [])
+        self.assertIn('synced_at', unchanged)
+
+        resp = self.put_json(
+                '/v1/quests/1/questions/2',
+                {"description": "why?", 'question_group': 'review_quiz'})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.put_json(
+                '/v1/quests/1/questions/order', {'question_ids': [3, 2, 1]})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.app.delete('/v1/quests/1/questions/1')
+        self.assertEqual(resp.status_code, 200)
+
+        changes = sync(since)
+        self.assertEqual(
+                [(question['id'], question['order']) for
+                    question in changes['questions']], [(2, 2), (3, 1)])
+        self.assertEqual(changes['deleted'], [1])
+        self.assertEqual(
+                [question['id'] for question in sync(
+                    since, '&question_group=lab_report')['questions']], [3])
+
+        resp = self.app.get('/v1/quests/1/questions?updated_since=soon')
+        self.assertEqual(resp.status_code, 400)
+        resp = self.app.get('/v1/quests/2/questions?updated_since=2000-01-01')
+        self.assertEqual(resp.status_code, 404)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,6 +2,7 @@
 
 
 import flask
+import io
 import json
 import unittest
 
@@ -391,6 +392,303 @@ class QuestTest(harness.TestHarness):
                 self.url_for(backend.quest_views.Tag, tag_id=1), {'name': 'c'})
         self.assertEqual(resp.status_code, 404)
 
+    @harness.with_sess(user_id=1)
+    def test_import(self):
+        """Test bulk imports of JSON and CSV bundles."""
+        harness.create_user(name="snakes")
+        resp = self.post_json(
+                self.url_for(backend.quest_views.TagList), {"name": "a"})
+        self.assertEqual(resp.status_code, 200)
+
+        url = self.url_for(backend.quest_views.QuestImport)
+        resp = self.post_json(url, {"quests": [
+            {"name": "mouse", "summary": "hat", "tags": ["a", "b", "b"],
+                "inquiry_questions": ["why?", "tab\there", "line\nbreak"],
+                "video_links": ["back\\slash", "\"quoted\", {comma}"],
+                "min_grade_level": 3,
+                "questions": [
+                    {"description": "which?", "question_type":
+                        "multiple_choice", "question_group": "review_quiz",
+                        "multiple_choices": [
+                            {"answer": "this", "is_correct": True,
+                                "order": 1},
+                            {"answer": "that", "is_correct": False,
+                                "order": 2}]},
+                    {"description": "how?", "question_type": "text",
+                        "question_group": "lab_report"}]},
+            {"name": "cat", "tags": ["b"]}]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data), {
+            "quests": [
+                {"ref": "quests[0]", "id": 1, "url": "/v1/quests/1"},
+                {"ref": "quests[1]", "id": 2, "url": "/v1/quests/2"}],
+            "tags_created": 1,
+            "question_count": 2,
+            "multiple_choice_count": 2})
+
+        resp = self.app.get(self.url_for(backend.quest_views.Quest, quest_id=1))
+        quest = json.loads(resp.data)
+        self.assertEqual(quest['name'], 'mouse')
+        # list elements keep their tabs, newlines, backslashes and quotes
+        self.assertEqual(
+                quest['inquiry_questions'],
+                ['why?', 'tab\there', 'line\nbreak'])
+        self.assertEqual(
+                quest['video_links'], ['back\\slash', '"quoted", {comma}'])
+        self.assertEqual(quest['min_grade_level'], 3)
+        self.assertEqual(quest['creator_id'], 1)
+        self.assertItemsEqual(quest['tags'], [
+            {'name': 'a', 'id': 1, 'url': '/v1/quest-tags/1'},
+            {'name': 'b', 'id': 2, 'url': '/v1/quest-tags/2'}])
+
+        resp = self.app.get('/v1/quests/1/questions')
+        questions = json.loads(resp.data)['questions']
+        self.assertEqual(
+                [(question['description'], question['order']) for
+                    question in questions],
+                [('which?', 1), ('how?', 2)])
+        self.assertEqual([(choice['answer'], choice['is_correct']) for
+            choice in questions[0]['multiple_choices']],
+            [('this', True), ('that', False)])
+
+        # imported choices can be answered and counted
+        choice_id = questions[0]['multiple_choices'][0]['id']
+        resp = self.post_json(
+                '/v1/questions/%d/answers' % questions[0]['id'],
+                {"answer_multiple_choice": choice_id})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.app.get('/v1/questions/%d/answer-stats' % (
+            questions[0]['id']))
+        self.assertEqual(
+                json.loads(resp.data)['multiple_choices'][0]['answer_count'],
+                1)
+
+        # CSV files refer to each other by ref
+        resp = self.app.post(url, data={
+            'quests': (io.BytesIO(
+                'ref,name,tags,video_links\n'
+                'q,dog,"[""a""]","[""v.mp4""]"\n'), 'quests.csv'),
+            'questions': (io.BytesIO(
+                'ref,quest_ref,description,question_type,question_group\n'
+                'x,q,"tabs\tand, commas",multiple_choice,review_quiz\n'),
+                'questions.csv'),
+            'multiple_choices': (io.BytesIO(
+                'question_ref,answer,is_correct,order\n'
+                'x,"back\\slash",false,1\n'), 'multiple_choices.csv')})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(json.loads(resp.data)['quests'], [
+            {"ref": "q", "id": 3, "url": "/v1/quests/3"}])
+
+        resp = self.app.get('/v1/quests/3/questions')
+        question = json.loads(resp.data)['questions'][0]
+        self.assertEqual(question['description'], 'tabs\tand, commas')
+        self.assertEqual(
+                [(choice['answer'], choice['is_correct']) for
+                    choice in question['multiple_choices']],
+                [('back\\slash', False)])
+        resp = self.app.get(self.url_for(backend.quest_views.Quest, quest_id=3))
+        self.assertEqual(json.loads(resp.data)['video_links'], ['v.mp4'])
+
+    @harness.with_sess(user_id=1)
+    def test_import_errors(self):
+        """Bundles with invalid rows import nothing and say what was
+        wrong with each row.
+        """
+        harness.create_user(name="snakes")
+        url = self.url_for(backend.quest_views.QuestImport)
+        resp = self.post_json(url, {"quests": [
+            {"name": "mouse", "min_grade_level": "three"},
+            {"name": "cat", "tags": "b", "questions": [
+                {"description": "how?", "question_type": "text",
+                    "question_group": "lab_report", "multiple_choices": [
+                        {"answer": "this", "is_correct": True,
+                            "order": 1}]},
+                {"description": "why?", "question_type": "essay",
+                    "question_group": "lab_report"}]},
+            {"name": "dog", "questions": "none"}]})
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(
+                [error['row'] for error in json.loads(resp.data)['errors']],
+                ['quests[2]', 'quests[0]', 'quests[1]',
+                    'quests[1].questions[1]',
+                    'quests[1].questions[0].multiple_choices[0]'])
+
+        resp = self.app.post(url, data={
+            'quests': (io.BytesIO('ref,name\nq,dog\nq,cat\n'), 'quests.csv'),
+            'questions': (io.BytesIO(
+                'ref,quest_ref,description,question_type,question_group\n'
+                'x,z,how?,text,review_quiz\n'), 'questions.csv')})
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(json.loads(resp.data)['errors'], [
+            {'row': 'quests.csv line 3', 'message': 'Duplicate ref q'},
+            {'row': 'questions.csv line 2',
+                'message': 'Unknown quest_ref z'}])
+
+        self.assertEqual(self.app.get('/v1/quests/1').status_code, 404)
+        resp = self.app.get(self.url_for(backend.quest_views.TagList))
+        self.assertEqual(json.loads(resp.data), {'tags': []})
+
+    @harness.with_sess(user_id=1)
+    def test_clone(self):
+        """Test deep copies of quests."""
+        harness.create_user(name="snakes")
+        harness.create_user(name="ladders")
+        resp = self.post_json(
+                self.url_for(backend.quest_views.QuestImport), {"quests": [
+                    {"name": "mouse", "summary": "hat", "tags": ["a", "b"],
+                        "video_links": ["v.mp4"], "questions": [
+                            {"description": "which?",
+                                "question_type": "multiple_choice",
+                                "question_group": "review_quiz",
+                                "multiple_choices": [
+                                    {"answer": "this", "is_correct": True,
+                                        "order": 2},
+                                    {"answer": "that", "is_correct": False,
+                                        "order": 1}]},
+                            {"description": "how?", "question_type": "text",
+                                "question_group": "lab_report"}]}]})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.post_json('/v1/questions/2/answers', {"answer_text": "so"})
+        self.assertEqual(resp.status_code, 200)
+        original = json.loads(self.app.get('/v1/quests/1').data)
+        original_questions = json.loads(
+                self.app.get('/v1/quests/1/questions').data)
+
+        self.update_session(user_id=2)
+        url = self.url_for(backend.quest_views.QuestClone, quest_id=1)
+        resp = self.app.post(url)
+        self.assertEqual(resp.status_code, 200)
+        clone = json.loads(resp.data)
+        self.assertEqual(clone['id'], 2)
+        self.assertEqual(clone['creator_id'], 2)
+        for field in ('name', 'summary', 'video_links', 'inquiry_questions'):
+            self.assertEqual(clone[field], original[field])
+        self.assertItemsEqual(clone['tags'], original['tags'])
+        self.assertEqual(json.loads(self.app.get('/v1/quests/2').data), clone)
+
+        questions = json.loads(
+                self.app.get('/v1/quests/2/questions').data)['questions']
+        self.assertEqual([question['id'] for question in questions], [3, 4])
+        self.assertEqual(
+                [question['description'] for question in questions],
+                ['which?', 'how?'])
+        self.assertEqual(
+                [(choice['answer'], choice['is_correct'], choice['order'],
+                    choice['creator_id']) for
+                    choice in questions[0]['multiple_choices']],
+                [('that', False, 1, 2), ('this', True, 2, 2)])
+        self.assertNotIn(
+                questions[0]['multiple_choices'][0]['id'], (1, 2))
+
+        # answers stay with the original
+        resp = self.app.get('/v1/quests/2/answers')
+        self.assertEqual(json.loads(resp.data)['answers'], [])
+        resp = self.app.get('/v1/questions/3/answer-stats')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+                json.loads(self.app.get('/v1/quests/1/questions').data),
+                original_questions)
+
+        # the copy may be renamed
+        resp = self.post_json(url, {"name": "house"})
+        self.assertEqual(json.loads(resp.data)['name'], 'house')
+        self.assertEqual(json.loads(resp.data)['id'], 3)
+
+        resp = self.app.post(
+                self.url_for(backend.quest_views.QuestClone, quest_id=10))
+        self.assertEqual(resp.status_code, 404)
+
+    @harness.with_sess(user_id=1)
+    def test_clone_sync(self):
+        """Test clones of old quests are synced to their creators."""
+        harness.create_user(name="snakes")
+        resp = self.post_json(
+                self.url_for(backend.quest_views.QuestList), {"name": "mouse"})
+        self.assertEqual(resp.status_code, 200)
+        backend.db.session.execute(
+                "UPDATE quests SET created_at = '2001-01-01', "
+                "updated_at = '2001-01-01'")
+        backend.db.session.commit()
+
+        resp = self.app.post(
+                self.url_for(backend.quest_views.QuestClone, quest_id=1))
+        self.assertEqual(resp.status_code, 200)
+        resp = self.app.get('/v1/users/1/quests?updated_since=2010-01-01')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+                [quest['id'] for quest in json.loads(resp.data)['quests']],
+                [2])
+
+    @harness.with_sess(user_id=1)
+    def test_mission_quest_order(self):
+        """Test ordering and bulk linking of a mission's quests."""
+        harness.create_user(name="snakes")
+        for name in ('a', 'b', 'c', 'd'):
+            resp = self.post_json(
+                    self.url_for(backend.quest_views.QuestList),
+                    {"name": name})
+            self.assertEqual(resp.status_code, 200)
+        resp = self.post_json(
+                self.url_for(backend.mission_views.MissionList),
+                {"name": "cheese", "description": "hunt", "points": 3})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.post_json(
+                self.url_for(
+                    backend.question_views.QuestionList, parent_id=4),
+                {"question_type": "text", "description": "why?",
+                    'question_group': 'review_quiz'})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.post_json('/v1/questions/1/answers', {"answer_text": "so"})
+        self.assertEqual(resp.status_code, 200)
+
+        url = self.url_for(
+                backend.quest_views.QuestMissionLinkList, mission_id=1)
+
+        def names():
+            """Return the names of the mission's quests, in order."""
+            resp = self.app.get(url)
+            self.assertEqual(resp.status_code, 200)
+            return [quest['name'] for quest in json.loads(resp.data)['quests']]
+
+        # quests linked one at a time go on the end
+        self.app.put('/v1/missions/1/quests/2')
+        self.app.put('/v1/missions/1/quests/1')
+        self.assertEqual(names(), ['b', 'a'])
+
+        resp = self.put_json(url, {"quest_ids": [3, 1, 2]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+                [quest['name'] for quest in json.loads(resp.data)['quests']],
+                ['c', 'a', 'b'])
+        self.assertEqual(names(), ['c', 'a', 'b'])
+
+        resp = self.put_json(url, {"quest_ids": [4, 2]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(names(), ['d', 'b'])
+        self.app.put('/v1/missions/1/quests/1')
+        self.assertEqual(names(), ['d', 'b', 'a'])
+
+        # linked quests count towards the mission's progress
+        resp = self.app.get('/v1/users/1/progress')
+        self.assertEqual(json.loads(resp.data)['missions'], [
+            {'mission_id': 1, 'mission_url': '/v1/missions/1',
+                'questions_answered': 1, 'question_count': 1}])
+        resp = self.put_json(url, {"quest_ids": [1]})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.app.get('/v1/users/1/progress')
+        self.assertEqual(json.loads(resp.data)['missions'], [])
+
+        for quest_ids in ([1, 1], [1, 5], "a"):
+            resp = self.put_json(url, {"quest_ids": quest_ids})
+            self.assertEqual(resp.status_code, 400)
+        self.assertEqual(names(), ['a'])
+
+        resp = self.put_json(
+                self.url_for(
+                    backend.quest_views.QuestMissionLinkList, mission_id=2),
+                {"quest_ids": [1]})
+        self.assertEqual(resp.status_code, 404)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -130,6 +130,60 @@ class S3Test(harness.TestHarness):
                     quest_id='4', file_name='a'))
         self.assertEqual(resp.status_code, 200)
 
+    @harness.with_sess(user_id=1)
+    @mock.patch.object(quest_views.s3, 'get_bucket')
+    def test_asset_clone(self, m_get_bucket):
+        """Test copying assets along with a quest."""
+        copies = []
+
+        class FakeBucket(object):
+            """Mock object for an S3 bucket."""
+            name = 'bucket'
+
+            @staticmethod
+            def list(prefix):
+                """Mock list method on the bucket."""
+                return [boto.s3.key.Key(name=name) for name in (
+                    prefix, prefix + 'a.png', prefix + 'b.mp4')]
+
+            @staticmethod
+            def copy_key(new_key_name, src_bucket_name, src_key_name,
+                    headers):
+                """Record the copy."""
+                copies.append((
+                    new_key_name, src_bucket_name, src_key_name, headers))
+
+        m_get_bucket.return_value = FakeBucket()
+
+        harness.create_user(name='snakes')
+        resp = self.post_json(self.url_for(quest_views.QuestList), {
+            'name': 'mouse',
+            'icon_url': 'http://clouds.cloudfront.net/quests/1/a.png',
+            'video_links': [
+                'https://bucket.s3.amazonaws.com/quests/1/b.mp4',
+                'youtube.com/clouds.mp4']})
+        self.assertEqual(resp.status_code, 200)
+
+        # assets are only copied when asked for
+        url = self.url_for(quest_views.QuestClone, quest_id=1)
+        resp = self.app.post(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(copies, [])
+
+        resp = self.post_json(url, {'copy_assets': True})
+        self.assertEqual(resp.status_code, 200)
+        acl = {'x-amz-acl': 'public-read'}
+        self.assertEqual(copies, [
+            ('quests/3/a.png', 'bucket', 'quests/1/a.png', acl),
+            ('quests/3/b.mp4', 'bucket', 'quests/1/b.mp4', acl)])
+        clone = json.loads(resp.data)
+        self.assertEqual(
+                clone['icon_url'],
+                'http://clouds.cloudfront.net/quests/3/a.png')
+        self.assertEqual(clone['video_links'], [
+            'https://bucket.s3.amazonaws.com/quests/3/b.mp4',
+            'youtube.com/clouds.mp4'])
+
     @mock.patch.object(s3, 'get_conn')
     def test_get_bucket(self, m_get_conn):
         """Test the get_bucket function."""